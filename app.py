@@ -1,141 +1,82 @@
+import hashlib
+import os
+import tempfile
+
 import streamlit as st
-import re
-import random
-
-# --- 設定: 仮想的なアルゴリズムの重み (公開情報を元にした近似値) ---
-WEIGHTS = {
-    "like": 0.5,
-    "retweet": 1.0,
-    "reply": 13.5,  # 対話は非常に重い
-    "image": 2.0,   # メディアがある場合の係数（ブースト）
-    "video": 2.0,
-    "link": -1.0,   # リンク付きは減点傾向（リプライ誘導推奨）
-}
 
-st.set_page_config(page_title="X Algo Pipeline Sim", layout="wide")
+from engagement_model import get_engagement_predictor
+from image_hydration import read_image_bytes
+from log_codes import render_log
+from model_registry import REGISTRY
+from model_variants import resolve_variant
+from profiling import MODES, PROFILE_MODE, PROFILE_PREFIX, Profiler
+from pipeline import (
+    WEIGHTS,
+    PostCandidate,
+    analyze_post,
+    compute_engagement_score,
+    rank_tier,
+    stage_4_filtering_visibility,
+)
+from timings import STAGE_TIMINGS
+from visibility import get_clip_batcher
+
+# STAGE 1〜3 の結果キャッシュの最大件数 (全セッション共有)
+ANALYSIS_CACHE_SIZE = 4096
 
-# --- クラス定義: パイプラインの各ステージ ---
+# 画像セーフティ判定に使う CLIP モデルのローカルディレクトリ (未設定なら判定しない)
+CLIP_MODEL_DIR = os.environ.get("XSCORER_CLIP_MODEL_DIR")
+# エンゲージメント予測に使うテキストモデルのローカルディレクトリ (未設定なら手入力のみ)
+ENGAGEMENT_MODEL_DIR = os.environ.get("XSCORER_ENGAGEMENT_MODEL_DIR")
+
+st.set_page_config(page_title="X Algo Pipeline Sim", layout="wide")
 
-class PostCandidate:
-    def __init__(self, text, has_media, is_premium, follower_count):
-        self.text = text
-        self.has_media = has_media
-        self.is_premium = is_premium
-        self.follower_count = follower_count
-        self.flags = []
-        self.score_breakdown = {}
-        self.final_score = 0
+# UI は1件ずつしか処理しないので、環境変数で設定されていなければサンプリングせずに毎回計測する
+# (XSCORER_STAGE_TIMINGS / XSCORER_STAGE_TIMINGS_SAMPLE を指定した場合はその設定に従う)
+if "XSCORER_STAGE_TIMINGS" not in os.environ and not STAGE_TIMINGS.enabled:
+    STAGE_TIMINGS.enable(None if "XSCORER_STAGE_TIMINGS_SAMPLE" in os.environ else 1)
 
-def stage_1_candidate_sources(post):
+@st.cache_data(max_entries=ANALYSIS_CACHE_SIZE, show_spinner=False)
+def cached_analysis(text, has_media, is_premium, follower_count, has_video=False):
     """
-    STAGE 1: CANDIDATE SOURCES
-    In-Network (Thunder) と Out-of-Network (Phoenix) の候補になるか判定
+    投稿内容とアカウント状態だけで決まる STAGE 1〜3 をキャッシュする
+    予想エンゲージメント数の変更では再計算せず、線形和だけを計算し直す
     """
-    log = []
-    status = "PASS"
-    
-    # Out-of-Network (おすすめ) に載るための最低条件シミュレーション
-    # フォロワー比率や直近の活動などが影響するが、ここでは簡易的に判定
-    
-    source_type = "In-Network Only (Thunder)"
-    if post.is_premium or post.follower_count > 500:
-        source_type = "Global Candidate (Phoenix Retrieval)"
-        log.append("✅ **Phoenix Retrieval**: おすすめ（FF外）表示の候補として抽出されました。")
-    else:
-        log.append("ℹ️ **Thunder Only**: フォロワー数が少ない、または活動が浅いため、主にフォロワー内（In-Network）での表示候補となります。")
-    
-    return status, log, source_type
+    return analyze_post(text, has_media, is_premium, follower_count, has_video=has_video)
 
-def stage_2_filtering_pre_scoring(post):
+@st.cache_data(max_entries=ANALYSIS_CACHE_SIZE, show_spinner=False)
+def cached_engagement_prediction(text, has_media, is_premium, follower_count, has_video=False):
     """
-    STAGE 2: FILTERING (Pre-Selection)
-    重複、ブロック、ミュートワード、スパムなどの排除
+    テキストモデルによる (予想いいね数, 予想リプライ数, 予想リポスト数)
     """
-    log = []
-    status = "PASS"
-    
-    # 1. スパム/ミュートワード判定（簡易）
-    spam_keywords = ["稼げる", "無料配布", "giveaway", "dm me"]
-    if any(word in post.text.lower() for word in spam_keywords):
-        status = "DROP"
-        log.append(f"⛔ **Muted Keyword**: スパム系の単語が含まれているため、フィルタリングされました。")
-        return status, log
-
-    # 2. ハッシュタグ過多（スパム判定）
-    hashtags = re.findall(r'#\w+', post.text)
-    if len(hashtags) > 5:
-        status = "DROP"
-        log.append(f"⛔ **Spam Filter**: ハッシュタグが多すぎます（{len(hashtags)}個）。スパム判定されるリスクがあります。")
-        return status, log
-
-    # 3. テキストの長さ（短すぎるとボット判定リスク）
-    if len(post.text) < 5 and not post.has_media:
-        status = "WARNING"
-        log.append("⚠️ **Low Quality**: テキストが短すぎます。メディアがない場合、ノイズとして除去される可能性があります。")
-
-    if status == "PASS":
-        log.append("✅ **Filtering Passed**: 重大なスパム要素は見つかりませんでした。")
-        
-    return status, log
+    post = PostCandidate(text, has_media, is_premium, follower_count, has_video=has_video)
+    with STAGE_TIMINGS.timed("engagement_model"):
+        likes, replies, reposts = get_engagement_predictor(ENGAGEMENT_MODEL_DIR).predict_engagement([post])[0]
+    return round(float(likes), 1), round(float(replies), 1), round(float(reposts), 1)
 
-def stage_3_scoring(post):
+def media_digest(images, videos):
     """
-    STAGE 3: SCORING (Heavy Ranker / Phoenix Scorer)
-    P(like), P(reply) などを予測し、スコア付けを行う工程のシミュレーション
+    アップロードされた画像・動画の中身のハッシュ (セーフティ判定のキャッシュキー)
     """
-    log = []
-    
-    # ベーススコア（投稿自体の品質推定）
-    base_score = 1.0
-    
-    # --- Feature Engineering (特徴量抽出) ---
-    
-    # メディアブースト
-    if post.has_media:
-        base_score *= WEIGHTS["image"]
-        log.append(f"📈 **Media Boost**: 画像/動画あり (x{WEIGHTS['image']})")
-    
-    # リンクペナルティ
-    urls = re.findall(r'http[s]?://', post.text)
-    if urls:
-        # 実際はリプライ欄ならOKだが、本文リンクは減点
-        log.append(f"📉 **Link Penalty**: 外部リンクが含まれています。インプレッションが制限される可能性があります。")
-        base_score *= 0.5 
-    
-    # 対話誘発性 (Question Mark)
-    if "?" in post.text or "？" in post.text:
-        log.append(f"📈 **Conversation Starter**: 疑問形が含まれており、リプライ率(P_reply)予測が向上します。")
-        base_score *= 1.2
-
-    # 長文ブースト (Premiumのみ)
-    if len(post.text) > 140 and post.is_premium:
-        log.append(f"📈 **Longform Boost**: 長文投稿による滞在時間増加が見込まれます。")
-        base_score *= 1.1
+    digest = hashlib.blake2b(digest_size=16)
+    for kind, items in (("image", images), ("video", videos)):
+        for item in items:
+            data = read_image_bytes(item)
+            digest.update(f"{kind}:{len(data)}:".encode("ascii"))
+            digest.update(data)
+    return digest.hexdigest()
 
-    post.base_potential = base_score
-    
-    # --- Engagement Simulation (予測スコア計算) ---
-    # ユーザーに「どれくらい反応が来そうか」を入力させ、アルゴリズム上のスコアを試算
-    return base_score, log
-
-def stage_4_filtering_visibility(post, final_score):
+@st.cache_data(max_entries=ANALYSIS_CACHE_SIZE, show_spinner=False)
+def cached_nsfw_score(digest, model_dir, variant, _images, _videos):
     """
-    STAGE 4: FILTERING (Post-Selection) & VISIBILITY
-    最終的な表示フィルタリング（NSFW、Violenceなど）
+    画像・動画の unsafe スコア。アップロードの中身・モデル・バリアントが同じならウィジェットを
+    操作しても推論し直さない (_images / _videos はハッシュせず、digest で区別する)
     """
-    status = "SHOW"
-    log = []
-    
-    # ここで本来は「Visibility Filtering (deleted/spam/violence/gore)」が入る
-    # 以前のCLIP判定でNSFWだった場合はここでDROPされる
-    
-    if final_score < 10:
-        status = "LIMITED"
-        log.append("⚠️ **Low Score**: スコアが低いため、表示頻度が調整（間引き）される可能性があります。")
-    else:
-        log.append("✅ **High Visibility**: 十分なスコアがあります。おすすめ表示の有力候補です。")
-        
-    return status, log
+    post = PostCandidate("", True, False, 0, images=_images, videos=_videos, has_video=bool(_videos))
+    # 同時に判定を要求した他のセッションの投稿とまとめてバッチ推論する
+    # (モデルはレジストリ経由でプロセスに1回だけロードし、全セッションで共有する)
+    with STAGE_TIMINGS.timed("visibility_model"):
+        return get_clip_batcher(model_dir, variant=variant)(post)
 
 # --- UI構築 ---
 
@@ -147,6 +88,19 @@ with st.sidebar:
     st.header("1. 投稿データ入力")
     input_text = st.text_area("投稿テキスト", placeholder="ここに投稿内容を入力...")
     input_has_media = st.checkbox("画像・動画あり", value=True)
+    input_has_video = False
+    input_images = []
+    input_videos = []
+    if input_has_media:
+        input_has_video = st.radio("メディアの種類", ["画像", "動画"], horizontal=True) == "動画"
+    if CLIP_MODEL_DIR and input_has_media:
+        if input_has_video:
+            input_videos = st.file_uploader("動画ファイル (キーフレームでセーフティ判定)",
+                                            type=["mp4", "mov", "webm", "mkv"],
+                                            accept_multiple_files=True) or []
+        else:
+            input_images = st.file_uploader("画像ファイル (セーフティ判定)", type=["png", "jpg", "jpeg", "webp"],
+                                            accept_multiple_files=True) or []
     
     st.header("2. アカウント状態")
     input_premium = st.checkbox("X Premium (青バッジ)", value=False)
@@ -154,21 +108,51 @@ with st.sidebar:
     
     st.markdown("---")
     st.header("3. 反応シミュレーション")
-    st.caption("この投稿にどれくらい反応が来ると予想しますか？")
-    sim_likes = st.number_input("予想いいね数", value=10)
-    sim_replies = st.number_input("予想リプライ数", value=0)
-    sim_reposts = st.number_input("予想リポスト数", value=0)
+    use_model = False
+    if ENGAGEMENT_MODEL_DIR:
+        use_model = st.checkbox("テキストモデルで予測する (P(like) / P(reply) / P(repost))", value=True)
+    if use_model:
+        st.caption("投稿テキストとアカウント状態から反応数を予測します。")
+        sim_likes = sim_replies = sim_reposts = 0
+        if input_text:
+            with st.spinner("エンゲージメントを予測中..."):
+                sim_likes, sim_replies, sim_reposts = cached_engagement_prediction(
+                    input_text, input_has_media, input_premium, int(input_followers), input_has_video)
+            st.write(f"予想いいね数: {sim_likes} / 予想リプライ数: {sim_replies} / 予想リポスト数: {sim_reposts}")
+    else:
+        st.caption("この投稿にどれくらい反応が来ると予想しますか？")
+        sim_likes = st.number_input("予想いいね数", value=10)
+        sim_replies = st.number_input("予想リプライ数", value=0)
+        sim_reposts = st.number_input("予想リポスト数", value=0)
     
     run_btn = st.button("アルゴリズムを実行 (Process Feed)", type="primary")
 
+    st.markdown("---")
+    use_profiler = st.checkbox("実行をプロファイルする", value=bool(PROFILE_PREFIX))
+    profiler_mode = PROFILE_MODE
+    if use_profiler:
+        profiler_mode = st.radio("プロファイラ", MODES, index=MODES.index(PROFILE_MODE), horizontal=True)
+
 # --- 画面右：パイプライン可視化 ---
 
-if run_btn and input_text:
-    post = PostCandidate(input_text, input_has_media, input_premium, input_followers)
+# 一度実行した後は、入力を変えるたびに結果を更新し続ける
+if run_btn:
+    st.session_state["pipeline_ran"] = True
+
+profiler = Profiler(profiler_mode) if use_profiler else None
+if profiler is not None:
+    profiler.start()
+
+if st.session_state.get("pipeline_ran") and input_text:
+    post = PostCandidate(input_text, input_has_media, input_premium, input_followers,
+                         likes=sim_likes, replies=sim_replies, reposts=sim_reposts,
+                         images=input_images, videos=input_videos, has_video=input_has_video)
+    s1_result, s2_result, s3_result = cached_analysis(
+        input_text, input_has_media, input_premium, int(input_followers), input_has_video)
     
     # --- STEP 1: Candidate Sources ---
     st.subheader("📍 Step 1: Candidate Sources (候補選出)")
-    s1_status, s1_log, s1_type = stage_1_candidate_sources(post)
+    s1_status, s1_log, s1_type = s1_result
     
     col1, col2 = st.columns([1, 3])
     with col1:
@@ -178,13 +162,13 @@ if run_btn and input_text:
             st.info("LOCAL CANDIDATE")
     with col2:
         st.write(f"**判定**: {s1_type}")
-        for l in s1_log: st.write(l)
+        for l in render_log(s1_log): st.write(l)
     
     st.markdown("⬇︎")
 
     # --- STEP 2: Pre-Scoring Filtering ---
     st.subheader("📍 Step 2: Hydration & Filtering (足切り)")
-    s2_status, s2_log = stage_2_filtering_pre_scoring(post)
+    s2_status, s2_log = s2_result
     
     col1, col2 = st.columns([1, 3])
     with col1:
@@ -195,7 +179,7 @@ if run_btn and input_text:
         else:
             st.success("PASSED")
     with col2:
-        for l in s2_log: st.write(l)
+        for l in render_log(s2_log): st.write(l)
         
     if s2_status == "DROP":
         st.error("🚫 この投稿はフィルタリング段階で破棄されました。修正してください。")
@@ -204,13 +188,11 @@ if run_btn and input_text:
         
         # --- STEP 3: Scoring ---
         st.subheader("📍 Step 3: Scoring (Heavy Ranker予測)")
-        base_potential, s3_log = stage_3_scoring(post)
+        base_potential, s3_log = s3_result
         
         # スコア計算 (Linear Estimation)
         # アルゴリズム内部の重み付き和
-        score_val = (sim_likes * WEIGHTS["like"]) + \
-                    (sim_replies * WEIGHTS["reply"]) + \
-                    (sim_reposts * WEIGHTS["retweet"])
+        score_val = compute_engagement_score(sim_likes, sim_replies, sim_reposts)
         
         # コンテンツ自体のポテンシャル係数を掛ける
         final_score = score_val * base_potential
@@ -220,7 +202,7 @@ if run_btn and input_text:
             st.metric("Total Score", f"{final_score:.1f}")
         with col2:
             st.markdown("#### Feature Analysis")
-            for l in s3_log: st.write(l)
+            for l in render_log(s3_log): st.write(l)
             st.markdown("#### Score Breakdown")
             st.caption(f"Base Potential: x{base_potential:.2f}")
             st.write(f"Like Score: {sim_likes * WEIGHTS['like']:.1f}")
@@ -231,17 +213,62 @@ if run_btn and input_text:
 
         # --- STEP 4: Selection & Visibility ---
         st.subheader("📍 Step 4: Selection & Visibility")
-        s4_status, s4_log = stage_4_filtering_visibility(post, final_score)
+        nsfw_score = None
+        if post.images or post.videos:
+            with st.spinner("画像・動画のセーフティ判定中..."):
+                nsfw_score = cached_nsfw_score(media_digest(post.images, post.videos), CLIP_MODEL_DIR,
+                                               resolve_variant(), post.images, post.videos)
+        with STAGE_TIMINGS.timed("stage_4"):
+            s4_status, s4_log = stage_4_filtering_visibility(post, final_score, nsfw_score)
         
-        for l in s4_log: st.write(l)
+        for l in render_log(s4_log): st.write(l)
         
-        if final_score > 100:
+        rank = rank_tier(final_score)
+        if s4_status == "DROP":
+            st.error("🚫 この投稿は表示フィルタリングで除外されました。")
+        elif rank == "HIGH":
             st.balloons()
             st.success("🎉 **Ranked High**: おすすめフィードの上位に表示される可能性が高いです！")
-        elif final_score > 30:
+        elif rank == "MID":
             st.success("✅ **Ranked Mid**: フォロワーのTLには確実に届きます。")
         else:
             st.info("ℹ️ **Ranked Low**: 表示優先度は低めです。リプライ等での加点が必要です。")
 
 elif run_btn:
     st.error("テキストを入力してください。")
+
+if profiler is not None:
+    profiler.stop()
+    with st.expander("🔬 Profile", expanded=True):
+        st.code(profiler.stage_report())
+        with tempfile.TemporaryDirectory() as directory:
+            for path in profiler.write(PROFILE_PREFIX or os.path.join(directory, "app")):
+                with open(path, "rb") as f:
+                    st.download_button(os.path.basename(path), f.read(), file_name=os.path.basename(path),
+                                       key=f"profile:{path}")
+
+if CLIP_MODEL_DIR or ENGAGEMENT_MODEL_DIR:
+    with st.expander("🧠 Loaded Models"):
+        usage = REGISTRY.memory_usage()
+        if not usage:
+            st.caption("ロード済みのモデルはありません。")
+        for name, info in usage.items():
+            st.write(f"**{name}**: {info['bytes'] / 1024 / 1024:.0f} MB "
+                     f"(ロード {info['load_seconds']:.1f}s / 最終使用 {info['idle_seconds']:.0f}s 前)")
+        if ENGAGEMENT_MODEL_DIR and any(name.startswith("engagement:") for name in usage):
+            metrics = get_engagement_predictor(ENGAGEMENT_MODEL_DIR).scheduler.metrics()
+            st.caption(f"エンゲージメント予測のパディング効率: {metrics['padding_efficiency']:.0%} "
+                       f"(長さ順にしない場合 {metrics['naive_padding_efficiency']:.0%})")
+
+with st.expander("⏱ Pipeline timings"):
+    timings = STAGE_TIMINGS.summary()
+    if not STAGE_TIMINGS.enabled:
+        st.caption("計測は無効です (XSCORER_STAGE_TIMINGS)。")
+    elif not timings:
+        st.caption("まだ計測結果はありません。")
+    else:
+        st.caption("このプロセスで計測したステージごとの処理時間 (µs)。"
+                   "STAGE 1〜3 と予測・セーフティ判定はキャッシュに無い入力を処理したときだけ計測されます。")
+        st.table([{"stage": name, **{key: round(value, 1) if key != "count" else value
+                                      for key, value in stats.items()}}
+                  for name, stats in sorted(timings.items())])
@@ -0,0 +1,85 @@
+"""
+ベンチマーク用の合成コーパス
+
+実際の投稿の分布に近い PostCandidate を乱数シードから再現可能に生成する。
+- 長さ: 数文字の短文から Premium の長文まで (単語数は対数正規分布)
+- 日本語 / 英語 / 混在の本文、ハッシュタグ (スパム判定される6個以上も含む)、URL、疑問形、スパムワード
+- Premium の比率、フォロワー数 (対数一様)、メディア (画像・動画) の有無
+- 予想エンゲージメントはフォロワー数に比例させる
+"""
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pipeline import SPAM_KEYWORDS, PostCandidate  # noqa: E402
+
+JA_WORDS = ("今日", "新しい", "機能", "リリース", "しました", "みなさん", "ありがとう", "ランチ", "美味しい",
+            "エンジニア", "設計", "について", "考えて", "みた", "記事", "書きました", "東京", "イベント",
+            "参加", "します", "😊", "🎉", "、", "。")
+EN_WORDS = ("the", "new", "feature", "is", "live", "thanks", "everyone", "for", "coming", "today",
+            "we", "shipped", "a", "big", "update", "check", "out", "this", "thread", "about", "python")
+HASHTAGS = ("#python", "#ml", "#ai", "#dev", "#tips", "#東京", "#エンジニア", "#startup", "#news", "#photo")
+URLS = ("https://example.com/blog/post", "http://t.co/abc123", "https://example.jp/記事?id=42")
+
+# 本文の言語の比率 (日本語 / 英語 / 混在)
+LANGUAGE_MIX = (("ja", 0.5), ("en", 0.3), ("mixed", 0.2))
+
+def _words(rng, language, n):
+    if language == "ja":
+        return "".join(rng.choice(JA_WORDS) for _ in range(n))
+    if language == "en":
+        return " ".join(rng.choice(EN_WORDS) for _ in range(n))
+    return " ".join(rng.choice(JA_WORDS if rng.random() < 0.5 else EN_WORDS) for _ in range(n))
+
+def synthetic_text(rng, premium=False):
+    language = rng.choices([name for name, _ in LANGUAGE_MIX], [w for _, w in LANGUAGE_MIX])[0]
+    # 単語数は対数正規分布 (中央値 10 語程度)。Premium は長文が多い
+    n_words = max(1, int(rng.lognormvariate(2.3 + (0.6 if premium else 0.0), 0.8)))
+    parts = [_words(rng, language, min(n_words, 400))]
+    if rng.random() < 0.3:
+        # ハッシュタグ。まれにスパム判定される個数 (6個以上) になる
+        count = rng.choice((1, 1, 2, 3, 7)) if rng.random() < 0.95 else 8
+        parts.append(" ".join(rng.choice(HASHTAGS) for _ in range(count)))
+    if rng.random() < 0.2:
+        parts.append(rng.choice(URLS))
+    if rng.random() < 0.15:
+        parts.append(rng.choice(("？", "?", "どう思いますか？", "what do you think?")))
+    if rng.random() < 0.02:
+        parts.append(rng.choice(SPAM_KEYWORDS))
+    extras = parts[1:]
+    rng.shuffle(extras)
+    return " ".join(parts[:1] + extras)
+
+def synthetic_posts(n, seed=0, premium_rate=0.15, media_rate=0.4, video_rate=0.25):
+    """
+    n 件の PostCandidate を生成する (同じ seed なら同じコーパス)
+    video_rate: メディア付き投稿のうち動画の割合
+    """
+    rng = random.Random(seed)
+    posts = []
+    for _ in range(n):
+        premium = rng.random() < premium_rate
+        followers = int(10 ** rng.uniform(0, 6.5))
+        has_media = rng.random() < media_rate
+        reach = followers * rng.uniform(0.001, 0.05)
+        posts.append(PostCandidate(
+            synthetic_text(rng, premium), has_media, premium, followers,
+            likes=round(reach), replies=round(reach * rng.uniform(0.01, 0.2)),
+            reposts=round(reach * rng.uniform(0.02, 0.3)),
+            has_video=has_media and rng.random() < video_rate,
+        ))
+    return posts
+
+def corpus_stats(posts):
+    lengths = sorted(len(post.text) for post in posts)
+    return {
+        "posts": len(posts),
+        "length_p50": lengths[len(lengths) // 2] if lengths else 0,
+        "length_max": lengths[-1] if lengths else 0,
+        "premium_rate": sum(post.is_premium for post in posts) / len(posts) if posts else 0.0,
+        "media_rate": sum(post.has_media for post in posts) / len(posts) if posts else 0.0,
+        "non_ascii_rate": sum(not post.text.isascii() for post in posts) / len(posts) if posts else 0.0,
+    }
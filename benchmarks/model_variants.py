@@ -0,0 +1,182 @@
+"""
+モデルバリアント (fp32 / int8 / onnx) の比較ベンチマーク
+
+各モデルを各バリアントで動かし、バッチあたりのレイテンシ (p50 / p95)、スループット、
+fp32 との一致度を JSON で出力する。
+- CLIP セーフティ分類器: ローカルの画像フィクスチャに対する unsafe スコアの平均絶対誤差と
+  SHOW / LIMITED / DROP 判定の一致率
+- エンゲージメント予測モデル: テキストフィクスチャ (JSONL / CSV の投稿。省略時は合成コーパス) に対する
+  確率の平均絶対誤差と、予想件数で STAGE 1〜4 を実行したときのランク (HIGH / MID / LOW / DROP) の一致率
+
+    python benchmarks/model_variants.py --model-dir models/clip --fixtures tests/fixtures/images
+    python benchmarks/model_variants.py --engagement-model models/engagement --texts posts.jsonl
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+from corpus import synthetic_posts  # noqa: E402
+from engagement_model import EngagementPredictor, expected_counts  # noqa: E402
+from model_variants import VARIANTS  # noqa: E402
+from pipeline import NSFW_DROP_THRESHOLD, NSFW_LIMIT_THRESHOLD, score_post  # noqa: E402
+from image_hydration import decode_image  # noqa: E402
+from streaming import detect_format, iter_records, open_text, post_from_record  # noqa: E402
+from visibility import ClipSafetyClassifier  # noqa: E402
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+def load_fixtures(directory):
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if name.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        raise SystemExit(f"画像が見つかりません: {directory}")
+    return [decode_image(path) for path in paths]
+
+def load_text_fixtures(path, n, seed):
+    """
+    投稿の JSONL / CSV (streaming と同じ項目) を読み込む。省略時は合成コーパスの n 件
+    """
+    if not path:
+        return synthetic_posts(n, seed=seed)
+    with open_text(path, "r") as f:
+        posts = [post_from_record(record) for record in iter_records(f, detect_format(path))]
+    if not posts:
+        raise SystemExit(f"投稿が見つかりません: {path}")
+    return posts
+
+def decisions(scores):
+    return np.where(scores >= NSFW_DROP_THRESHOLD, 2, np.where(scores >= NSFW_LIMIT_THRESHOLD, 1, 0))
+
+def percentile(values, q):
+    return float(np.percentile(np.asarray(values), q))
+
+def ranks(posts, probabilities):
+    """
+    予想件数を確率から求めて STAGE 1〜4 を実行したときのランク (フィルタで除外された投稿は DROP)
+    """
+    counts = expected_counts(probabilities, [post.follower_count for post in posts])
+    result = []
+    for post, (likes, replies, reposts) in zip(posts, counts):
+        post.likes, post.replies, post.reposts = float(likes), float(replies), float(reposts)
+        result.append(score_post(post).rank or "DROP")
+    return np.asarray(result)
+
+def bench_variant(predict, items, batch_size, repeat, warmup, unit):
+    """
+    predict: バッチ (items のスライス) を受け取る推論関数
+    """
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    for batch in batches[:warmup]:
+        predict(batch)
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for batch in batches:
+            t0 = time.perf_counter()
+            predict(batch)
+            latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    return {
+        "batch_latency_ms_p50": percentile(latencies, 50) * 1000,
+        "batch_latency_ms_p95": percentile(latencies, 95) * 1000,
+        "batch_latency_ms_mean": statistics.fmean(latencies) * 1000,
+        f"throughput_{unit}_per_s": len(items) * repeat / elapsed,
+    }
+
+def bench_clip(args, variants):
+    images = load_fixtures(args.fixtures)
+    report = {"model_dir": args.model_dir, "images": len(images), "batch_size": args.batch_size, "variants": {}}
+    reference = None
+    for variant in variants:
+        t0 = time.perf_counter()
+        classifier = ClipSafetyClassifier(args.model_dir, batch_size=args.batch_size,
+                                          num_threads=args.num_threads, variant=variant,
+                                          cache_dir=None)
+        load_seconds = time.perf_counter() - t0
+
+        scores = classifier.unsafe_scores(images)
+        result = {"load_seconds": load_seconds, "memory_bytes": classifier.memory_bytes()}
+        result.update(bench_variant(classifier.unsafe_scores, images, args.batch_size, args.repeat,
+                                    args.warmup, "images"))
+        if reference is None:
+            reference = scores
+        else:
+            result["score_mae_vs_fp32"] = float(np.mean(np.abs(scores - reference)))
+            result["score_max_abs_diff_vs_fp32"] = float(np.max(np.abs(scores - reference)))
+            result["decision_agreement_vs_fp32"] = float(np.mean(decisions(scores) == decisions(reference)))
+        report["variants"][variant] = result
+        del classifier
+    return report
+
+def bench_engagement(args, variants):
+    posts = load_text_fixtures(args.texts, args.synthetic_texts, args.seed)
+    report = {"model_dir": args.engagement_model, "texts": args.texts or "synthetic", "posts": len(posts),
+              "batch_size": args.batch_size, "variants": {}}
+    reference = reference_ranks = None
+    for variant in variants:
+        t0 = time.perf_counter()
+        predictor = EngagementPredictor(args.engagement_model, batch_size=args.batch_size,
+                                        num_threads=args.num_threads, variant=variant, cache_dir=None)
+        load_seconds = time.perf_counter() - t0
+
+        probabilities = predictor.predict_posts(posts)
+        result = {"load_seconds": load_seconds, "memory_bytes": predictor.memory_bytes()}
+        result.update(bench_variant(predictor.predict_posts, posts, args.batch_size, args.repeat,
+                                    args.warmup, "texts"))
+        post_ranks = ranks(posts, probabilities)
+        if reference is None:
+            reference, reference_ranks = probabilities, post_ranks
+        else:
+            diff = np.abs(probabilities - reference)
+            result["probability_mae_vs_fp32"] = float(np.mean(diff))
+            result["probability_max_abs_diff_vs_fp32"] = float(np.max(diff))
+            result["rank_agreement_vs_fp32"] = float(np.mean(post_ranks == reference_ranks))
+        report["variants"][variant] = result
+        del predictor
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CLIP セーフティ分類器とエンゲージメント予測モデルのバリアント比較")
+    parser.add_argument("--model-dir", help="CLIP モデルのローカルディレクトリ")
+    parser.add_argument("--fixtures", help="画像フィクスチャのディレクトリ (--model-dir と一緒に指定する)")
+    parser.add_argument("--engagement-model", metavar="DIR", help="エンゲージメント予測モデルのローカルディレクトリ")
+    parser.add_argument("--texts", help="テキストフィクスチャ (投稿の JSONL / CSV)。省略時は合成コーパス")
+    parser.add_argument("--synthetic-texts", type=int, default=512, help="合成コーパスの件数")
+    parser.add_argument("--seed", type=int, default=0, help="合成コーパスの乱数シード")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1, help="計測前に捨てるバッチ数")
+    parser.add_argument("--num-threads", type=int)
+    parser.add_argument("-o", "--output", help="結果 JSON の出力先 (省略時は標準出力)")
+    args = parser.parse_args(argv)
+    if not args.model_dir and not args.engagement_model:
+        parser.error("--model-dir か --engagement-model のどちらかを指定してください")
+    if args.model_dir and not args.fixtures:
+        parser.error("--model-dir には --fixtures (画像フィクスチャのディレクトリ) が必要です")
+
+    variants = ["fp32"] + [v for v in args.variants if v != "fp32"]
+    report = {"benchmark": "model_variants"}
+    if args.model_dir:
+        report["clip_safety"] = bench_clip(args, variants)
+    if args.engagement_model:
+        report["engagement"] = bench_engagement(args, variants)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
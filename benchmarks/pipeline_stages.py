@@ -0,0 +1,181 @@
+"""
+パイプラインのステージ別ベンチマーク
+
+合成コーパス (benchmarks/corpus.py) に対して stage_1〜stage_4 と score_post (end-to-end) を
+それぞれ実行し、スループット (件/秒) と1件あたりのレイテンシ (p50 / p95 / p99) を計測する。
+結果はコミットやマシンの情報と一緒に JSON に書き出すので、--compare で別のコミットの
+結果と比較して回帰を検出できる。
+
+    python benchmarks/pipeline_stages.py -o bench.json
+    python benchmarks/pipeline_stages.py --compare bench.json --tolerance 0.1
+
+- スループットはタイマーを挟まないループ全体の時間から計算する
+- レイテンシは1件ずつ perf_counter_ns で計測する (タイマー自体の数十 ns を含む)
+- stage_2 は特徴量抽出 (テキストの走査) を含めて計測する。stage_3 / stage_4 は抽出済みの特徴量を使う
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+from corpus import corpus_stats, synthetic_posts  # noqa: E402
+from pipeline import (  # noqa: E402
+    score_post,
+    stage_1_candidate_sources,
+    stage_2_filtering_pre_scoring,
+    stage_3_scoring,
+    stage_4_filtering_visibility,
+)
+
+# 画像付き投稿に付ける合成の unsafe スコア (id(post) -> スコア)
+_nsfw_scores = {}
+
+def _reset_features(posts):
+    for post in posts:
+        post.features = None
+
+def _prepare_scored(posts, seed):
+    # stage_3 / stage_4 用に特徴量と最終スコアを計算しておく。
+    # 画像付き投稿には合成の unsafe スコアを付けて NSFW 判定の分岐も通す
+    rng = np.random.default_rng(seed)
+    _nsfw_scores.clear()
+    for post, nsfw_score in zip(posts, rng.beta(0.5, 3.0, size=len(posts))):
+        score_post(post)
+        if post.has_media:
+            _nsfw_scores[id(post)] = float(nsfw_score)
+
+def _stage_2(post):
+    # 特徴量抽出を含めて計測する
+    post.features = None
+    return stage_2_filtering_pre_scoring(post)
+
+def _stage_4(post):
+    return stage_4_filtering_visibility(post, post.final_score, _nsfw_scores.get(id(post)))
+
+STAGES = {
+    "stage_1_candidate_sources": stage_1_candidate_sources,
+    "stage_2_filtering_pre_scoring": _stage_2,
+    "stage_3_scoring": stage_3_scoring,
+    "stage_4_filtering_visibility": _stage_4,
+    "end_to_end": score_post,
+}
+
+def bench_stage(fn, posts, repeat):
+    """
+    fn を全投稿に repeat 回適用し、スループットとレイテンシの分位点を返す
+    """
+    # ウォームアップ
+    for post in posts[:1000]:
+        fn(post)
+
+    elapsed = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for post in posts:
+            fn(post)
+        elapsed.append(time.perf_counter() - started)
+
+    latencies = np.empty(len(posts), dtype=np.int64)
+    clock = time.perf_counter_ns
+    for i, post in enumerate(posts):
+        t0 = clock()
+        fn(post)
+        latencies[i] = clock() - t0
+    latencies_us = latencies / 1000.0
+
+    best = min(elapsed)
+    return {
+        "calls": len(posts) * repeat,
+        "throughput_per_s": len(posts) / best,
+        "mean_us": best / len(posts) * 1e6,
+        "latency_us_p50": float(np.percentile(latencies_us, 50)),
+        "latency_us_p95": float(np.percentile(latencies_us, 95)),
+        "latency_us_p99": float(np.percentile(latencies_us, 99)),
+        "latency_us_max": float(latencies_us.max()),
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(n, seed, repeat, stages=None):
+    posts = synthetic_posts(n, seed=seed)
+    report = {
+        "benchmark": "pipeline_stages",
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "repeat": repeat,
+        "corpus": corpus_stats(posts),
+        "stages": {},
+    }
+    for name, fn in STAGES.items():
+        if stages and name not in stages:
+            continue
+        # 各ステージは前のステージの結果 (特徴量・スコア) を前提にするので、ここで揃える
+        _reset_features(posts)
+        if name in ("stage_3_scoring", "stage_4_filtering_visibility"):
+            _prepare_scored(posts, seed)
+        report["stages"][name] = bench_stage(fn, posts, repeat)
+    return report
+
+def compare(report, baseline, tolerance):
+    """
+    baseline からのスループットの変化率を表示し、tolerance を超えて遅くなったステージ名のリストを返す
+    """
+    regressions = []
+    print(f"{'stage':32} {'baseline/s':>12} {'current/s':>12} {'change':>8}", file=sys.stderr)
+    for name, current in report["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None:
+            continue
+        change = current["throughput_per_s"] / base["throughput_per_s"] - 1.0
+        flag = ""
+        if change < -tolerance:
+            regressions.append(name)
+            flag = "  <-- 回帰"
+        print(f"{name:32} {base['throughput_per_s']:12.0f} {current['throughput_per_s']:12.0f} "
+              f"{change:+8.1%}{flag}", file=sys.stderr)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="パイプラインのステージ別ベンチマーク")
+    parser.add_argument("-n", "--posts", type=int, default=20000, help="合成コーパスの件数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="スループット計測の繰り返し回数 (最速を採用)")
+    parser.add_argument("--stage", action="append", choices=list(STAGES), help="計測するステージ (複数可)")
+    parser.add_argument("-o", "--output", help="結果 JSON の出力先 (省略時は標準出力)")
+    parser.add_argument("--compare", metavar="JSON", help="比較対象の結果 JSON (別コミットで出力したもの)")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="--compare で回帰とみなすスループット低下の割合")
+    args = parser.parse_args(argv)
+
+    report = run(args.posts, args.seed, args.repeat, args.stage)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+スコアリング HTTP サービスの負荷試験
+
+keep-alive の HTTP/1.1 接続を複数張り、各接続から POST /score を連続で送って
+スループット (rps) とレイテンシ (p50 / p95 / p99) を JSON で出力する。
+標準ライブラリだけで動くので、サービスと同じマシンでそのまま実行できる。
+
+    python service.py --port 8000 &
+    python benchmarks/service_load.py --port 8000 --connections 64 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+SAMPLE_TEXTS = (
+    "今日のランチ美味しかった",
+    "新機能をリリースしました！詳しくはこちら https://example.com/blog",
+    "みなさんはどう思いますか？",
+    "Check out our giveaway, dm me for details",
+    "#python #ml #ai #data #dev #tips 今日の学び",
+    "長文のスレッドです。" * 20,
+)
+
+def _request_bytes(host, record):
+    body = json.dumps(record, ensure_ascii=False).encode("utf-8")
+    header = (f"POST /score HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+              f"Content-Length: {len(body)}\r\n\r\n").encode("ascii")
+    return header + body
+
+def _sample_requests(host, n, seed=0):
+    rng = random.Random(seed)
+    return [_request_bytes(host, {
+        "id": i,
+        "text": rng.choice(SAMPLE_TEXTS),
+        "has_media": rng.random() < 0.4,
+        "is_premium": rng.random() < 0.2,
+        "follower_count": int(10 ** rng.uniform(1, 6)),
+        "likes": rng.randint(0, 500),
+        "replies": rng.randint(0, 50),
+        "reposts": rng.randint(0, 100),
+    }) for i in range(n)]
+
+async def _read_response(reader):
+    header = await reader.readuntil(b"\r\n\r\n")
+    status = int(header.split(b" ", 2)[1])
+    length = 0
+    for line in header.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    await reader.readexactly(length)
+    return status
+
+async def _connection(host, port, requests, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        i = 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            writer.write(requests[i % len(requests)])
+            await writer.drain()
+            status = await _read_response(reader)
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors.append(status)
+            i += 1
+    finally:
+        writer.close()
+
+async def run(host, port, connections, duration, warmup):
+    requests = _sample_requests(host, 1024)
+    # ウォームアップ (接続確立とサービス側の初回処理を計測から外す)
+    await asyncio.gather(*[_connection(host, port, requests, time.perf_counter() + warmup, [], [])
+                           for _ in range(connections)])
+
+    latencies, errors = [], []
+    started = time.perf_counter()
+    await asyncio.gather(*[_connection(host, port, requests, started + duration, latencies, errors)
+                           for _ in range(connections)])
+    elapsed = time.perf_counter() - started
+    values = np.asarray(latencies) * 1000
+    return {
+        "benchmark": "service_load",
+        "connections": connections,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_s": len(latencies) / elapsed,
+        "latency_ms_p50": float(np.percentile(values, 50)) if len(values) else None,
+        "latency_ms_p95": float(np.percentile(values, 95)) if len(values) else None,
+        "latency_ms_p99": float(np.percentile(values, 99)) if len(values) else None,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="スコアリング HTTP サービスの負荷試験")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--connections", type=int, default=64, help="同時に張る keep-alive 接続数")
+    parser.add_argument("--duration", type=float, default=10.0, help="計測秒数")
+    parser.add_argument("--warmup", type=float, default=1.0, help="計測前のウォームアップ秒数")
+    args = parser.parse_args(argv)
+    report = asyncio.run(run(args.host, args.port, args.connections, args.duration, args.warmup))
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+起動時間ベンチマーク: テキストだけの score_batch が ML ライブラリの import コストを払わないことを確認する
+
+新しいインタプリタで CLI 相当のモジュールを import し、テキストのみの投稿を
+score_batch したあとで sys.modules に torch / transformers が無いことを検査する。
+計測は複数回繰り返し、import と初回 score_batch の時間の中央値を JSON で出力する。
+
+    python benchmarks/startup.py [--repeat 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("torch", "transformers", "onnxruntime", "av")
+
+_PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import cli, parallel, pipeline, streaming, visibility
+t1 = time.perf_counter()
+posts = [pipeline.PostCandidate("みなさんはどう思いますか？ https://example.com #python", True, i % 2 == 0, 1000,
+                                likes=10, replies=2, reposts=1) for i in range(1000)]
+pipeline.score_batch(posts)
+t2 = time.perf_counter()
+print(json.dumps({
+    "import_s": t1 - t0,
+    "score_batch_s": t2 - t1,
+    "loaded": [name for name in HEAVY_MODULES if name in sys.modules],
+}))
+"""
+
+def run_probe():
+    code = f"HEAVY_MODULES = {HEAVY_MODULES!r}\n" + _PROBE
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    runs = [run_probe() for _ in range(args.repeat)]
+    loaded = sorted({name for run in runs for name in run["loaded"]})
+    report = {
+        "benchmark": "startup",
+        "repeat": args.repeat,
+        "import_s_median": statistics.median(run["import_s"] for run in runs),
+        "score_batch_1k_s_median": statistics.median(run["score_batch_s"] for run in runs),
+        "heavy_modules_loaded": loaded,
+    }
+    print(json.dumps(report, indent=2))
+    if loaded:
+        print(f"NG: テキストのみの score_batch で {', '.join(loaded)} が import されました", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+ヘッドレスのバッチスコアリング CLI
+
+JSONL / CSV (1行1投稿) をストリーミングで読み込み、STAGE 1〜4 を実行した結果を
+1件ずつ書き出す。形式は拡張子から判定する (.gz 圧縮も可)。
+
+    python cli.py posts.jsonl -o scores.jsonl --workers 8
+    python cli.py export.csv.gz -o scores.csv
+    python cli.py posts.jsonl -o scores.jsonl --timings timings.prom
+    python cli.py posts.jsonl -o scores.jsonl --profile /tmp/run --profiler sample
+    python cli.py posts.jsonl -o scores.jsonl --memory-report memory.json
+"""
+import argparse
+import json
+import sys
+from functools import partial
+
+from length_bucketing import PADDING_STATS
+from memory_report import DEFAULT_EVERY, MEMORY_REPORT_PATH, MemoryReport
+from model_variants import VARIANTS
+from parallel import DEFAULT_CHUNKSIZE, iter_score_parallel
+from profiling import MODES, PROFILE_MODE, PROFILE_PREFIX, Profiler
+from streaming import FORMATS, RecordError, ResultWriter, detect_format, iter_records, open_text, score_stream
+from timings import STAGE_TIMINGS
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="X Algorithm Pipeline のバッチスコアリング")
+    parser.add_argument("input", nargs="?", default="-", help="入力ファイル (省略時は標準入力)")
+    parser.add_argument("-o", "--output", default="-", help="出力ファイル (省略時は標準出力)")
+    parser.add_argument("--input-format", choices=FORMATS, help="入力形式 (省略時は拡張子から判定)")
+    parser.add_argument("--output-format", choices=FORMATS, help="出力形式 (省略時は拡張子から判定)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="並列プロセス数 (0 で CPU コア数)")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE,
+                        help="ワーカーに1回で渡す投稿数")
+    parser.add_argument("--clip-model", metavar="DIR",
+                        help="画像セーフティ判定に使う CLIP モデルのローカルディレクトリ")
+    parser.add_argument("--engagement-model", metavar="DIR",
+                        help="指定時は予想いいね数などを入力の値ではなくテキストモデルの予測で置き換える")
+    parser.add_argument("--model-variant", choices=VARIANTS,
+                        help="モデルのバリアント (省略時は XSCORER_MODEL_VARIANT、未設定なら fp32)")
+    parser.add_argument("--timings", metavar="FILE",
+                        help="ステージごとの処理時間 (p50 / p95 / p99) と、エンゲージメント予測のパディング効率を "
+                             "Prometheus のテキスト形式で書き出す")
+    parser.add_argument("--profile", metavar="PREFIX", default=PROFILE_PREFIX,
+                        help="実行をプロファイルして PREFIX.pstats / PREFIX.collapsed / PREFIX.stages.txt に"
+                             "書き出す (省略時は XSCORER_PROFILE)")
+    parser.add_argument("--profiler", choices=MODES, default=PROFILE_MODE,
+                        help="cprofile (全呼び出し) / sample (低負荷のサンプリング)。省略時は XSCORER_PROFILER")
+    parser.add_argument("--memory-report", metavar="FILE", default=MEMORY_REPORT_PATH,
+                        help="tracemalloc によるステージ別・バッチ別のメモリ使用量を JSON で書き出す "
+                             "(省略時は XSCORER_MEMORY_REPORT)")
+    parser.add_argument("--memory-every", type=int, default=DEFAULT_EVERY,
+                        help="--memory-report でスナップショットを取る間隔 (件数)")
+    args = parser.parse_args(argv)
+
+    if args.timings:
+        STAGE_TIMINGS.enable()
+    # プロファイラと tracemalloc は呼び出したプロセスしか見ないので、ワーカーに分けずに実行する
+    if (args.profile or args.memory_report) and args.workers != 1:
+        print("--profile / --memory-report: ワーカープロセスは計測できないため --workers 1 で実行します",
+              file=sys.stderr)
+        args.workers = 1
+    profiler = Profiler(args.profiler) if args.profile else None
+    memory = MemoryReport(args.memory_every) if args.memory_report else None
+
+    input_format = args.input_format or detect_format(args.input)
+    output_format = args.output_format or detect_format(args.output)
+    score_iter = partial(iter_score_parallel, workers=args.workers or None, chunksize=args.chunksize,
+                         clip_model_dir=args.clip_model, model_variant=args.model_variant,
+                         engagement_model_dir=args.engagement_model)
+
+    errors = 0
+    src = open_text(args.input, "r")
+    dst = open_text(args.output, "w")
+    try:
+        writer = ResultWriter(dst, output_format)
+        if memory is not None:
+            memory.start()
+        if profiler is not None:
+            profiler.start()
+        for record_id, result in score_stream(iter_records(src, input_format), score_iter):
+            writer.write(result, record_id)
+            if isinstance(result, RecordError):
+                errors += 1
+            if memory is not None:
+                memory.tick()
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        if memory is not None:
+            memory.stop()
+        if args.input != "-":
+            src.close()
+        if args.output != "-":
+            dst.close()
+
+    if errors:
+        print(f"変換できなかったレコードが {errors} 件ありました (出力は id と error だけの行になります)",
+              file=sys.stderr)
+    if args.timings:
+        with open(args.timings, "w", encoding="utf-8") as f:
+            f.write(STAGE_TIMINGS.prometheus_text())
+            # --engagement-model 指定時はバッチのパディング効率も書き出す (ワーカーの分も合算済み)
+            f.write(PADDING_STATS.prometheus_text())
+    if profiler is not None:
+        profiler.write(args.profile)
+        sys.stderr.write(profiler.stage_report())
+    if memory is not None:
+        report = memory.report()
+        with open(args.memory_report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        sys.stderr.write(memory.summary_text(report))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+STAGE 3 スコア計算の列指向 (NumPy) 版
+
+投稿を1件ずつ処理する stage_3_scoring と同じ係数を、列 (配列) 単位で
+まとめて適用する。数百万件のコンテンツカレンダーを再ランキングする用途向け。
+"""
+from array import array
+
+import numpy as np
+
+from pipeline import (
+    FLAG_DROPPED,
+    FLAG_HAS_MEDIA,
+    FLAG_HAS_VIDEO,
+    FLAG_PREMIUM,
+    INPUT_FLAGS,
+    LINK_PENALTY,
+    LONGFORM_BOOST,
+    LONGFORM_MIN_LENGTH,
+    QUESTION_BOOST,
+    WEIGHTS,
+    PostCandidate,
+    post_features,
+    stage_2_filtering_pre_scoring,
+)
+
+# CandidateTable.flags で使う特徴量のビット (入力フラグは pipeline と共通)
+FLAG_HAS_LINK = 1 << 7
+FLAG_HAS_QUESTION = 1 << 8
+
+def media_weight_columns(has_media, has_video=None, weights=None):
+    """
+    メディアブーストの係数 (動画は WEIGHTS["video"]、それ以外のメディアは WEIGHTS["image"])
+    """
+    weights = WEIGHTS if weights is None else weights
+    has_media = np.asarray(has_media, dtype=bool)
+    media_weight = weights["image"]
+    if has_video is not None:
+        media_weight = np.where(np.asarray(has_video, dtype=bool), weights["video"], weights["image"])
+    return np.where(has_media, media_weight, 1.0)
+
+def base_potential_columns(has_media, is_premium, text_length, has_link, has_question, has_video=None):
+    """
+    stage_3_scoring のベースポテンシャル係数を列単位で計算する
+    各引数は同じ長さの配列 (bool / int) を受け取り、float64 の配列を返す
+    has_video: 省略時はメディアをすべて画像とみなす
+    """
+    is_premium = np.asarray(is_premium, dtype=bool)
+    text_length = np.asarray(text_length)
+    has_link = np.asarray(has_link, dtype=bool)
+    has_question = np.asarray(has_question, dtype=bool)
+
+    return (media_weight_columns(has_media, has_video)
+            * np.where(has_link, LINK_PENALTY, 1.0)
+            * np.where(has_question, QUESTION_BOOST, 1.0)
+            * np.where((text_length > LONGFORM_MIN_LENGTH) & is_premium, LONGFORM_BOOST, 1.0))
+
+def engagement_score_columns(likes, replies, reposts):
+    """
+    compute_engagement_score の列版 (WEIGHTS による重み付き和)
+    """
+    return (np.asarray(likes, dtype=np.float64) * WEIGHTS["like"]
+            + np.asarray(replies, dtype=np.float64) * WEIGHTS["reply"]
+            + np.asarray(reposts, dtype=np.float64) * WEIGHTS["retweet"])
+
+def score_columns(has_media, is_premium, text_length, has_link, has_question,
+                  likes, replies, reposts, has_video=None):
+    """
+    列単位でベースポテンシャルと最終スコアを計算し、(base_potential, final_score) を返す
+    """
+    base_potential = base_potential_columns(has_media, is_premium, text_length,
+                                            has_link, has_question, has_video)
+    final_score = engagement_score_columns(likes, replies, reposts) * base_potential
+    return base_potential, final_score
+
+def columns_from_posts(posts):
+    """
+    PostCandidate の iterable から score_columns 用の列 (dict of ndarray) を組み立てる
+    """
+    posts = list(posts)
+    n = len(posts)
+    columns = {
+        "has_media": np.empty(n, dtype=bool),
+        "has_video": np.empty(n, dtype=bool),
+        "is_premium": np.empty(n, dtype=bool),
+        "text_length": np.empty(n, dtype=np.int64),
+        "has_link": np.empty(n, dtype=bool),
+        "has_question": np.empty(n, dtype=bool),
+        "likes": np.empty(n, dtype=np.float64),
+        "replies": np.empty(n, dtype=np.float64),
+        "reposts": np.empty(n, dtype=np.float64),
+    }
+    for i, post in enumerate(posts):
+        features = post_features(post)
+        columns["has_media"][i] = post.has_media
+        columns["has_video"][i] = post.has_video
+        columns["is_premium"][i] = post.is_premium
+        columns["text_length"][i] = features.length
+        columns["has_link"][i] = features.url_count > 0
+        columns["has_question"][i] = features.question_marks > 0
+        columns["likes"][i] = post.likes
+        columns["replies"][i] = post.replies
+        columns["reposts"][i] = post.reposts
+    return columns
+
+class CandidateTable:
+    """
+    PostCandidate を列ごとの配列 (struct-of-arrays) で保持するコンテナ
+    1件あたり数十バイトで済むので、数百万件規模のランキングシミュレーションに使う。
+    table[i] で PostCandidate を取り出せるので、各ステージ関数はそのまま使える。
+    keep_text=False の場合はテキストを保持せず、スコア計算に必要な特徴量だけを持つ
+    追加時に STAGE 2 の足切りを実行し、DROP された投稿は flags の FLAG_DROPPED で保持する
+    """
+
+    def __init__(self, keep_text=True):
+        self.keep_text = keep_text
+        self.texts = []
+        self.flags = array("H")
+        self.text_length = array("I")
+        self.follower_count = array("q")
+        self.likes = array("d")
+        self.replies = array("d")
+        self.reposts = array("d")
+
+    @classmethod
+    def from_posts(cls, posts, keep_text=True, matcher=None):
+        table = cls(keep_text=keep_text)
+        table.extend(posts, matcher)
+        return table
+
+    def append(self, post, matcher=None):
+        """
+        matcher: STAGE 2 で使うミュートワードのマッチャー (省略時は既定リスト)
+        """
+        status, _ = stage_2_filtering_pre_scoring(post, matcher)
+        features = post_features(post)
+        flags = post.flags & INPUT_FLAGS
+        if status == "DROP":
+            flags |= FLAG_DROPPED
+        if features.url_count:
+            flags |= FLAG_HAS_LINK
+        if features.question_marks:
+            flags |= FLAG_HAS_QUESTION
+        if self.keep_text:
+            self.texts.append(post.text)
+        self.flags.append(flags)
+        self.text_length.append(features.length)
+        self.follower_count.append(post.follower_count)
+        self.likes.append(post.likes)
+        self.replies.append(post.replies)
+        self.reposts.append(post.reposts)
+
+    def extend(self, posts, matcher=None):
+        for post in posts:
+            self.append(post, matcher)
+
+    def __len__(self):
+        return len(self.flags)
+
+    def __getitem__(self, i):
+        if not self.keep_text:
+            raise ValueError("keep_text=False のテーブルからは PostCandidate を復元できません")
+        flags = self.flags[i]
+        return PostCandidate(self.texts[i], bool(flags & FLAG_HAS_MEDIA), bool(flags & FLAG_PREMIUM),
+                             self.follower_count[i], likes=self.likes[i],
+                             replies=self.replies[i], reposts=self.reposts[i],
+                             has_video=bool(flags & FLAG_HAS_VIDEO))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self):
+        """
+        数値列が使っているバイト数 (テキストは含まない)
+        """
+        return sum(col.itemsize * len(col) for col in (
+            self.flags, self.text_length, self.follower_count,
+            self.likes, self.replies, self.reposts))
+
+    def columns(self):
+        """
+        score_columns にそのまま渡せる列 (配列をコピーせずに NumPy から参照する)
+        戻り値の配列を保持している間は、バッファを共有しているため append できない
+        """
+        flags = np.frombuffer(self.flags, dtype=np.uint16)
+        return {
+            "has_media": (flags & FLAG_HAS_MEDIA) != 0,
+            "has_video": (flags & FLAG_HAS_VIDEO) != 0,
+            "is_premium": (flags & FLAG_PREMIUM) != 0,
+            "text_length": np.frombuffer(self.text_length, dtype=np.uint32),
+            "has_link": (flags & FLAG_HAS_LINK) != 0,
+            "has_question": (flags & FLAG_HAS_QUESTION) != 0,
+            "likes": np.frombuffer(self.likes, dtype=np.float64),
+            "replies": np.frombuffer(self.replies, dtype=np.float64),
+            "reposts": np.frombuffer(self.reposts, dtype=np.float64),
+        }
+
+    @property
+    def dropped(self):
+        """
+        STAGE 2 で DROP されたか (bool の配列)
+        """
+        return (np.frombuffer(self.flags, dtype=np.uint16) & FLAG_DROPPED) != 0
+
+    def score(self):
+        """
+        テーブル全体の (base_potential, final_score) を列単位で計算する
+        STAGE 2 で DROP された投稿の final_score は score_post と同じく 0
+        """
+        base_potential, final_score = score_columns(**self.columns())
+        final_score[self.dropped] = 0.0
+        return base_potential, final_score
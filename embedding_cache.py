@@ -0,0 +1,196 @@
+"""
+コンテンツハッシュをキーにした埋め込み・推論結果のディスクキャッシュ
+
+同じ画像やテキスト (リポストされた素材、編集中の下書き、what-if の再実行) を
+何度もモデルに通さないよう、内容のハッシュ + モデルのバージョンをキーにして
+埋め込みベクトルと分類器の出力を保存する。
+- ベクトルは固定サイズの memmap (capacity 行 x dim 列の float32) に置く
+- キー → 行番号・最終使用時刻・出力 は SQLite のインデックスで管理する
+- 満杯になったら最終使用時刻が古いものから行を再利用する (サイズは capacity で上限)
+- ワーカープロセス間で共有するので、読み書きはディレクトリのファイルロックを取って行う。
+  書き込みは「追い出し (コミット) → ベクトルの書き込み → 行の登録 (コミット)」の順にするので、
+  途中で失敗しても、登録済みのキーが別のベクトルを指すことはない
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from file_lock import file_lock
+
+DEFAULT_CAPACITY = 100_000
+
+# モデル側で使うキャッシュの保存先と件数 (保存先が未設定ならキャッシュしない)
+CACHE_DIR = os.environ.get("XSCORER_EMBEDDING_CACHE_DIR") or None
+CACHE_ITEMS = int(os.environ.get("XSCORER_EMBEDDING_CACHE_ITEMS", DEFAULT_CAPACITY))
+
+def content_key(content, model_version):
+    """
+    内容 (bytes / str) とモデルのバージョンからキャッシュキーを作る
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(model_version.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(content)
+    return digest.hexdigest()
+
+class EmbeddingCache:
+    """
+    directory: キャッシュの保存先 (vectors.f32 / index.sqlite / meta.json)
+    dim: 埋め込みの次元数。既存のキャッシュと dim / capacity が違う場合は作り直す
+    """
+
+    def __init__(self, directory, dim, capacity=DEFAULT_CAPACITY):
+        self.directory = directory
+        self.dim = dim
+        self.capacity = capacity
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+        meta_path = os.path.join(directory, "meta.json")
+        vectors_path = os.path.join(directory, "vectors.f32")
+        index_path = os.path.join(directory, "index.sqlite")
+        # ワーカープロセスが同時に開くので、作り直しは1プロセスずつロックを取って行う
+        self._lock_path = os.path.join(directory, ".lock")
+        with file_lock(self._lock_path):
+            self._rebuild_if_needed(meta_path, vectors_path, index_path)
+            self._vectors = np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(capacity, dim))
+        self._db = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, slot INTEGER UNIQUE NOT NULL,"
+            " last_used REAL NOT NULL, output TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+    def _rebuild_if_needed(self, meta_path, vectors_path, index_path):
+        meta = {"dim": self.dim, "capacity": self.capacity}
+        if os.path.exists(meta_path) and os.path.exists(vectors_path):
+            with open(meta_path, encoding="utf-8") as f:
+                if json.load(f) == meta:
+                    return
+        # meta.json は最後に書くので、途中で落ちても次回は作り直しになる
+        for path in (meta_path, vectors_path, index_path, index_path + "-wal", index_path + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        vectors = np.memmap(vectors_path, dtype=np.float32, mode="w+", shape=(self.capacity, self.dim))
+        vectors.flush()
+        del vectors
+        tmp_path = meta_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get_many(self, keys):
+        """
+        キャッシュにあるキーだけを {key: (embedding, output)} で返す (embedding はコピー)
+        """
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        found = {}
+        now = time.time()
+        with self._lock, file_lock(self._lock_path):
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, slot, output FROM entries WHERE key IN ({','.join('?' * len(part))})",
+                    part).fetchall()
+                for key, slot, output in rows:
+                    found[key] = (np.array(self._vectors[slot]),
+                                  json.loads(output) if output is not None else None)
+            if found:
+                self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?",
+                                     [(now, key) for key in found])
+        return found
+
+    def put_many(self, items):
+        """
+        items: (key, embedding, output) の iterable。output は JSON にできる値 (または None)
+        """
+        items = list({key: (key, embedding, output) for key, embedding, output in items}.values())
+        if not items:
+            return
+        now = time.time()
+        with self._lock, file_lock(self._lock_path):
+            # 1. 行の割り当て (追い出したエントリの削除) をコミットする。ここで失敗してもベクトルは書いていない
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                existing = {}
+                keys = [key for key, _, _ in items]
+                for start in range(0, len(keys), 500):
+                    part = keys[start:start + 500]
+                    existing.update(self._db.execute(
+                        f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(part))})",
+                        part).fetchall())
+                needed = sum(1 for key, _, _ in items if key not in existing)
+                # 同じバッチで更新するキーは追い出さない。行が足りない分の新しいキーは保存しない
+                slots = self._allocate(needed, protected=existing)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            slots.reverse()
+            rows = []
+            for key, embedding, output in items:
+                slot = existing.get(key)
+                if slot is None:
+                    if not slots:
+                        continue
+                    slot = slots.pop()
+                rows.append((key, slot, now, json.dumps(output) if output is not None else None))
+                # 2. ベクトルの書き込み (新しい行はまだどのキーからも参照されていない)
+                self._vectors[slot] = np.asarray(embedding, dtype=np.float32)
+            self._vectors.flush()
+            # 3. 書き込んだ行をキーに登録する
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO entries (key, slot, last_used, output) VALUES (?, ?, ?, ?)", rows)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _allocate(self, n, protected=()):
+        # 空き行を先に使い、足りなければ最終使用時刻が古いエントリを追い出して再利用する
+        # protected のキーは追い出さないので、返す行数は n より少ないことがある
+        n = min(n, self.capacity - len(protected))
+        if n <= 0:
+            return []
+        used = self._db.execute("SELECT COUNT(*), COALESCE(MAX(slot), -1) FROM entries").fetchone()
+        count, max_slot = used
+        slots = []
+        if count == max_slot + 1:
+            # 行番号が詰まっている (途中の削除がない) ので末尾から払い出す
+            slots = list(range(max_slot + 1, min(max_slot + 1 + n, self.capacity)))
+        else:
+            taken = {row[0] for row in self._db.execute("SELECT slot FROM entries")}
+            for slot in range(self.capacity):
+                if len(slots) == n:
+                    break
+                if slot not in taken:
+                    slots.append(slot)
+        if len(slots) < n:
+            wanted = n - len(slots)
+            rows = self._db.execute("SELECT key, slot FROM entries ORDER BY last_used LIMIT ?",
+                                    (wanted + len(protected),)).fetchall()
+            victims = [(key, slot) for key, slot in rows if key not in protected][:wanted]
+            self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in victims])
+            slots.extend(slot for _, slot in victims)
+        return slots
+
+    def close(self):
+        with self._lock:
+            self._vectors.flush()
+            self._db.close()
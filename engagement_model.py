@@ -0,0 +1,228 @@
+"""
+STAGE 3 のエンゲージメント予測 (P(like) / P(reply) / P(repost))
+
+手入力の予想いいね数などの代わりに、ローカルのテキストモデルで投稿ごとの
+エンゲージメント確率を予測する。モデルは transformers の
+AutoModelForSequenceClassification (num_labels=3、ラベルごとに sigmoid) を
+save_pretrained したディレクトリを想定している。
+アカウント特徴量 (Premium・メディア・フォロワー数の桁) は、学習時と同じ形式の
+タグとしてテキストの先頭に付けて入力する (account_prefix 参照)。
+トークナイズはパディングなしでまとめて行い、トークン長の近いものどうしで組んだ
+バッチごとに、そのバッチの最大長までだけパディングする (length_bucketing 参照)。
+"""
+import math
+import os
+import threading
+import weakref
+
+import numpy as np
+
+from embedding_cache import CACHE_DIR, CACHE_ITEMS, EmbeddingCache, content_key
+from lazy_import import LazyModule
+from length_bucketing import LengthBucketScheduler
+from microbatch import DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT_MS, MicroBatcher
+from model_registry import REGISTRY, estimate_model_bytes, model_key
+from model_variants import OnnxRunner, export_onnx, quantize_dynamic_int8, resolve_variant, weights_fingerprint
+
+torch = LazyModule("torch")
+transformers = LazyModule("transformers")
+
+# モデルの出力の順序 (WEIGHTS のキー)。PostCandidate の likes / replies / reposts に対応する
+ENGAGEMENT_LABELS = ("like", "reply", "retweet")
+
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_MAX_LENGTH = 128
+
+def account_prefix(post):
+    """
+    アカウント特徴量のタグ。フォロワー数は桁 (log10) に丸める
+    """
+    media = "video" if post.has_video else "image" if post.has_media else "none"
+    followers = int(math.log10(post.follower_count + 1)) if post.follower_count > 0 else 0
+    return f"[premium={int(post.is_premium)}] [media={media}] [followers=1e{followers}] "
+
+def model_input_text(post):
+    return account_prefix(post) + post.text
+
+def expected_counts(probabilities, follower_count):
+    """
+    エンゲージメント確率 (N, 3) を予想件数にする (フォロワー全員に1回ずつ表示されると仮定)
+    """
+    impressions = np.asarray(follower_count, dtype=np.float64).reshape(-1, 1)
+    return np.asarray(probabilities, dtype=np.float64) * np.maximum(impressions, 0.0)
+
+def _logits_module(model, input_names):
+    """
+    位置引数の入力 -> logits だけを返す nn.Module (ONNX 書き出し用)
+    """
+    class SequenceLogits(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).logits
+
+    return SequenceLogits().eval()
+
+class EngagementPredictor:
+    """
+    model_dir: AutoModelForSequenceClassification / AutoTokenizer を save_pretrained したディレクトリ
+    (ネットワークには接続せず、ローカルのファイルだけを読む)
+    variant: fp32 / int8 / onnx (省略時は XSCORER_MODEL_VARIANT)
+    max_batch_tokens: 1バッチのパディング込みトークン数の上限 (省略時は件数 batch_size のみで区切る)
+    cache_dir: 予測結果のキャッシュの保存先 (省略時は XSCORER_EMBEDDING_CACHE_DIR、未設定なら使わない)
+    """
+
+    def __init__(self, model_dir, batch_size=DEFAULT_BATCH_SIZE, max_length=DEFAULT_MAX_LENGTH,
+                 num_threads=None, variant=None, onnx_path=None, cache_dir=CACHE_DIR, cache_items=CACHE_ITEMS,
+                 max_batch_tokens=None):
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.scheduler = LengthBucketScheduler(batch_size, max_tokens=max_batch_tokens)
+        self.variant = resolve_variant(variant)
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(model_dir, local_files_only=True)
+        self.model = transformers.AutoModelForSequenceClassification.from_pretrained(
+            model_dir, local_files_only=True).eval()
+        if self.model.config.num_labels != len(ENGAGEMENT_LABELS):
+            raise ValueError(f"エンゲージメント予測モデルの出力数は {len(ENGAGEMENT_LABELS)} である必要があります: "
+                             f"{self.model.config.num_labels}")
+        self._input_names = tuple(self.tokenizer.model_input_names)
+        # キャッシュのキーにはバリアント変換前の重みのハッシュを使う (同じディレクトリ名でも重みが違えば別エントリ)
+        weights = weights_fingerprint(self.model) if cache_dir else None
+
+        self._onnx = None
+        if self.variant == "int8":
+            self.model = quantize_dynamic_int8(self.model)
+        elif self.variant == "onnx":
+            example = self.tokenizer(["example"], return_tensors="pt")
+            dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in self._input_names}
+            dynamic_axes["logits"] = {0: "batch"}
+            onnx_path = onnx_path or os.path.join(model_dir, "onnx", "engagement.onnx")
+            onnx_path = export_onnx(_logits_module(self.model, self._input_names),
+                                    tuple(example[name] for name in self._input_names), onnx_path,
+                                    input_names=self._input_names, output_names=("logits",),
+                                    dynamic_axes=dynamic_axes)
+            self._onnx = OnnxRunner(onnx_path, num_threads=num_threads)
+            self.model = None
+
+        self.cache = None
+        self.model_version = f"{weights}-{self.variant}|max_length={max_length}"
+        if cache_dir:
+            self.cache = EmbeddingCache(os.path.join(cache_dir, "engagement"),
+                                        dim=len(ENGAGEMENT_LABELS), capacity=cache_items)
+            # ModelRegistry から解放されても使用中の呼び出し元がいるので、最後の参照が無くなったときに閉じる
+            self._finalizer = weakref.finalize(self, self.cache.close)
+
+    @property
+    def name(self):
+        return f"{os.path.basename(os.path.normpath(self.model_dir))}-{self.variant}"
+
+    def memory_bytes(self):
+        if self._onnx is not None:
+            return self._onnx.memory_bytes()
+        return estimate_model_bytes(self.model)
+
+    def close(self):
+        """
+        予測結果のキャッシュを閉じる (閉じた後はキャッシュを使わない)
+        呼ばなくても、最後の参照が無くなったときに閉じられる
+        """
+        if self.cache is not None:
+            self._finalizer()
+            self.cache = None
+
+    def _logits(self, batch):
+        if self._onnx is not None:
+            (logits,) = self._onnx.run(**{name: batch[name].numpy() for name in self._input_names})
+            return logits
+        with torch.inference_mode():
+            return self.model(**{name: batch[name] for name in self._input_names}).logits.numpy()
+
+    def predict_texts(self, texts):
+        """
+        テキストのリストに対するエンゲージメント確率 (N, 3) を返す
+        """
+        texts = list(texts)
+        probabilities = np.empty((len(texts), len(ENGAGEMENT_LABELS)), dtype=np.float32)
+        if not texts:
+            return probabilities
+        # パディングせずにまとめてトークナイズし、長さの近いものどうしでバッチを作る
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length)
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        for indices in self.scheduler.plan(lengths):
+            features = [{name: encoded[name][i] for name in self._input_names} for i in indices]
+            # バッチ内の最大長までだけパディングする
+            batch = self.tokenizer.pad(features, return_tensors="pt")
+            probabilities[indices] = 1.0 / (1.0 + np.exp(-self._logits(batch)))
+        return probabilities
+
+    def predict_posts(self, posts):
+        """
+        PostCandidate のリストに対するエンゲージメント確率 (N, 3) を返す (キャッシュ済みはモデルに通さない)
+        """
+        texts = [model_input_text(post) for post in posts]
+        if self.cache is None:
+            return self.predict_texts(texts)
+
+        probabilities = np.empty((len(texts), len(ENGAGEMENT_LABELS)), dtype=np.float32)
+        keys = [content_key(text, self.model_version) for text in texts]
+        cached = self.cache.get_many(keys)
+        pending = []
+        for i, key in enumerate(keys):
+            if key in cached:
+                probabilities[i] = cached[key][0]
+            else:
+                pending.append(i)
+        if pending:
+            predicted = self.predict_texts([texts[i] for i in pending])
+            probabilities[pending] = predicted
+            self.cache.put_many((keys[i], row, None) for i, row in zip(pending, predicted))
+        return probabilities
+
+    def predict_engagement(self, posts):
+        """
+        PostCandidate のリストに対する予想件数 (N, 3) = [likes, replies, reposts] を返す
+        """
+        return expected_counts(self.predict_posts(posts), [post.follower_count for post in posts])
+
+    def apply(self, posts):
+        """
+        各投稿の likes / replies / reposts を予想件数で置き換える
+        """
+        for post, (likes, replies, reposts) in zip(posts, self.predict_engagement(posts)):
+            post.likes = float(likes)
+            post.replies = float(replies)
+            post.reposts = float(reposts)
+
+def get_engagement_predictor(model_dir, variant=None, **kwargs):
+    """
+    プロセス共通の ModelRegistry から予測モデルを取得する (プロセスごとに1回だけロード)
+    variant と kwargs (num_threads など) の組み合わせごとに別のモデルとしてロードする
+    """
+    variant = resolve_variant(variant)
+    return REGISTRY.get(model_key("engagement", model_dir, variant, **kwargs),
+                        lambda: EngagementPredictor(model_dir, variant=variant, **kwargs))
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+def get_engagement_batcher(model_dir, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                           variant=None):
+    """
+    1件ずつ届く投稿のエンゲージメント予測をまとめて推論する、プロセス共通の MicroBatcher
+    batcher(post) で その投稿の予想件数 [likes, replies, reposts] が返る
+    variant: モデルのバリアント (省略時は XSCORER_MODEL_VARIANT)。バリアントごとに別の MicroBatcher になる
+    """
+    variant = resolve_variant(variant)
+    key = (variant, os.path.abspath(model_dir))
+    with _batchers_lock:
+        batcher = _batchers.get(key)
+        if batcher is None:
+            batcher = _batchers[key] = MicroBatcher(
+                lambda posts: list(get_engagement_predictor(model_dir, variant).predict_engagement(posts)),
+                max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, name="engagement-batcher")
+        return batcher
@@ -0,0 +1,109 @@
+"""
+重み変更時のインクリメンタル再スコアリング
+
+WEIGHTS に依存しない投稿ごとの特徴量 (コンテンツ係数・メディア有無・足切り結果) と
+エンゲージメント行列を一度だけ計算して保持し、重みを変えたときは
+行列ベクトル積だけで全件の最終スコアを計算し直す。
+"""
+import numpy as np
+
+from columnar import FLAG_HAS_LINK, FLAG_HAS_QUESTION, CandidateTable, media_weight_columns
+from pipeline import (
+    FLAG_HAS_MEDIA,
+    FLAG_HAS_VIDEO,
+    FLAG_PREMIUM,
+    LINK_PENALTY,
+    LONGFORM_BOOST,
+    LONGFORM_MIN_LENGTH,
+    QUESTION_BOOST,
+    WEIGHTS,
+)
+
+# エンゲージメント行列の列と対応する WEIGHTS のキー
+ENGAGEMENT_KEYS = ("like", "reply", "retweet")
+
+class FeatureStore:
+    """
+    engagement: (N, 3) の [likes, replies, reposts]
+    content_factor: リンク・疑問形・長文の係数の積 (重みに依存しない部分)
+    has_media: メディアブーストの対象か
+    dropped: STAGE 2 で DROP されたか (スコアは常に 0)
+    has_video: メディアが動画か (省略時はすべて画像)
+    """
+
+    def __init__(self, engagement, content_factor, has_media, dropped, has_video=None):
+        self.engagement = np.ascontiguousarray(engagement, dtype=np.float64)
+        self.content_factor = np.asarray(content_factor, dtype=np.float64)
+        self.has_media = np.asarray(has_media, dtype=bool)
+        self.dropped = np.asarray(dropped, dtype=bool)
+        if has_video is None:
+            has_video = np.zeros(len(self.has_media), dtype=bool)
+        self.has_video = np.asarray(has_video, dtype=bool)
+
+    @classmethod
+    def from_posts(cls, posts, matcher=None):
+        """
+        PostCandidate から特徴量を作る (STAGE 2 の足切りもここで1回だけ実行する)
+        """
+        return cls.from_table(CandidateTable.from_posts(posts, keep_text=False, matcher=matcher))
+
+    @classmethod
+    def from_table(cls, table, dropped=None):
+        """
+        CandidateTable から特徴量を作る
+        dropped: STAGE 2 の DROP 判定 (省略時はテーブルに追加したときの判定)
+        """
+        flags = np.frombuffer(table.flags, dtype=np.uint16)
+        text_length = np.frombuffer(table.text_length, dtype=np.uint32)
+        longform = (text_length > LONGFORM_MIN_LENGTH) & ((flags & FLAG_PREMIUM) != 0)
+        content_factor = (np.where((flags & FLAG_HAS_LINK) != 0, LINK_PENALTY, 1.0)
+                          * np.where((flags & FLAG_HAS_QUESTION) != 0, QUESTION_BOOST, 1.0)
+                          * np.where(longform, LONGFORM_BOOST, 1.0))
+        engagement = np.column_stack([
+            np.frombuffer(table.likes, dtype=np.float64),
+            np.frombuffer(table.replies, dtype=np.float64),
+            np.frombuffer(table.reposts, dtype=np.float64),
+        ])
+        if dropped is None:
+            dropped = table.dropped
+        return cls(engagement, content_factor, (flags & FLAG_HAS_MEDIA) != 0, dropped,
+                   has_video=(flags & FLAG_HAS_VIDEO) != 0)
+
+    def __len__(self):
+        return len(self.content_factor)
+
+    def base_potential(self, weights=None):
+        return self.content_factor * media_weight_columns(self.has_media, self.has_video, weights)
+
+    def rescore(self, weights=None):
+        """
+        指定した重み (省略時は現在の WEIGHTS) で全件の最終スコアを計算する
+        """
+        weights = WEIGHTS if weights is None else weights
+        weight_vector = np.array([weights[key] for key in ENGAGEMENT_KEYS], dtype=np.float64)
+        scores = (self.engagement @ weight_vector) * self.base_potential(weights)
+        scores[self.dropped] = 0.0
+        return scores
+
+    def top_k(self, k, weights=None):
+        """
+        指定した重みでのスコア上位 k 件のインデックスを降順で返す
+        """
+        scores = self.rescore(weights)
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.intp)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def save(self, path):
+        np.savez(path, engagement=self.engagement, content_factor=self.content_factor,
+                 has_media=self.has_media, dropped=self.dropped, has_video=self.has_video)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            # has_video がない古いファイルはメディアをすべて画像とみなす
+            has_video = data["has_video"] if "has_video" in data.files else None
+            return cls(data["engagement"], data["content_factor"], data["has_media"], data["dropped"],
+                       has_video=has_video)
@@ -0,0 +1,63 @@
+"""
+投稿テキストの特徴量抽出
+
+各ステージが個別に行っていた lower() / キーワード判定 / ハッシュタグ・URL の
+正規表現 / 疑問符判定 / len() を投稿ごとに1回の抽出にまとめ、コンパクトな
+PostFeatures レコードを作る。各ステージはこのレコードだけを参照する。
+"""
+import re
+from collections import namedtuple
+
+# X の文字数カウント (twitter-text v3) で1文字=1とみなす範囲。それ以外 (CJK・絵文字など) は2文字換算
+_NARROW_RANGES = "\u0000-\u10ff\u2000-\u200d\u2010-\u201f\u2032-\u2037"
+
+# 各パターンはリテラルの先頭文字 ("#" / "http") を持つので、re の高速な前方検索が効く。
+# 1つの選択パターンに融合するとこの最適化が効かなくなり、かえって遅くなる。
+_HASHTAG_PATTERN = re.compile(r"#\w+")
+# URL は別の URL の手前で切り、連続した URL もそれぞれ数える ("h" のときだけ先読みする)
+_URL_PATTERN = re.compile(r"http[s]?://[^\sh]*(?:h(?!ttps?://)[^\sh]*)*")
+_NARROW_PATTERN = re.compile("[" + _NARROW_RANGES + "]+")
+
+PostFeatures = namedtuple(
+    "PostFeatures",
+    [
+        "length",           # 文字数 (len)
+        "weighted_length",  # X 換算の文字数 (CJK・絵文字は2)
+        "hashtag_count",    # #\w+ の個数
+        "url_count",        # http(s):// の個数
+        "url_spans",        # URL の (開始, 終了) のタプル
+        "question_marks",   # "?" / "？" の個数
+        "keyword_hits",     # ヒットしたミュートワードのタプル
+        "keyword_source",   # keyword_hits を判定したマッチャーの fingerprint (判定していなければ None)
+    ],
+)
+
+def extract_features(text, matcher=None):
+    """
+    テキストから PostFeatures を作る
+    matcher: KeywordMatcher / SwappableMatcher (None の場合はキーワード判定を行わない)
+    """
+    length = len(text)
+
+    weighted_length = length
+    if not text.isascii():
+        # 1文字換算の文字を取り除いた残りが2文字換算の文字
+        weighted_length += len(_NARROW_PATTERN.sub("", text))
+
+    url_spans = ()
+    if "http" in text:
+        url_spans = tuple([m.span() for m in _URL_PATTERN.finditer(text)])
+
+    hashtag_count = 0
+    if "#" in text:
+        hashtag_count = len(_HASHTAG_PATTERN.findall(text))
+
+    keyword_hits, keyword_source = (), None
+    if matcher is not None:
+        # SwappableMatcher は走査中に差し替わることがあるので、走査するマッチャーを先に固定する
+        matcher = getattr(matcher, "matcher", matcher)
+        keyword_hits = tuple(matcher.find_all_lowered(text.lower()))
+        keyword_source = matcher.fingerprint
+
+    return PostFeatures(length, weighted_length, hashtag_count, len(url_spans), url_spans,
+                        text.count("?") + text.count("？"), keyword_hits, keyword_source)
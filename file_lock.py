@@ -0,0 +1,30 @@
+"""
+プロセス間の排他用のファイルロック
+
+ワーカープロセスが同時に起動して、同じキャッシュディレクトリや ONNX ファイルを
+作ろうとしたときに1プロセスずつ作らせるために使う。fcntl が無い環境 (Windows) では
+ロックせずにそのまま実行する。
+"""
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+@contextmanager
+def file_lock(path):
+    """
+    path (ロック用のファイル。無ければ作る) の排他ロックを取っている間だけ with ブロックを実行する
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
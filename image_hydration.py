@@ -0,0 +1,149 @@
+"""
+投稿に添付された画像ファイルのデコード (ハイドレーション)
+
+CLIP に入力するのは短辺 224px 程度なので、フル解像度の写真を全部デコードする
+必要はない。JPEG は draft モードで DCT の段階で縮小してデコードし、それ以外も
+reduce (整数倍の縮小) + thumbnail で、短辺が目標サイズになる程度まで小さくする。
+デコードはスレッドプールで行い (Pillow のデコード中は GIL が解放される)、
+デコード中・消費待ちの画像の合計バイト数に上限を設けてメモリを抑える。
+"""
+import io
+import math
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from lazy_import import LazyModule
+
+PIL_Image = LazyModule("PIL.Image")
+
+# 短辺をこのサイズまで縮小する (CLIP の入力サイズ)
+DEFAULT_SIZE = 224
+DEFAULT_MAX_INFLIGHT_BYTES = int(os.environ.get("XSCORER_IMAGE_INFLIGHT_MB", 256)) * 1024 * 1024
+DEFAULT_MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+def read_image_bytes(item):
+    """
+    パス / ファイルオブジェクト (Streamlit の UploadedFile など) の中身をバイト列で返す
+    """
+    if isinstance(item, (str, os.PathLike)):
+        with open(item, "rb") as f:
+            return f.read()
+    if hasattr(item, "getvalue"):
+        return item.getvalue()
+    item.seek(0)
+    return item.read()
+
+def _open(item):
+    if isinstance(item, PIL_Image.Image):
+        return item
+    if isinstance(item, (str, os.PathLike)):
+        return PIL_Image.open(item)
+    # ファイルオブジェクトは読み取り位置を共有しないよう、メモリ上のコピーから開く
+    return PIL_Image.open(io.BytesIO(read_image_bytes(item)))
+
+def _draft(image, size):
+    # 短辺が size 以上に保たれる範囲で、JPEG のデコード時の縮小を指定する (他の形式では何もしない)
+    if getattr(image, "format", None) == "JPEG":
+        width, height = image.size
+        scale = size / min(width, height)
+        if scale < 1:
+            image.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+
+def _target_size(image, size):
+    width, height = image.size
+    scale = size / min(width, height)
+    if scale >= 1:
+        return None
+    return math.ceil(width * scale), math.ceil(height * scale)
+
+def image_errors():
+    """
+    読めない・壊れた画像で送出される例外 (except 節で使う。PIL は例外が起きたときに初めて参照する)
+    PIL.UnidentifiedImageError は OSError のサブクラス
+    """
+    return (OSError, ValueError, PIL_Image.DecompressionBombError)
+
+def decoded_bytes(item, size=DEFAULT_SIZE):
+    """
+    デコード時に確保される画素データのバイト数の見積もり (ヘッダーだけを読む)
+    """
+    if isinstance(item, PIL_Image.Image):
+        return item.size[0] * item.size[1] * 3
+    with _open(item) as image:
+        if size:
+            _draft(image, size)
+        return image.size[0] * image.size[1] * max(len(image.getbands()), 3)
+
+def decode_image(item, size=DEFAULT_SIZE):
+    """
+    PIL.Image / パス / ファイルオブジェクトを RGB の PIL.Image にする (常に新しい画像を返す)
+    size を指定すると短辺がおよそ size になるまで縮小する (拡大はしない)。None ならフル解像度
+    """
+    source = _open(item)
+    try:
+        image = source
+        if size:
+            if source is not item:
+                _draft(source, size)
+            box = _target_size(source, size)
+            if box is not None:
+                # reducing_gap: 大きな縮小は reduce (整数倍の平均) を先に行ってから補間する
+                image = source.resize(box, PIL_Image.Resampling.BICUBIC, reducing_gap=2.0)
+        return image.convert("RGB")
+    finally:
+        if source is not item:
+            source.close()
+
+def decode_image_or_none(item, size=DEFAULT_SIZE):
+    """
+    decode_image と同じだが、読めない・壊れた画像では例外を送出せずに None を返す
+    """
+    try:
+        return decode_image(item, size)
+    except image_errors():
+        return None
+
+class ImageHydrator:
+    """
+    画像をスレッドプールでデコードし、入力順に返す
+    max_inflight_bytes: デコード中・消費待ちの画像の見積もりバイト数の上限
+    (1枚で上限を超える画像も、他に処理中のものがなければ処理する)
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, max_workers=None, max_inflight_bytes=DEFAULT_MAX_INFLIGHT_BYTES):
+        self.size = size
+        self.max_inflight_bytes = max_inflight_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or DEFAULT_MAX_WORKERS,
+                                            thread_name_prefix="image-hydration")
+
+    def iter_hydrate(self, items):
+        """
+        items を RGB の PIL.Image にして1枚ずつ yield する (順序は入力と同じ)
+        読めない・壊れた画像は None を yield する
+        """
+        pending = deque()
+        inflight = 0
+        for item in items:
+            try:
+                cost = decoded_bytes(item, self.size)
+            except image_errors():
+                # ヘッダーが読めない画像はデコードせずに None にする
+                pending.append((None, 0))
+                continue
+            # 上限を超えるなら、先頭から消費してメモリが空くのを待つ
+            while pending and inflight + cost > self.max_inflight_bytes:
+                future, done_cost = pending.popleft()
+                inflight -= done_cost
+                yield future.result() if future is not None else None
+            pending.append((self._executor.submit(decode_image_or_none, item, self.size), cost))
+            inflight += cost
+        while pending:
+            future, _ = pending.popleft()
+            yield future.result() if future is not None else None
+
+    def hydrate(self, items):
+        return list(self.iter_hydrate(items))
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,212 @@
+"""
+STAGE 2 のスパム/ミュートワード判定用 Aho-Corasick マッチャー
+
+キーワード数に関係なく、テキストを1回走査するだけで全ヒットを検出する。
+テナントごとのミュートリスト (数万語規模) を想定している。
+既定リストのような小さいリストでは、同じトライ木を正規表現にコンパイルして
+C 実装の re で走査する (1文字ずつの Python ループより大幅に速い)。
+"""
+import hashlib
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# これ以下のキーワード数ならトライ木を正規表現にコンパイルして走査する
+REGEX_MAX_KEYWORDS = 256
+
+class KeywordMatcher:
+    """
+    Aho-Corasick オートマトン (大文字小文字は区別しない)
+    構築後は読み取り専用なので、複数スレッドから同時に使ってよい
+    """
+
+    def __init__(self, keywords):
+        # 重複と空文字を除き、入力順を保ったまま小文字化
+        self.keywords = tuple(dict.fromkeys(k.lower() for k in keywords if k))
+        # キーワードリストの識別子 (同じリストなら別インスタンス・別プロセスでも同じ値)
+        self.fingerprint = hashlib.blake2b("\0".join(self.keywords).encode("utf-8"), digest_size=8).hexdigest()
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        self._terminal = [None]
+        self._build()
+        self._pattern = self._prefilter = None
+        if len(self.keywords) <= REGEX_MAX_KEYWORDS:
+            trie_regex = self._trie_regex(0)
+            # ヒットなしの投稿がほとんどなので、まず先読みなしの search で足切りする
+            self._prefilter = re.compile(trie_regex)
+            # 各位置で最長一致を先読みする (重なり合うヒットも取りこぼさない)
+            self._pattern = re.compile("(?=(" + trie_regex + "))")
+
+    def _build(self):
+        goto, output = self._goto, self._output
+
+        # 1. トライ木の構築
+        for index, keyword in enumerate(self.keywords):
+            state = 0
+            for ch in keyword:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    self._fail.append(0)
+                    output.append(())
+                    self._terminal.append(None)
+                state = nxt
+            output[state] = output[state] + (index,)
+            self._terminal[state] = index
+
+        # 2. 幅優先で failure リンクを張り、出力を failure 先とマージしておく
+        fail = self._fail
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                if output[fail[nxt]]:
+                    output[nxt] = output[nxt] + output[fail[nxt]]
+
+    def _trie_regex(self, state):
+        """
+        state 以下のトライ木を正規表現に変換する (分岐は先頭文字で決まるので後戻りしない)
+        """
+        leaves, branches = [], []
+        for ch, nxt in sorted(self._goto[state].items()):
+            if self._goto[nxt]:
+                branches.append(re.escape(ch) + self._trie_regex(nxt))
+            else:
+                leaves.append(re.escape(ch))
+        if leaves:
+            branches.append(leaves[0] if len(leaves) == 1 else "[" + "".join(leaves) + "]")
+        if not branches:
+            return ""
+        optional = state and self._terminal[state] is not None
+        if len(branches) == 1 and not (optional and len(branches[0]) > 1):
+            body = branches[0]
+        else:
+            body = "(?:" + "|".join(branches) + ")"
+        if optional:
+            # ここで終わるキーワードもあるので、続きは省略可能 (貪欲に最長一致)
+            body += "?"
+        return body
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def iter_matches(self, text):
+        """
+        (終了位置, キーワード) を yield する
+        """
+        return self.iter_matches_lowered(text.lower())
+
+    def iter_matches_lowered(self, lowered):
+        """
+        小文字化済みのテキストに対する iter_matches (呼び出し側で lower() を共有する用)
+        """
+        if not self.keywords:
+            return iter(())
+        if self._pattern is not None:
+            return self._iter_regex(lowered)
+        return self._iter_automaton(lowered)
+
+    def _iter_regex(self, lowered):
+        first = self._prefilter.search(lowered)
+        if first is None:
+            return
+        goto, terminal, keywords = self._goto, self._terminal, self.keywords
+        for m in self._pattern.finditer(lowered, first.start()):
+            # 最長一致の経路上で終わるキーワードを短い順に列挙する
+            start, state = m.start(), 0
+            for offset, ch in enumerate(m.group(1), 1):
+                state = goto[state][ch]
+                if terminal[state] is not None:
+                    yield start + offset, keywords[terminal[state]]
+
+    def _iter_automaton(self, lowered):
+        goto, fail, output, keywords = self._goto, self._fail, self._output, self.keywords
+        state = 0
+        for pos, ch in enumerate(lowered):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                for index in output[state]:
+                    yield pos + 1, keywords[index]
+
+    def search(self, text):
+        """
+        最初にヒットしたキーワードを返す (ヒットなしは None)
+        """
+        for _, keyword in self.iter_matches(text):
+            return keyword
+        return None
+
+    def find_all(self, text):
+        """
+        ヒットしたキーワードを重複なしで返す
+        """
+        return self.find_all_lowered(text.lower())
+
+    def find_all_lowered(self, lowered):
+        if self._prefilter is not None and self._prefilter.search(lowered) is None:
+            return []
+        return list(dict.fromkeys(keyword for _, keyword in self.iter_matches_lowered(lowered)))
+
+class SwappableMatcher:
+    """
+    ミュートリスト更新時にバックグラウンドでオートマトンを再構築し、
+    完成してから参照を差し替えるホルダー。再構築中も古いマッチャーで判定を続けられる。
+    """
+
+    def __init__(self, keywords=()):
+        self._matcher = KeywordMatcher(keywords)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="keyword-matcher")
+
+    @property
+    def matcher(self):
+        return self._matcher
+
+    @property
+    def fingerprint(self):
+        return self._matcher.fingerprint
+
+    def rebuild(self, keywords):
+        """
+        キーワードリストを差し替える (非同期)。構築完了後の KeywordMatcher を返す Future を返す
+        """
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        return self._executor.submit(self._build_and_swap, tuple(keywords), generation)
+
+    def _build_and_swap(self, keywords, generation):
+        matcher = KeywordMatcher(keywords)
+        with self._lock:
+            # 後から要求された再構築が先に完了していた場合は差し替えない
+            if generation == self._generation:
+                self._matcher = matcher
+        return matcher
+
+    # KeywordMatcher と同じインターフェースで使えるように委譲する
+    def iter_matches(self, text):
+        return self._matcher.iter_matches(text)
+
+    def search(self, text):
+        return self._matcher.search(text)
+
+    def iter_matches_lowered(self, lowered):
+        return self._matcher.iter_matches_lowered(lowered)
+
+    def find_all(self, text):
+        return self._matcher.find_all(text)
+
+    def find_all_lowered(self, lowered):
+        return self._matcher.find_all_lowered(lowered)
@@ -0,0 +1,32 @@
+"""
+重い依存ライブラリ (torch / transformers など) の遅延 import
+
+モジュールの先頭で import すると、テキストだけのスコアリングでも Streamlit の
+ワーカーや CLI の起動ごとに数秒・数百MBのコストがかかる。LazyModule は
+最初に属性へアクセスしたときに初めて本物のモジュールを import する。
+"""
+import importlib
+import sys
+
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self._name!r} ({state})>"
+
+def is_loaded(name):
+    """
+    モジュールがすでに (どこかで) import 済みかどうか
+    """
+    return name in sys.modules
@@ -0,0 +1,140 @@
+"""
+トークン長によるバッチのスケジューリング
+
+投稿の長さは数文字から Premium の長文まで幅があり、入力順のままバッチにすると
+各バッチが最長の投稿に合わせてパディングされ、計算の大半がパディングに使われる。
+トークン長の順に並べて長さの近いものどうしでバッチを組み、結果は元の順序に戻す。
+パディング効率 (実トークン数 / パディング込みのトークン数) を集計して報告する。
+スケジューラーごとの集計に加えて、プロセス全体の集計 PADDING_STATS にも加算する
+(ワーカープロセスの分は parallel.submit_chunk がチャンクの完了時に親プロセスへ合算する)。
+"""
+import threading
+
+DEFAULT_BATCH_SIZE = 32
+
+def padded_tokens(lengths, batches):
+    """
+    batches (インデックスのリストのリスト) をバッチ内の最大長までパディングしたときのトークン数
+    """
+    return sum(max(lengths[i] for i in batch) * len(batch) for batch in batches if batch)
+
+def padding_efficiency(lengths, batches):
+    """
+    実トークン数 / パディング込みのトークン数 (1.0 ならパディングなし)
+    """
+    padded = padded_tokens(lengths, batches)
+    return sum(lengths[i] for batch in batches for i in batch) / padded if padded else 1.0
+
+def plan_batches(lengths, batch_size=DEFAULT_BATCH_SIZE, max_tokens=None):
+    """
+    トークン長の順に並べたインデックスを、長さの近いものどうしのバッチに分ける
+    max_tokens: 1バッチのパディング込みトークン数の上限 (長い投稿のバッチは件数を減らす)
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    batches, batch = [], []
+    for i in order:
+        # 昇順なので、追加する投稿の長さがそのままバッチの最大長になる
+        if batch and (len(batch) >= batch_size
+                      or (max_tokens is not None and (len(batch) + 1) * lengths[i] > max_tokens)):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+class PaddingStats:
+    """
+    パディング効率の集計 (naive_padded_tokens は入力順のままバッチにした場合のパディング込みトークン数)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.naive_padded_tokens = 0
+
+    def add(self, batches, real_tokens, padded_tokens, naive_padded_tokens):
+        with self._lock:
+            self.batches += batches
+            self.real_tokens += real_tokens
+            self.padded_tokens += padded_tokens
+            self.naive_padded_tokens += naive_padded_tokens
+
+    def drain(self):
+        """
+        これまでの集計を (batches, real_tokens, padded_tokens, naive_padded_tokens) で取り出してリセットする
+        (ワーカープロセスから親プロセスへ渡す用)
+        """
+        with self._lock:
+            snapshot = (self.batches, self.real_tokens, self.padded_tokens, self.naive_padded_tokens)
+            self.batches = self.real_tokens = self.padded_tokens = self.naive_padded_tokens = 0
+        return snapshot
+
+    def merge(self, snapshot):
+        self.add(*snapshot)
+
+    @property
+    def padding_efficiency(self):
+        return self.real_tokens / self.padded_tokens if self.padded_tokens else 1.0
+
+    @property
+    def naive_padding_efficiency(self):
+        return self.real_tokens / self.naive_padded_tokens if self.naive_padded_tokens else 1.0
+
+    def metrics(self):
+        return {
+            "batches": self.batches,
+            "real_tokens": self.real_tokens,
+            "padded_tokens": self.padded_tokens,
+            "padding_efficiency": self.padding_efficiency,
+            "naive_padding_efficiency": self.naive_padding_efficiency,
+        }
+
+    def prometheus_text(self, prefix="xscorer"):
+        """
+        Prometheus のテキスト形式 (gauge / counter)。まだバッチがなければ空文字列
+        """
+        if not self.batches:
+            return ""
+        name = f"{prefix}_engagement_padding"
+        return "\n".join([
+            f"# HELP {name}_efficiency Real tokens / padded tokens of length-bucketed engagement batches.",
+            f"# TYPE {name}_efficiency gauge",
+            f'{name}_efficiency{{order="length"}} {self.padding_efficiency:.6f}',
+            f'{name}_efficiency{{order="input"}} {self.naive_padding_efficiency:.6f}',
+            f"# HELP {name}_tokens_total Tokens fed to the engagement model.",
+            f"# TYPE {name}_tokens_total counter",
+            f'{name}_tokens_total{{kind="real"}} {self.real_tokens}',
+            f'{name}_tokens_total{{kind="padded"}} {self.padded_tokens}',
+            f"# HELP {name}_batches_total Length-bucketed engagement batches.",
+            f"# TYPE {name}_batches_total counter",
+            f"{name}_batches_total {self.batches}",
+        ]) + "\n"
+
+# プロセス全体のパディング効率 (全スケジューラーとワーカーの分の合計)
+PADDING_STATS = PaddingStats()
+
+class LengthBucketScheduler:
+    """
+    長さの近い入力でバッチを組むインデックスを plan で返す
+    stats にこのスケジューラーのパディング効率を累積する (PADDING_STATS にも加算する)
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, max_tokens=None):
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.stats = PaddingStats()
+
+    def plan(self, lengths):
+        batches = plan_batches(lengths, self.batch_size, self.max_tokens)
+        naive = [list(range(start, min(start + self.batch_size, len(lengths))))
+                 for start in range(0, len(lengths), self.batch_size)]
+        counts = (len(batches), sum(lengths), padded_tokens(lengths, batches), padded_tokens(lengths, naive))
+        self.stats.add(*counts)
+        PADDING_STATS.add(*counts)
+        return batches
+
+    def metrics(self):
+        return self.stats.metrics()
@@ -0,0 +1,61 @@
+"""
+各ステージが出力するログのコードと表示用メッセージ
+
+ステージはコードとパラメータの組 (LogCode, params) だけを記録し、
+Markdown の文字列は UI やレポートで実際に表示するときに render_log で組み立てる。
+"""
+from enum import IntEnum
+
+class LogCode(IntEnum):
+    # STAGE 1
+    PHOENIX_RETRIEVAL = 101
+    THUNDER_ONLY = 102
+    # STAGE 2
+    MUTED_KEYWORD = 201
+    SPAM_HASHTAGS = 202
+    LOW_QUALITY = 203
+    FILTERING_PASSED = 204
+    # STAGE 3
+    MEDIA_BOOST = 301
+    LINK_PENALTY = 302
+    CONVERSATION_STARTER = 303
+    LONGFORM_BOOST = 304
+    # STAGE 4
+    LOW_SCORE = 401
+    HIGH_VISIBILITY = 402
+    NSFW_DROPPED = 403
+    SENSITIVE_MEDIA = 404
+
+_MESSAGES = {
+    LogCode.PHOENIX_RETRIEVAL: "✅ **Phoenix Retrieval**: おすすめ（FF外）表示の候補として抽出されました。",
+    LogCode.THUNDER_ONLY: "ℹ️ **Thunder Only**: フォロワー数が少ない、または活動が浅いため、主にフォロワー内（In-Network）での表示候補となります。",
+    LogCode.MUTED_KEYWORD: "⛔ **Muted Keyword**: スパム系の単語（{0}）が含まれているため、フィルタリングされました。",
+    LogCode.SPAM_HASHTAGS: "⛔ **Spam Filter**: ハッシュタグが多すぎます（{0}個）。スパム判定されるリスクがあります。",
+    LogCode.LOW_QUALITY: "⚠️ **Low Quality**: テキストが短すぎます。メディアがない場合、ノイズとして除去される可能性があります。",
+    LogCode.FILTERING_PASSED: "✅ **Filtering Passed**: 重大なスパム要素は見つかりませんでした。",
+    LogCode.MEDIA_BOOST: "📈 **Media Boost**: 画像/動画あり (x{0})",
+    LogCode.LINK_PENALTY: "📉 **Link Penalty**: 外部リンクが含まれています。インプレッションが制限される可能性があります。",
+    LogCode.CONVERSATION_STARTER: "📈 **Conversation Starter**: 疑問形が含まれており、リプライ率(P_reply)予測が向上します。",
+    LogCode.LONGFORM_BOOST: "📈 **Longform Boost**: 長文投稿による滞在時間増加が見込まれます。",
+    LogCode.LOW_SCORE: "⚠️ **Low Score**: スコアが低いため、表示頻度が調整（間引き）される可能性があります。",
+    LogCode.HIGH_VISIBILITY: "✅ **High Visibility**: 十分なスコアがあります。おすすめ表示の有力候補です。",
+    LogCode.NSFW_DROPPED: "⛔ **Visibility Filter**: 画像がNSFW・暴力的と判定されたため、表示対象から除外されました。(unsafe: {0:.2f})",
+    LogCode.SENSITIVE_MEDIA: "⚠️ **Sensitive Media**: 画像にセンシティブな可能性があるため、表示が制限される可能性があります。(unsafe: {0:.2f})",
+}
+
+# パラメータなしのエントリで共有する空のパラメータ
+NO_PARAMS = ()
+
+def render_log_entry(entry):
+    """
+    (LogCode, params) を表示用の Markdown 文字列にする
+    """
+    code, params = entry
+    params = [", ".join(p) if isinstance(p, tuple) else p for p in params]
+    return _MESSAGES[code].format(*params)
+
+def render_log(entries):
+    """
+    ステージのログ (エントリのリスト) を Markdown 文字列のリストにする
+    """
+    return [render_log_entry(entry) for entry in entries]
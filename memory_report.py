@@ -0,0 +1,286 @@
+"""
+tracemalloc によるメモリ使用量のレポート (ステージ別・バッチ別)
+
+大きなエクスポートで OOM になるとき、何がメモリを使っているか
+(PostCandidate・ログの文字列・正規表現のマッチ結果など) を調べるためのもの。
+- バッチ (every 件) ごとにスナップショットを取り、確保中のメモリ・バッチ中のピーク・RSS を記録する
+- 確保中のメモリは、確保したときのトレースバックで一番内側のステージ関数
+  (profiling.STAGE_FUNCTIONS) に帰属させる。ステージ外はリポジトリ内の一番内側のファイル名
+- 確保中のメモリが最大だったバッチのスナップショットから、確保元の上位 (ファイル:行) を出す
+- 実行全体の tracemalloc のピークと RSS のピーク
+
+- STAGE_TIMINGS でサンプリングした投稿では、ステージごとの確保量の増減とステージ中のピーク
+  (tracemalloc.get_traced_memory の差分) も記録する。一時的に確保してすぐ解放するメモリは
+  確保中のメモリには残らないので、こちらで見る
+
+ステージごとにスナップショットを取ると1件ごとに数 ms かかるので、確保中のメモリのステージ単位の集計は
+トレースバックからの帰属で行う。tracemalloc は全ての確保にトレースバックを記録するので、
+有効時は10倍程度遅くなる (DEFAULT_FRAMES を深くするほど遅い)。
+
+    python cli.py posts.jsonl -o scores.jsonl --memory-report memory.json
+"""
+import ast
+import os
+import sys
+import tracemalloc
+from collections import Counter
+
+from model_registry import current_rss_bytes
+from profiling import STAGE_FUNCTIONS
+from timings import STAGE_TIMINGS
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MEMORY_REPORT_PATH = os.environ.get("XSCORER_MEMORY_REPORT")
+DEFAULT_EVERY = 1024
+DEFAULT_FRAMES = 8
+DEFAULT_TOP = 20
+
+def _stage_line_ranges():
+    """
+    {ファイル名: [(開始行, 終了行, ステージ名), ...]} (STAGE_FUNCTIONS の関数の定義範囲)
+    """
+    ranges = {}
+    for (filename, name), stage in STAGE_FUNCTIONS.items():
+        path = os.path.join(ROOT, filename)
+        try:
+            with open(path, encoding="utf-8") as f:
+                tree = ast.parse(f.read(), filename)
+        except (OSError, SyntaxError):
+            continue
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == name:
+                ranges.setdefault(path, []).append((node.lineno, node.end_lineno, stage))
+    return ranges
+
+def peak_rss_bytes():
+    """
+    プロセス開始からの RSS のピーク (取得できない環境では None)
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KiB、macOS は byte
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _stage_deltas(stages):
+    """
+    {ステージ名: {samples, net_bytes (増減の合計), peak_bytes (ステージ中のピークの最大)}}
+    """
+    return {name: {"samples": samples, "net_bytes": net, "peak_bytes": peak}
+            for name, (samples, net, peak) in stages.items()}
+
+def _site(frame):
+    filename = frame.filename
+    if filename.startswith(ROOT):
+        filename = os.path.relpath(filename, ROOT)
+    return f"{filename}:{frame.lineno}"
+
+class MemoryReport:
+    """
+    every: この件数ごとに1バッチとしてスナップショットを取る
+    frames: 記録するトレースバックの深さ (ステージへの帰属に使う)
+    timings: ステージの区切りを受け取る StageTimings
+    sample_every: timings が無効なときに、実行中だけ有効にして何件に1件ステージごとの増減を記録するか
+                  (省略時は timings の設定。有効な場合はその設定に従う)
+    """
+
+    def __init__(self, every=DEFAULT_EVERY, frames=DEFAULT_FRAMES, top=DEFAULT_TOP, timings=STAGE_TIMINGS,
+                 sample_every=None):
+        self.every = every
+        self.frames = frames
+        self.top = top
+        self.timings = timings
+        self.sample_every = sample_every
+        self.batches = []
+        self.records = 0
+        self._ranges = _stage_line_ranges()
+        self._owners = {}
+        self._pending = 0
+        self._peak_snapshot = None
+        self._peak_current = -1
+        self._first_snapshot = None
+        self._started_tracing = False
+        self._enabled_timings = None
+        # サンプリングした投稿のステージごとの増減 {ステージ名: [件数, 増減の合計, ステージ中のピークの最大]}
+        self._stages = {}
+        self._stage_current = 0
+        # lap でピークをリセットするので、バッチ中のピークはここに持っておく
+        self._batch_peak = 0
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        if not self.timings.enabled:
+            # stop で元の間隔に戻す
+            self._enabled_timings = self.timings.sample_every
+            self.timings.enable(self.sample_every)
+        self.timings.memory = self
+        tracemalloc.reset_peak()
+        self._first_snapshot = self._snapshot()
+
+    def stop(self):
+        self.timings.memory = None
+        if self._enabled_timings is not None:
+            self.timings.disable()
+            self.timings.sample_every = self._enabled_timings
+            self._enabled_timings = None
+        if self._pending:
+            self._end_batch()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def begin_stages(self):
+        """
+        StageClock の開始時に呼ばれる (最初のステージの増減の基準にする)
+        """
+        self._batch_peak = max(self._batch_peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self._stage_current = tracemalloc.get_traced_memory()[0]
+
+    def lap(self, name):
+        """
+        StageClock.lap から呼ばれ、前の区切りからの確保量の増減とステージ中のピークを name に記録する
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        self._batch_peak = max(self._batch_peak, peak)
+        stats = self._stages.get(name)
+        if stats is None:
+            stats = self._stages[name] = [0, 0, 0]
+        stats[0] += 1
+        stats[1] += current - self._stage_current
+        stats[2] = max(stats[2], peak - self._stage_current)
+        # ここでの記録自体の確保は次のステージに含めない
+        tracemalloc.reset_peak()
+        self._stage_current = tracemalloc.get_traced_memory()[0]
+
+    def _snapshot(self):
+        # レポート自体 (tracemalloc とこのモジュール) の確保は除く
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__, all_frames=True),
+        ))
+
+    def tick(self, n=1):
+        """
+        n 件処理したことを記録し、every 件たまったらバッチの区切りとしてスナップショットを取る
+        """
+        self.records += n
+        self._pending += n
+        if self._pending >= self.every:
+            self._end_batch()
+
+    def _end_batch(self):
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = self._snapshot()
+        self.batches.append({
+            "batch": len(self.batches),
+            "records": self._pending,
+            "traced_bytes": current,
+            "traced_peak_bytes": max(peak, self._batch_peak),
+            "rss_bytes": current_rss_bytes(),
+            "by_stage": self.by_stage(snapshot),
+            "stage_deltas": _stage_deltas(self._stages),
+        })
+        if current > self._peak_current:
+            self._peak_current = current
+            self._peak_snapshot = snapshot
+        self._pending = 0
+        self._stages = {}
+        # 次のバッチのピークを取るためにリセットする (実行全体のピークは batches の最大)
+        self._batch_peak = 0
+        tracemalloc.reset_peak()
+
+    def _owner(self, traceback):
+        owner = self._owners.get(traceback)
+        if owner is None:
+            owner = self._owners[traceback] = self._find_owner(traceback)
+        return owner
+
+    def _find_owner(self, traceback):
+        # トレースバックは古い順なので、内側 (末尾) から見る
+        fallback = None
+        for frame in reversed(traceback):
+            for start, end, stage in self._ranges.get(frame.filename, ()):
+                if start <= frame.lineno <= end:
+                    return stage
+            if fallback is None and frame.filename.startswith(ROOT):
+                fallback = os.path.basename(frame.filename)
+        return fallback or "other"
+
+    def by_stage(self, snapshot):
+        """
+        {ステージ名 / ファイル名: 確保中のバイト数}
+        """
+        sizes = Counter()
+        for trace in snapshot.traces:
+            sizes[self._owner(trace.traceback)] += trace.size
+        return dict(sizes.most_common())
+
+    def report(self):
+        """
+        JSON に書き出せる dict のレポート
+        """
+        top_sites, growth = [], []
+        if self._peak_snapshot is not None:
+            top_sites = [{"site": _site(stat.traceback[-1]), "bytes": stat.size, "blocks": stat.count}
+                         for stat in self._peak_snapshot.statistics("lineno")[:self.top]]
+            growth = [{"site": _site(stat.traceback[-1]), "bytes": stat.size_diff, "blocks": stat.count_diff}
+                      for stat in self._peak_snapshot.compare_to(self._first_snapshot, "lineno")[:self.top]
+                      if stat.size_diff > 0]
+        peak_batch = max(self.batches, key=lambda batch: batch["traced_bytes"], default=None)
+        # 全バッチのサンプルを合算したステージごとの増減
+        totals = {}
+        for batch in self.batches:
+            for stage, deltas in batch["stage_deltas"].items():
+                stats = totals.setdefault(stage, [0, 0, 0])
+                stats[0] += deltas["samples"]
+                stats[1] += deltas["net_bytes"]
+                stats[2] = max(stats[2], deltas["peak_bytes"])
+        return {
+            "records": self.records,
+            "batch_records": self.every,
+            "traced_peak_bytes": max((batch["traced_peak_bytes"] for batch in self.batches), default=0),
+            "rss_peak_bytes": peak_rss_bytes(),
+            "rss_bytes": current_rss_bytes(),
+            "peak_batch": peak_batch["batch"] if peak_batch else None,
+            "peak_by_stage": peak_batch["by_stage"] if peak_batch else {},
+            "stage_deltas": _stage_deltas(totals),
+            "top_sites": top_sites,
+            "growth_sites": growth,
+            "batches": self.batches,
+        }
+
+    def summary_text(self, report=None):
+        report = report or self.report()
+        mib = 1024 * 1024
+        lines = [f"memory: {report['records']} records / {len(report['batches'])} batches, "
+                 f"traced peak {report['traced_peak_bytes'] / mib:.1f} MiB, "
+                 f"RSS peak {(report['rss_peak_bytes'] or 0) / mib:.1f} MiB"]
+        if report["peak_batch"] is not None:
+            # 確保中: ピークのバッチの終わりに確保されていた量 / 増減・ピーク: サンプリングした投稿の1件あたり
+            deltas = report["stage_deltas"]
+            samples = max((stats["samples"] for stats in deltas.values()), default=0)
+            lines.append(f"  by stage (held at end of batch {report['peak_batch']} / "
+                         f"per sampled record, {samples} samples):")
+            lines.append(f"    {'stage':24} {'held':>14} {'net (mean)':>14} {'peak (max)':>14}")
+            for stage in list(report["peak_by_stage"]) + [name for name in deltas
+                                                          if name not in report["peak_by_stage"]]:
+                size = report["peak_by_stage"].get(stage, 0)
+                stats = deltas.get(stage)
+                if stats is None:
+                    lines.append(f"    {stage:24} {size / mib:10.2f} MiB")
+                    continue
+                net = stats["net_bytes"] / stats["samples"]
+                lines.append(f"    {stage:24} {size / mib:10.2f} MiB {net / 1024:10.1f} KiB "
+                             f"{stats['peak_bytes'] / 1024:10.1f} KiB")
+            lines.append("  top allocation sites:")
+            for site in report["top_sites"][:10]:
+                lines.append(f"    {site['site']:48} {site['bytes'] / mib:10.2f} MiB {site['blocks']:>9} blocks")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,103 @@
+"""
+モデル推論用の動的マイクロバッチキュー
+
+Streamlit の各セッションや API から1件ずつ届く推論リクエストをキューに溜め、
+最大件数 (max_batch_size) か最大待ち時間 (max_wait_ms) のどちらかに達した時点で
+1回のバッチ推論にまとめる。呼び出し元にはそれぞれの結果が Future で返る。
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 5
+
+_STOP = object()
+
+class MicroBatcher:
+    """
+    batch_fn: アイテムのリストを受け取り、同じ順序・同じ長さの結果リストを返す関数
+    """
+
+    def __init__(self, batch_fn, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms=DEFAULT_MAX_WAIT_MS, name="microbatch"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        # 閉じたかどうかの確認とキューへの追加をまとめて行う (_STOP の後ろにリクエストが入らないように)
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """
+        1件のリクエストをキューに入れ、結果を受け取る Future を返す
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MicroBatcher は閉じられています")
+            self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout)
+
+    def close(self, timeout=None):
+        """
+        キューに残っているリクエストを処理してからワーカースレッドを止める
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    @property
+    def mean_batch_size(self):
+        return self.items / self.batches if self.batches else 0.0
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # 期限を過ぎていても、すでにキューにあるものは取り込む
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            request = self._queue.get()
+            if request is _STOP:
+                return
+            batch = self._collect(request)
+            # キャンセル済みのリクエストは推論しない
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.batch_fn([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise ValueError(f"batch_fn の結果が {len(results)} 件でした (入力は {len(batch)} 件)")
+            except BaseException as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,174 @@
+"""
+プロセス全体で共有するモデルレジストリ
+
+Streamlit はユーザー操作のたびにスクリプトを再実行するが、import 済みのモジュールは
+プロセス内で共有される。モデルをこのレジストリ経由で取得すれば、再実行や
+セッションをまたいでも各モデルはプロセスごとに1回だけロードされる。
+RAM の上限 (XSCORER_MODEL_RAM_BUDGET_MB) を超えた場合や、一定時間使われていない
+(XSCORER_MODEL_IDLE_TTL_S) 場合は、最後に使われた時刻が古いモデルから解放する。
+"""
+import gc
+import os
+import threading
+import time
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def current_rss_bytes():
+    """
+    現在の常駐メモリ (Linux の /proc/self/statm。取得できない環境では None)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+def estimate_model_bytes(model):
+    """
+    モデルのメモリ使用量の推定値
+    memory_bytes() を持つオブジェクトはその値、torch のモジュールはパラメータとバッファの合計
+    """
+    if hasattr(model, "memory_bytes"):
+        return model.memory_bytes()
+    if hasattr(model, "parameters") and hasattr(model, "buffers"):
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    return None
+
+def model_key(kind, model_dir, variant, **options):
+    """
+    ModelRegistry のキー (例: "clip-safety:fp32:/models/clip;num_threads=4")
+    ロード時の引数が違えば別のモデルとして扱う。None の引数は省略時と同じなのでキーに含めず、
+    引数の順序によらないよう名前順に並べる
+    """
+    key = f"{kind}:{variant}:{os.path.abspath(model_dir)}"
+    return key + "".join(f";{name}={options[name]!r}" for name in sorted(options) if options[name] is not None)
+
+class _Entry:
+    __slots__ = ("model", "loaded_at", "last_used", "bytes", "load_seconds", "lock")
+
+    def __init__(self):
+        self.model = None
+        self.loaded_at = None
+        self.last_used = None
+        self.bytes = 0
+        self.load_seconds = None
+        self.lock = threading.Lock()
+
+class ModelRegistry:
+    """
+    ram_budget_bytes: ロード済みモデルの合計サイズの上限 (None で無制限)
+    idle_ttl_seconds: これより長く使われていないモデルは次の get のときに解放する (None で無効)
+    """
+
+    def __init__(self, ram_budget_bytes=None, idle_ttl_seconds=None):
+        self.ram_budget_bytes = ram_budget_bytes
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, loader):
+        """
+        name のモデルを返す。未ロードなら loader() でロードして登録する
+        同じモデルを複数のセッションが同時に要求しても、ロードは1回だけ行われる
+        """
+        if self.idle_ttl_seconds is not None:
+            self.evict_idle(self.idle_ttl_seconds)
+
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                entry = self._entries[name] = _Entry()
+
+        with entry.lock:
+            if entry.model is None:
+                rss_before = current_rss_bytes()
+                started = time.perf_counter()
+                model = loader()
+                entry.load_seconds = time.perf_counter() - started
+                size = estimate_model_bytes(model)
+                if size is None:
+                    rss_after = current_rss_bytes()
+                    size = max(rss_after - rss_before, 0) if rss_before is not None and rss_after is not None else 0
+                entry.model, entry.bytes = model, size
+                entry.loaded_at = time.time()
+            entry.last_used = time.time()
+            model = entry.model
+
+        self._enforce_budget(keep=name)
+        return model
+
+    def is_loaded(self, name):
+        entry = self._entries.get(name)
+        return entry is not None and entry.model is not None
+
+    def evict(self, name):
+        """
+        レジストリが持つモデルへの参照を解放する (使用中の呼び出し元が参照を手放すとメモリが解放される)
+        使用中かもしれないので close() は呼ばない。スレッドプールなどのリソースは、
+        最後の参照が無くなったときにモデル側 (weakref.finalize) で解放する
+        """
+        with self._lock:
+            entry = self._entries.pop(name, None)
+        if entry is not None:
+            with entry.lock:
+                entry.model = None
+            gc.collect()
+            return True
+        return False
+
+    def evict_idle(self, max_idle_seconds):
+        """
+        max_idle_seconds より長く使われていないモデルを解放し、解放した名前のリストを返す
+        """
+        now = time.time()
+        with self._lock:
+            idle = [name for name, entry in self._entries.items()
+                    if entry.last_used is not None and now - entry.last_used > max_idle_seconds]
+        return [name for name in idle if self.evict(name)]
+
+    def _enforce_budget(self, keep=None):
+        if self.ram_budget_bytes is None:
+            return
+        with self._lock:
+            loaded = sorted(((entry.last_used, name, entry.bytes)
+                             for name, entry in self._entries.items() if entry.model is not None))
+        total = sum(size for _, _, size in loaded)
+        for _, name, size in loaded:
+            if total <= self.ram_budget_bytes:
+                break
+            if name == keep:
+                continue
+            if self.evict(name):
+                total -= size
+
+    def memory_usage(self):
+        """
+        ロード済みモデルごとの {name: {"bytes", "load_seconds", "idle_seconds"}}
+        """
+        now = time.time()
+        with self._lock:
+            return {
+                name: {
+                    "bytes": entry.bytes,
+                    "load_seconds": entry.load_seconds,
+                    "idle_seconds": now - entry.last_used,
+                }
+                for name, entry in self._entries.items() if entry.model is not None
+            }
+
+    def total_bytes(self):
+        return sum(info["bytes"] for info in self.memory_usage().values())
+
+def _env_float(name):
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+_budget_mb = _env_float("XSCORER_MODEL_RAM_BUDGET_MB")
+
+# プロセス共通のレジストリ
+REGISTRY = ModelRegistry(
+    ram_budget_bytes=int(_budget_mb * 1024 * 1024) if _budget_mb is not None else None,
+    idle_ttl_seconds=_env_float("XSCORER_MODEL_IDLE_TTL_S"),
+)
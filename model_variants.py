@@ -0,0 +1,106 @@
+"""
+CPU 推論用のモデルバリアント (fp32 / int8 動的量子化 / ONNX)
+
+どのバリアントを使うかは各モデルのコンストラクタ引数か、環境変数
+XSCORER_MODEL_VARIANT (fp32 / int8 / onnx) で選ぶ。
+- int8: torch の動的量子化で nn.Linear の重みを int8 にする (精度の低下は小さい)
+- onnx: torch.onnx.export で書き出したグラフを onnxruntime の CPU 実行プロバイダで動かす
+"""
+import hashlib
+import os
+import tempfile
+
+from file_lock import file_lock
+from lazy_import import LazyModule
+
+torch = LazyModule("torch")
+onnxruntime = LazyModule("onnxruntime")
+
+VARIANTS = ("fp32", "int8", "onnx")
+DEFAULT_VARIANT = "fp32"
+
+# ONNX の opset。transformers の CLIP / BERT 系がそのまま書き出せる版
+ONNX_OPSET = 17
+
+def resolve_variant(variant=None):
+    """
+    引数 > 環境変数 XSCORER_MODEL_VARIANT > fp32 の順でバリアントを決める
+    """
+    variant = (variant or os.environ.get("XSCORER_MODEL_VARIANT") or DEFAULT_VARIANT).lower()
+    if variant not in VARIANTS:
+        raise ValueError(f"未対応のモデルバリアントです: {variant} (選択肢: {', '.join(VARIANTS)})")
+    return variant
+
+def quantize_dynamic_int8(module):
+    """
+    nn.Linear を int8 の動的量子化版に置き換えたモジュールを返す
+    """
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+def weights_fingerprint(module, *extra):
+    """
+    module の重み (state_dict) と extra から作るハッシュ (ONNX の書き出し結果のキャッシュキー)
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for value in (torch.__version__, *extra):
+        digest.update(str(value).encode("utf-8") + b"\0")
+    for name, tensor in sorted(module.state_dict().items()):
+        tensor = tensor.detach().cpu().contiguous()
+        digest.update(f"{name}|{tensor.dtype}|{tuple(tensor.shape)}".encode("utf-8"))
+        digest.update(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+def export_onnx(module, example_inputs, path, input_names, output_names, dynamic_axes=None):
+    """
+    module を ONNX に書き出し、書き出したファイルのパスを返す
+    実際のファイル名は path の拡張子の前に重みと opset のハッシュを付けたもの
+    (model.onnx -> model.<hash>.onnx)。同じハッシュのファイルがあれば書き出さずにそのまま使うので、
+    モデルや opset が変わったときに古い書き出し結果を使うことはない
+    example_inputs: forward に渡す位置引数のタプル
+    """
+    fingerprint = weights_fingerprint(module, ONNX_OPSET, tuple(input_names), tuple(output_names), dynamic_axes)
+    root, ext = os.path.splitext(os.path.abspath(path))
+    path = f"{root}.{fingerprint}{ext or '.onnx'}"
+    if os.path.exists(path):
+        return path
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # ワーカープロセスが同時に呼ぶので、書き出しはロックを取った1プロセスだけが行う
+    with file_lock(path + ".lock"):
+        if os.path.exists(path):
+            return path
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".onnx.tmp")
+        os.close(fd)
+        try:
+            with torch.inference_mode():
+                torch.onnx.export(module, example_inputs, tmp_path, input_names=list(input_names),
+                                  output_names=list(output_names), dynamic_axes=dynamic_axes,
+                                  opset_version=ONNX_OPSET)
+            # 書き出し途中のファイルを他のプロセスが読まないよう、完成してから置き換える
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return path
+
+class OnnxRunner:
+    """
+    onnxruntime の CPU セッション。run(**inputs) で NumPy 配列の出力リストを返す
+    """
+
+    def __init__(self, path, num_threads=None):
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, sess_options=options,
+                                                    providers=["CPUExecutionProvider"])
+
+    def run(self, **inputs):
+        return self.session.run(None, inputs)
+
+    def memory_bytes(self):
+        # セッションのメモリは直接取れないので、重みの大半を占めるファイルサイズで近似する
+        return os.path.getsize(self.path)
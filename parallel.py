@@ -0,0 +1,147 @@
+"""
+複数プロセスでのパイプライン並列実行
+
+各ステージは純粋な CPU 処理なので、GIL を避けるために ProcessPoolExecutor で
+入力をチャンクに分けて処理する。チャンク単位で投げることで pickle のコストを均し、
+結果は入力と同じ順序で返す。
+"""
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+
+from engagement_model import get_engagement_predictor
+from keyword_matcher import KeywordMatcher
+from length_bucketing import PADDING_STATS
+from pipeline import iter_score_batch
+from timings import STAGE_TIMINGS
+from visibility import get_clip_classifier
+
+DEFAULT_CHUNKSIZE = 256
+
+# ワーカープロセス内で使うマッチャー (プロセスごとに1回だけ構築する) と、モデルの読み込み設定
+# モデルはチャンクごとに ModelRegistry から取得する (予算超過やアイドルで解放された場合は再ロードされる)
+_worker_matcher = None
+_worker_models = (None, None, None)
+
+def _load_visibility(clip_model_dir, model_variant=None, num_threads=None):
+    return get_clip_classifier(clip_model_dir, variant=model_variant, num_threads=num_threads)
+
+def _load_engagement(engagement_model_dir, model_variant=None, num_threads=None):
+    return get_engagement_predictor(engagement_model_dir, variant=model_variant, num_threads=num_threads)
+
+def _init_worker(keywords, clip_model_dir, model_variant, engagement_model_dir=None,
+                 timings_sample_every=None):
+    global _worker_matcher, _worker_models
+    # 親プロセスでステージの計測が有効なら、ワーカーでも同じ間隔で計測する
+    if timings_sample_every is not None:
+        STAGE_TIMINGS.enable(timings_sample_every)
+    else:
+        STAGE_TIMINGS.disable()
+    if keywords is not None:
+        _worker_matcher = KeywordMatcher(keywords)
+    _worker_models = (clip_model_dir, model_variant, engagement_model_dir)
+    # 起動時にロードしておく (最初のチャンクの処理時間にロードを含めない)
+    _worker_model_instances()
+
+def _worker_model_instances():
+    clip_model_dir, model_variant, engagement_model_dir = _worker_models
+    # コア数ぶんのプロセスを立てるので、各プロセスの torch は1スレッドにする
+    visibility = engagement = None
+    if clip_model_dir is not None:
+        visibility = _load_visibility(clip_model_dir, model_variant, num_threads=1)
+    if engagement_model_dir is not None:
+        engagement = _load_engagement(engagement_model_dir, model_variant, num_threads=1)
+    return visibility, engagement
+
+def _score_chunk(posts):
+    visibility, engagement = _worker_model_instances()
+    results = list(iter_score_batch(posts, _worker_matcher, visibility, engagement=engagement))
+    # ワーカーで計測したステージの処理時間とパディング効率は結果と一緒に親プロセスへ返す
+    timings = STAGE_TIMINGS.drain() if STAGE_TIMINGS.enabled else None
+    padding = PADDING_STATS.drain() if engagement is not None else None
+    return results, timings, padding
+
+def create_worker_pool(workers=None, keywords=None, clip_model_dir=None, model_variant=None,
+                       engagement_model_dir=None):
+    """
+    マッチャーとモデルを各プロセスで1回だけ構築済みのワーカープール (ProcessPoolExecutor) を作る
+    submit_chunk で投稿のチャンクを投げる。引数は iter_score_parallel と同じ
+    """
+    timings_sample_every = STAGE_TIMINGS.sample_every if STAGE_TIMINGS.enabled else None
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=_init_worker,
+                               initargs=(keywords, clip_model_dir, model_variant, engagement_model_dir,
+                                         timings_sample_every))
+
+def submit_chunk(executor, posts):
+    """
+    create_worker_pool のプールで投稿のリストを処理し、ScoreResult のリストを返す Future を返す
+    ワーカーで計測したステージの処理時間とパディング効率は、完了時にこのプロセスの
+    STAGE_TIMINGS / PADDING_STATS へ合算する
+    """
+    future = Future()
+
+    def done(worker_future):
+        try:
+            results, timings, padding = worker_future.result()
+        except BaseException as e:
+            future.set_exception(e)
+            return
+        if timings:
+            STAGE_TIMINGS.merge(timings)
+        if padding:
+            PADDING_STATS.merge(padding)
+        future.set_result(results)
+
+    executor.submit(_score_chunk, posts).add_done_callback(done)
+    return future
+
+def _chunks(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def iter_score_parallel(posts, workers=None, chunksize=DEFAULT_CHUNKSIZE, keywords=None,
+                        clip_model_dir=None, model_variant=None, engagement_model_dir=None):
+    """
+    PostCandidate の iterable を workers 個のプロセスで処理し、ScoreResult を入力順に yield する
+    keywords: STAGE 2 のミュートワード (省略時は既定リスト)。各ワーカーで1回だけ構築する
+    clip_model_dir: 指定時は STAGE 4 で CLIP による画像セーフティ判定を行う
+    model_variant: モデルのバリアント fp32 / int8 / onnx (省略時は XSCORER_MODEL_VARIANT)
+    engagement_model_dir: 指定時は likes / replies / reposts をテキストモデルの予想件数で置き換える
+
+    同時に投げるチャンクは workers の2倍までに抑えるので、巨大な入力でもメモリは一定。
+    ワーカー側で設定される post.features / post.flags などは呼び出し元には反映されない。
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        matcher = KeywordMatcher(keywords) if keywords is not None else None
+        visibility = None
+        if clip_model_dir is not None:
+            visibility = _load_visibility(clip_model_dir, model_variant)
+        engagement = None
+        if engagement_model_dir is not None:
+            engagement = _load_engagement(engagement_model_dir, model_variant)
+        yield from iter_score_batch(posts, matcher, visibility, engagement=engagement)
+        return
+
+    with create_worker_pool(workers, keywords, clip_model_dir, model_variant,
+                            engagement_model_dir) as executor:
+        pending = deque()
+        for chunk in _chunks(posts, chunksize):
+            pending.append(submit_chunk(executor, chunk))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def score_parallel(posts, workers=None, chunksize=DEFAULT_CHUNKSIZE, keywords=None,
+                   clip_model_dir=None, model_variant=None, engagement_model_dir=None):
+    """
+    iter_score_parallel の結果を入力順のリストで返す
+    """
+    return list(iter_score_parallel(posts, workers, chunksize, keywords, clip_model_dir, model_variant,
+                                    engagement_model_dir))
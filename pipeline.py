@@ -0,0 +1,457 @@
+"""
+X Algorithm Pipeline のヘッドレス実装
+
+Streamlit に依存せず、STAGE 1〜4 をまとめて実行できるようにしたモジュール。
+app.py (UI) とバッチ処理・サービスの両方から import して使う。
+"""
+from collections import namedtuple
+
+from features import extract_features
+from keyword_matcher import KeywordMatcher
+from log_codes import NO_PARAMS, LogCode
+from timings import STAGE_TIMINGS
+
+# --- 設定: 仮想的なアルゴリズムの重み (公開情報を元にした近似値) ---
+WEIGHTS = {
+    "like": 0.5,
+    "retweet": 1.0,
+    "reply": 13.5,  # 対話は非常に重い
+    "image": 2.0,   # メディアがある場合の係数（ブースト）
+    "video": 2.0,
+    "link": -1.0,   # リンク付きは減点傾向（リプライ誘導推奨）
+}
+
+# STAGE 1 の候補ソース
+SOURCE_IN_NETWORK = "In-Network Only (Thunder)"
+SOURCE_GLOBAL = "Global Candidate (Phoenix Retrieval)"
+
+# STAGE 3 の特徴量ごとの係数
+LINK_PENALTY = 0.5          # 本文リンク
+QUESTION_BOOST = 1.2        # 疑問形 (対話誘発)
+LONGFORM_BOOST = 1.1        # 長文 (Premiumのみ)
+LONGFORM_MIN_LENGTH = 140   # 長文とみなす文字数
+
+# STAGE 2 の既定スパム/ミュートワード (テナント別リストは matcher 引数で差し替える)
+SPAM_KEYWORDS = ["稼げる", "無料配布", "giveaway", "dm me"]
+DEFAULT_SPAM_MATCHER = KeywordMatcher(SPAM_KEYWORDS)
+
+# STAGE 4 の画像セーフティ判定 (visibility.ClipSafetyClassifier の unsafe スコア) の閾値
+NSFW_DROP_THRESHOLD = 0.6
+NSFW_LIMIT_THRESHOLD = 0.3
+# セーフティ判定をまとめて行う投稿数
+VISIBILITY_BATCH_SIZE = 64
+# エンゲージメント予測をまとめて行う投稿数 (多いほどトークン長の近い投稿でバッチを組める)
+ENGAGEMENT_BATCH_SIZE = 1024
+
+# 最終スコアによるランク帯の閾値
+RANK_HIGH_THRESHOLD = 100
+RANK_MID_THRESHOLD = 30
+
+# パイプライン1件分の実行結果
+ScoreResult = namedtuple(
+    "ScoreResult",
+    [
+        "source_type",        # STAGE 1: 候補ソース
+        "filter_status",      # STAGE 2: PASS / WARNING / DROP
+        "base_potential",     # STAGE 3: コンテンツ自体のポテンシャル係数
+        "engagement_score",   # STAGE 3: 重み付きエンゲージメント和
+        "final_score",        # STAGE 3: 最終スコア
+        "visibility_status",  # STAGE 4: SHOW / LIMITED / DROP
+        "rank",               # HIGH / MID / LOW (DROP時は None)
+        "nsfw_score",         # STAGE 4: 画像の unsafe スコア (判定していない場合は None)
+        "logs",               # 各ステージのログ (stage1, stage2, stage3, stage4)。表示は log_codes.render_log
+    ],
+)
+
+# --- クラス定義: パイプラインの各ステージ ---
+
+# PostCandidate.flags のビット
+FLAG_HAS_MEDIA = 1 << 0         # 入力: 画像/動画あり
+FLAG_PREMIUM = 1 << 1           # 入力: X Premium
+FLAG_GLOBAL_CANDIDATE = 1 << 2  # STAGE 1: Phoenix Retrieval の候補
+FLAG_WARNING = 1 << 3           # STAGE 2: WARNING
+FLAG_DROPPED = 1 << 4           # STAGE 2 / STAGE 4: DROP
+FLAG_LIMITED = 1 << 5           # STAGE 4: LIMITED
+FLAG_HAS_VIDEO = 1 << 6         # 入力: メディアが動画 (メディアブーストに WEIGHTS["video"] を使う)
+INPUT_FLAGS = FLAG_HAS_MEDIA | FLAG_PREMIUM | FLAG_HAS_VIDEO
+
+class PostCandidate:
+    """
+    パイプラインに流す投稿候補
+    大量の候補をメモリに保持できるよう __slots__ で固定フィールドにし、
+    bool の属性や各ステージの判定結果は flags のビットマスクにまとめている
+    """
+    __slots__ = ("_text", "follower_count", "likes", "replies", "reposts",
+                 "flags", "base_potential", "final_score", "features", "images", "videos")
+
+    def __init__(self, text, has_media, is_premium, follower_count,
+                 likes=0, replies=0, reposts=0, images=(), videos=(), has_video=False):
+        self.text = text
+        self.follower_count = follower_count
+        # 予想エンゲージメント数（UIのシミュレーション入力に相当）
+        self.likes = likes
+        self.replies = replies
+        self.reposts = reposts
+        self.flags = (FLAG_HAS_MEDIA if has_media else 0) | (FLAG_PREMIUM if is_premium else 0)
+        # 動画ファイルが添付されていれば動画の投稿 (ファイルなしで動画として試算する場合は has_video)
+        if videos or has_video:
+            self.flags |= FLAG_HAS_MEDIA | FLAG_HAS_VIDEO
+        self.base_potential = 1.0
+        self.final_score = 0
+        # テキストの特徴量 (PostFeatures)。各ステージで共有する
+        self.features = None
+        # 添付画像 (PIL.Image またはファイルパス)。STAGE 4 のセーフティ判定に使う
+        self.images = tuple(images)
+        # 添付動画 (ファイルパスまたはファイルオブジェクト)。キーフレームを画像と同じ判定に通す
+        self.videos = tuple(videos)
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        # テキストを変えたら抽出済みの特徴量は使えない
+        self._text = value
+        self.features = None
+
+    def _set_flag(self, flag, value):
+        if value:
+            self.flags |= flag
+        else:
+            self.flags &= ~flag
+
+    @property
+    def has_media(self):
+        return bool(self.flags & FLAG_HAS_MEDIA)
+
+    @has_media.setter
+    def has_media(self, value):
+        self._set_flag(FLAG_HAS_MEDIA, value)
+
+    @property
+    def has_video(self):
+        return bool(self.flags & FLAG_HAS_VIDEO)
+
+    @has_video.setter
+    def has_video(self, value):
+        self._set_flag(FLAG_HAS_VIDEO, value)
+
+    @property
+    def is_premium(self):
+        return bool(self.flags & FLAG_PREMIUM)
+
+    @is_premium.setter
+    def is_premium(self, value):
+        self._set_flag(FLAG_PREMIUM, value)
+
+    @property
+    def score_breakdown(self):
+        """
+        エンゲージメント種別ごとの重み付きスコア
+        """
+        return {
+            "like": self.likes * WEIGHTS["like"],
+            "reply": self.replies * WEIGHTS["reply"],
+            "retweet": self.reposts * WEIGHTS["retweet"],
+        }
+
+def post_features(post, matcher=None):
+    """
+    投稿の PostFeatures を返す (未抽出なら抽出して post に保持する)
+    matcher: キーワード判定の結果を使う場合に指定する。保持している特徴量が別のキーワードリストで
+    判定したものなら抽出し直す。None ならキーワード判定の結果は見ないものとして、保持している特徴量を
+    そのまま返す (未抽出なら既定リストで抽出する)
+    """
+    features = post.features
+    if features is None or (matcher is not None and features.keyword_source != matcher.fingerprint):
+        features = post.features = extract_features(post.text, matcher if matcher is not None
+                                                    else DEFAULT_SPAM_MATCHER)
+    return features
+
+def stage_1_candidate_sources(post):
+    """
+    STAGE 1: CANDIDATE SOURCES
+    In-Network (Thunder) と Out-of-Network (Phoenix) の候補になるか判定
+    """
+    log = []
+    status = "PASS"
+
+    # Out-of-Network (おすすめ) に載るための最低条件シミュレーション
+    # フォロワー比率や直近の活動などが影響するが、ここでは簡易的に判定
+
+    source_type = SOURCE_IN_NETWORK
+    if post.is_premium or post.follower_count > 500:
+        source_type = SOURCE_GLOBAL
+        log.append((LogCode.PHOENIX_RETRIEVAL, NO_PARAMS))
+    else:
+        log.append((LogCode.THUNDER_ONLY, NO_PARAMS))
+
+    return status, log, source_type
+
+def stage_2_filtering_pre_scoring(post, matcher=None):
+    """
+    STAGE 2: FILTERING (Pre-Selection)
+    重複、ブロック、ミュートワード、スパムなどの排除
+    matcher: KeywordMatcher / SwappableMatcher (省略時は SPAM_KEYWORDS)
+    """
+    log = []
+    status = "PASS"
+    features = post_features(post, matcher if matcher is not None else DEFAULT_SPAM_MATCHER)
+
+    # 1. スパム/ミュートワード判定 (特徴量抽出時にまとめて走査済み)
+    hits = features.keyword_hits
+    if hits:
+        status = "DROP"
+        log.append((LogCode.MUTED_KEYWORD, (hits,)))
+        return status, log
+
+    # 2. ハッシュタグ過多（スパム判定）
+    if features.hashtag_count > 5:
+        status = "DROP"
+        log.append((LogCode.SPAM_HASHTAGS, (features.hashtag_count,)))
+        return status, log
+
+    # 3. テキストの長さ（短すぎるとボット判定リスク）
+    if features.length < 5 and not post.has_media:
+        status = "WARNING"
+        log.append((LogCode.LOW_QUALITY, NO_PARAMS))
+
+    if status == "PASS":
+        log.append((LogCode.FILTERING_PASSED, NO_PARAMS))
+
+    return status, log
+
+def stage_3_scoring(post):
+    """
+    STAGE 3: SCORING (Heavy Ranker / Phoenix Scorer)
+    P(like), P(reply) などを予測し、スコア付けを行う工程のシミュレーション
+    """
+    log = []
+    features = post_features(post)
+
+    # ベーススコア（投稿自体の品質推定）
+    base_score = 1.0
+
+    # --- Feature Engineering (特徴量抽出) ---
+
+    # メディアブースト
+    if post.has_media:
+        media_weight = WEIGHTS["video"] if post.has_video else WEIGHTS["image"]
+        base_score *= media_weight
+        log.append((LogCode.MEDIA_BOOST, (media_weight,)))
+
+    # リンクペナルティ
+    if features.url_count:
+        # 実際はリプライ欄ならOKだが、本文リンクは減点
+        log.append((LogCode.LINK_PENALTY, NO_PARAMS))
+        base_score *= LINK_PENALTY
+
+    # 対話誘発性 (Question Mark)
+    if features.question_marks:
+        log.append((LogCode.CONVERSATION_STARTER, NO_PARAMS))
+        base_score *= QUESTION_BOOST
+
+    # 長文ブースト (Premiumのみ)
+    if features.length > LONGFORM_MIN_LENGTH and post.is_premium:
+        log.append((LogCode.LONGFORM_BOOST, NO_PARAMS))
+        base_score *= LONGFORM_BOOST
+
+    post.base_potential = base_score
+
+    # --- Engagement Simulation (予測スコア計算) ---
+    # ユーザーに「どれくらい反応が来そうか」を入力させ、アルゴリズム上のスコアを試算
+    return base_score, log
+
+def stage_4_filtering_visibility(post, final_score, nsfw_score=None):
+    """
+    STAGE 4: FILTERING (Post-Selection) & VISIBILITY
+    最終的な表示フィルタリング（NSFW、Violenceなど）
+    nsfw_score: CLIP による画像の unsafe スコア (判定していない場合は None)
+    """
+    status = "SHOW"
+    log = []
+
+    # Visibility Filtering: CLIP 判定で NSFW / 暴力と判定された画像付き投稿は DROP
+    if nsfw_score is not None:
+        if nsfw_score >= NSFW_DROP_THRESHOLD:
+            log.append((LogCode.NSFW_DROPPED, (nsfw_score,)))
+            return "DROP", log
+        if nsfw_score >= NSFW_LIMIT_THRESHOLD:
+            status = "LIMITED"
+            log.append((LogCode.SENSITIVE_MEDIA, (nsfw_score,)))
+
+    if final_score < 10:
+        status = "LIMITED"
+        log.append((LogCode.LOW_SCORE, NO_PARAMS))
+    elif status == "SHOW":
+        log.append((LogCode.HIGH_VISIBILITY, NO_PARAMS))
+
+    return status, log
+
+# --- スコア計算 ---
+
+def compute_engagement_score(likes, replies, reposts):
+    """
+    アルゴリズム内部の重み付き和 (Linear Estimation)
+    """
+    return (likes * WEIGHTS["like"]) + \
+           (replies * WEIGHTS["reply"]) + \
+           (reposts * WEIGHTS["retweet"])
+
+def compute_final_score(base_potential, likes, replies, reposts):
+    """
+    重み付き和にコンテンツ自体のポテンシャル係数を掛けた最終スコア
+    """
+    return compute_engagement_score(likes, replies, reposts) * base_potential
+
+def rank_tier(final_score):
+    """
+    最終スコアからおすすめフィード上のランク帯 (HIGH / MID / LOW) を判定
+    """
+    if final_score > RANK_HIGH_THRESHOLD:
+        return "HIGH"
+    if final_score > RANK_MID_THRESHOLD:
+        return "MID"
+    return "LOW"
+
+# --- パイプライン実行 ---
+
+def _set_visibility_flags(post, s4_status):
+    post.flags &= ~(FLAG_LIMITED | FLAG_DROPPED)
+    if s4_status == "LIMITED":
+        post.flags |= FLAG_LIMITED
+    elif s4_status == "DROP":
+        post.flags |= FLAG_DROPPED
+
+def score_post(post, matcher=None, nsfw_score=None):
+    """
+    1件の PostCandidate に STAGE 1〜4 を順に適用し、ScoreResult を返す
+    matcher: STAGE 2 で使うミュートワードのマッチャー (省略時は既定リスト)
+    nsfw_score: 事前に計算した画像の unsafe スコア (STAGE 4 で使う)
+    """
+    # ステージごとの計測は STAGE_TIMINGS のサンプリング対象の投稿だけ行う
+    clock = STAGE_TIMINGS.clock()
+
+    # テキストの走査はここで1回だけ行い、以降のステージは post.features を参照する
+    post.features = extract_features(post.text, matcher if matcher is not None else DEFAULT_SPAM_MATCHER)
+
+    post.flags &= INPUT_FLAGS
+    clock.lap("features")
+
+    s1_status, s1_log, source_type = stage_1_candidate_sources(post)
+    if source_type == SOURCE_GLOBAL:
+        post.flags |= FLAG_GLOBAL_CANDIDATE
+    clock.lap("stage_1")
+
+    s2_status, s2_log = stage_2_filtering_pre_scoring(post, matcher)
+    if s2_status == "WARNING":
+        post.flags |= FLAG_WARNING
+    elif s2_status == "DROP":
+        post.flags |= FLAG_DROPPED
+        post.final_score = 0
+        clock.lap("stage_2")
+        clock.finish("score_post")
+        return ScoreResult(source_type, s2_status, 0.0, 0.0, 0.0,
+                           "DROP", None, None, (s1_log, s2_log, [], []))
+    clock.lap("stage_2")
+
+    base_potential, s3_log = stage_3_scoring(post)
+    engagement_score = compute_engagement_score(post.likes, post.replies, post.reposts)
+    final_score = engagement_score * base_potential
+    post.final_score = final_score
+    clock.lap("stage_3")
+
+    s4_status, s4_log = stage_4_filtering_visibility(post, final_score, nsfw_score)
+    _set_visibility_flags(post, s4_status)
+
+    rank = rank_tier(final_score) if s4_status != "DROP" else None
+    clock.lap("stage_4")
+    clock.finish("score_post")
+    return ScoreResult(source_type, s2_status, base_potential, engagement_score,
+                       final_score, s4_status, rank, nsfw_score,
+                       (s1_log, s2_log, s3_log, s4_log))
+
+def analyze_post(text, has_media, is_premium, follower_count, matcher=None, has_video=False):
+    """
+    エンゲージメント数に依存しない STAGE 1〜3 だけを実行する
+    (stage_1 の結果, stage_2 の結果, stage_3 の結果) を返す。STAGE 2 で DROP の場合 stage_3 は None
+    入力だけで結果が決まるので、UI ではこの戻り値をキャッシュして使い回す
+    """
+    clock = STAGE_TIMINGS.clock()
+    post = PostCandidate(text, has_media, is_premium, follower_count, has_video=has_video)
+    post.features = extract_features(text, matcher if matcher is not None else DEFAULT_SPAM_MATCHER)
+    clock.lap("features")
+    s1 = stage_1_candidate_sources(post)
+    clock.lap("stage_1")
+    s2 = stage_2_filtering_pre_scoring(post, matcher)
+    clock.lap("stage_2")
+    s3 = None
+    if s2[0] != "DROP":
+        s3 = stage_3_scoring(post)
+        clock.lap("stage_3")
+    clock.finish()
+    return s1, s2, s3
+
+def _score_chunk_with_visibility(posts, matcher, visibility):
+    # STAGE 2 で DROP されず画像・動画を持つ投稿だけを、まとめて1回でセーフティ判定する
+    results = [score_post(post, matcher) for post in posts]
+    targets = [i for i, (post, result) in enumerate(zip(posts, results))
+               if (post.images or post.videos) and result.filter_status != "DROP"]
+    if not targets:
+        return results
+
+    # モデル推論はバッチ単位なので、有効時は毎回計測する
+    with STAGE_TIMINGS.timed("visibility_batch"):
+        nsfw_scores = visibility.score_posts([posts[i] for i in targets])
+    for i, nsfw_score in zip(targets, nsfw_scores):
+        post, result = posts[i], results[i]
+        s4_status, s4_log = stage_4_filtering_visibility(post, result.final_score, nsfw_score)
+        _set_visibility_flags(post, s4_status)
+        rank = rank_tier(result.final_score) if s4_status != "DROP" else None
+        results[i] = result._replace(visibility_status=s4_status, rank=rank, nsfw_score=nsfw_score,
+                                     logs=result.logs[:3] + (s4_log,))
+    return results
+
+def iter_score_batch(posts, matcher=None, visibility=None, batch_size=VISIBILITY_BATCH_SIZE,
+                     engagement=None):
+    """
+    PostCandidate の iterable を逐次処理し、ScoreResult を1件ずつ yield する
+    visibility: ClipSafetyClassifier など (score_posts を持つ)。指定時は batch_size 件ごとに
+    画像をまとめてセーフティ判定し、STAGE 4 に反映する
+    engagement: EngagementPredictor など (apply を持つ)。指定時は ENGAGEMENT_BATCH_SIZE 件ごとに
+    likes / replies / reposts をテキストモデルの予想件数で置き換えてからスコアを計算する
+    """
+    if visibility is None and engagement is None:
+        for post in posts:
+            yield score_post(post, matcher)
+        return
+
+    chunk_size = ENGAGEMENT_BATCH_SIZE if engagement is not None else batch_size
+    chunk = []
+    for post in posts:
+        chunk.append(post)
+        if len(chunk) >= chunk_size:
+            yield from _score_chunk(chunk, matcher, visibility, batch_size, engagement)
+            chunk = []
+    if chunk:
+        yield from _score_chunk(chunk, matcher, visibility, batch_size, engagement)
+
+def _score_chunk(posts, matcher, visibility, batch_size, engagement):
+    if engagement is not None:
+        with STAGE_TIMINGS.timed("engagement_batch"):
+            engagement.apply(posts)
+    if visibility is None:
+        for post in posts:
+            yield score_post(post, matcher)
+        return
+    for start in range(0, len(posts), batch_size):
+        yield from _score_chunk_with_visibility(posts[start:start + batch_size], matcher, visibility)
+
+def score_batch(posts, matcher=None, visibility=None, batch_size=VISIBILITY_BATCH_SIZE, engagement=None):
+    """
+    PostCandidate の iterable をまとめて処理し、入力順の ScoreResult のリストを返す
+    """
+    if visibility is None and engagement is None:
+        return [score_post(post, matcher) for post in posts]
+    return list(iter_score_batch(posts, matcher, visibility, batch_size, engagement))
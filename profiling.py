@@ -0,0 +1,259 @@
+"""
+スコアリング実行のプロファイリング (cProfile / サンプリング)
+
+遅いバッチをコードを書き換えずにそのままプロファイルするためのフック。
+- cprofile: 全関数呼び出しを記録する (正確だが数倍遅くなる)。pstats と、呼び出しグラフから
+  近似した collapsed stack を書き出す
+- sample: 一定間隔で対象スレッドのスタックを採取する (数 % の負荷)。collapsed stack だけを書き出す
+
+collapsed stack (PREFIX.collapsed) は flamegraph.pl / speedscope / inferno でそのまま読める。
+どちらのモードでも STAGE_FUNCTIONS の関数に入っている時間をステージごとに集計する。
+
+    python cli.py posts.jsonl -o scores.jsonl --profile /tmp/run --profiler sample
+    XSCORER_PROFILE=/tmp/run python cli.py posts.jsonl -o scores.jsonl
+"""
+import cProfile
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_PREFIX = os.environ.get("XSCORER_PROFILE")
+PROFILE_MODE = os.environ.get("XSCORER_PROFILER", "cprofile")
+MODES = ("cprofile", "sample")
+DEFAULT_INTERVAL_S = 0.005
+
+# (ファイル名, 関数名) -> ステージ名 (timings.py の名前に合わせる)
+STAGE_FUNCTIONS = {
+    ("features.py", "extract_features"): "features",
+    ("pipeline.py", "stage_1_candidate_sources"): "stage_1",
+    ("pipeline.py", "stage_2_filtering_pre_scoring"): "stage_2",
+    ("pipeline.py", "stage_3_scoring"): "stage_3",
+    ("pipeline.py", "stage_4_filtering_visibility"): "stage_4",
+    ("visibility.py", "score_posts"): "visibility_batch",
+    ("engagement_model.py", "apply"): "engagement_batch",
+}
+
+# collapsed stack に含める最小の時間 (呼び出しグラフからの近似で細かい枝が爆発しないように)
+_MIN_COLLAPSED_S = 1e-6
+
+def _frame_label(filename, lineno, name):
+    if filename == "~":
+        # 組み込み関数 ("<built-in method builtins.len>" など)
+        return name
+    return f"{name} ({os.path.basename(filename)}:{lineno})"
+
+def _stage_of(filename, name):
+    return STAGE_FUNCTIONS.get((os.path.basename(filename), name))
+
+class SamplingProfiler:
+    """
+    interval 秒ごとに対象スレッド (start() を呼んだスレッド) のスタックを採取する
+    各サンプルには前のサンプルからの実時間を重みとして付ける (間隔が interval より長くなっても
+    合計は実行時間と一致する)。
+
+    - メインスレッドからは SIGALRM のインターバルタイマーで採取する。ハンドラーは対象スレッド自身の
+      バイトコードの区切りで動くので、どこで時間を使っているかに偏りなく採取できる
+    - それ以外のスレッド (Streamlit のスクリプトなど) では別スレッドから sys._current_frames() で採取する。
+      採取スレッドは対象スレッドが GIL を手放したとき (I/O など) に動きやすいので、
+      I/O を含む箇所に偏り、純粋な Python の計算は少なめに出る
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL_S):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.mode = None
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._previous_handler = None
+        self._last = None
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._last = time.perf_counter()
+        if threading.current_thread() is threading.main_thread() and hasattr(signal, "setitimer"):
+            self.mode = "signal"
+            self._previous_handler = signal.signal(signal.SIGALRM, self._on_signal)
+            signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+        else:
+            self.mode = "thread"
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="xscorer-sampler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self.mode == "signal":
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self._previous_handler or signal.SIG_DFL)
+        else:
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+
+    def _on_signal(self, signum, frame):
+        self._record(frame)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self._record(frame)
+
+    def _record(self, frame):
+        now = time.perf_counter()
+        weight, self._last = now - self._last, now
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+        self.stacks[tuple(stack)] += weight
+        self.samples += 1
+
+    def collapsed_lines(self):
+        # collapsed stack の値は整数なので µs 単位にする
+        for stack, seconds in self.stacks.most_common():
+            yield ";".join(_frame_label(*frame) for frame in stack) + f" {round(seconds * 1e6)}"
+
+    def stage_seconds(self):
+        """
+        {ステージ名: 推定秒数}。一番内側のステージ関数に帰属させる (どのステージでもなければ "other")
+        """
+        seconds = Counter()
+        for stack, weight in self.stacks.items():
+            stages = (_stage_of(filename, name) for filename, _, name in reversed(stack))
+            seconds[next((stage for stage in stages if stage), "other")] += weight
+        return dict(seconds)
+
+def _collapsed_from_stats(stats):
+    """
+    pstats の呼び出しグラフから collapsed stack を近似する
+    (関数の時間を呼び出し元ごとの累積時間の比で按分しながら、呼び出し元のない関数からたどる)
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees.setdefault(caller, []).append((func, cumulative))
+    totals = Counter()
+
+    def walk(func, path, scale):
+        tottime = stats[func][2]
+        path = path + (func,)
+        if tottime * scale >= _MIN_COLLAPSED_S:
+            totals[path] += tottime * scale
+        for callee, cumulative in callees.get(func, ()):
+            if callee in path:
+                continue
+            callee_cumtime = stats[callee][3]
+            if not callee_cumtime:
+                continue
+            share = scale * min(1.0, cumulative / callee_cumtime)
+            if callee_cumtime * share >= _MIN_COLLAPSED_S:
+                walk(callee, path, share)
+
+    for func, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            walk(func, (), 1.0)
+    for path, seconds in sorted(totals.items(), key=lambda item: -item[1]):
+        # collapsed stack の値は整数なので µs 単位にする
+        yield ";".join(_frame_label(*frame) for frame in path) + f" {round(seconds * 1e6)}"
+
+class Profiler:
+    """
+    mode: "cprofile" / "sample"
+    start() 〜 stop() の間 (または with ブロック内) をプロファイルし、write(prefix) で書き出す
+    """
+
+    def __init__(self, mode="cprofile", interval=DEFAULT_INTERVAL_S):
+        if mode not in MODES:
+            raise ValueError(f"未対応のプロファイラです: {mode} (選択肢: {', '.join(MODES)})")
+        self.mode = mode
+        self.interval = interval
+        self.elapsed = 0.0
+        self._profile = None
+        self._sampler = None
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = SamplingProfiler(self.interval)
+            self._sampler.start()
+
+    def stop(self):
+        if self.mode == "cprofile":
+            self._profile.disable()
+        else:
+            self._sampler.stop()
+        self.elapsed = time.perf_counter() - self._started
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        """
+        cprofile モードの pstats.Stats (sample モードでは None)
+        """
+        return pstats.Stats(self._profile) if self._profile is not None else None
+
+    def stage_seconds(self):
+        """
+        {ステージ名: 秒数}。cprofile はステージ関数の累積時間、sample は採取数からの推定
+        """
+        if self._sampler is not None:
+            return self._sampler.stage_seconds()
+        seconds = Counter()
+        for (filename, _, name), (_, _, _, cumtime, _) in self.stats().stats.items():
+            stage = _stage_of(filename, name)
+            if stage is not None:
+                seconds[stage] += cumtime
+        return dict(seconds)
+
+    def collapsed_lines(self):
+        if self._sampler is not None:
+            return self._sampler.collapsed_lines()
+        return _collapsed_from_stats(self.stats().stats)
+
+    def stage_report(self):
+        mode = self.mode
+        if self._sampler is not None:
+            mode = f"{mode}/{self._sampler.mode}, {self._sampler.samples} samples"
+        lines = [f"profile ({mode}): {self.elapsed:.3f}s"]
+        for stage, seconds in sorted(self.stage_seconds().items(), key=lambda item: -item[1]):
+            share = seconds / self.elapsed if self.elapsed else 0.0
+            lines.append(f"  {stage:20} {seconds:10.3f}s {share:7.1%}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, prefix):
+        """
+        PREFIX.pstats (cprofile のみ)、PREFIX.collapsed、PREFIX.stages.txt を書き出し、パスのリストを返す
+        """
+        directory = os.path.dirname(prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        paths = []
+        if self._profile is not None:
+            self._profile.dump_stats(prefix + ".pstats")
+            paths.append(prefix + ".pstats")
+        with open(prefix + ".collapsed", "w", encoding="utf-8") as f:
+            for line in self.collapsed_lines():
+                f.write(line + "\n")
+        paths.append(prefix + ".collapsed")
+        with open(prefix + ".stages.txt", "w", encoding="utf-8") as f:
+            f.write(self.stage_report())
+        paths.append(prefix + ".stages.txt")
+        return paths
@@ -0,0 +1,247 @@
+"""
+スコアリングの HTTP サービス (FastAPI + uvicorn)
+
+    python service.py --port 8000 --workers 4
+    curl -s localhost:8000/score -d '{"text": "こんにちは", "follower_count": 1000}'
+    curl -s localhost:8000/score/batch -H 'Content-Type: application/x-ndjson' --data-binary @posts.jsonl
+
+- POST /score: 1件のレコード (streaming.post_from_record と同じ項目) の結果を JSON で返す
+- POST /score/batch: JSON 配列 / {"posts": [...]} / NDJSON を受け取り、結果を NDJSON でチャンクごとに返す
+- GET /healthz: 死活監視用
+- GET /metrics: ステージごとの処理時間 (Prometheus のテキスト形式、--stage-timings か XSCORER_STAGE_TIMINGS=1 で計測) と
+  エンゲージメント予測のパディング効率
+
+テキストだけの判定は1件 10µs 程度なので、/score はイベントループ上でそのまま実行する。
+モデルを使う判定は MicroBatcher (同時に届いた他のリクエストとまとめて推論) の Future を待ち、
+バッチはチャンクごとにワーカープロセスへ投げる。処理中のチャンク数はセマフォで
+ワーカー数の2倍までに抑えるので、大量のリクエストが来てもメモリは一定に保たれる。
+"""
+import argparse
+import asyncio
+import json
+import os
+from collections import deque, namedtuple
+from contextlib import asynccontextmanager
+
+from engagement_model import get_engagement_batcher
+from keyword_matcher import KeywordMatcher
+from lazy_import import LazyModule
+from length_bucketing import PADDING_STATS
+from model_variants import VARIANTS
+from parallel import DEFAULT_CHUNKSIZE, create_worker_pool, submit_chunk
+from pipeline import score_post
+from streaming import post_from_record, record_from_result
+from timings import STAGE_TIMINGS
+from visibility import get_clip_batcher
+
+fastapi = LazyModule("fastapi")
+responses = LazyModule("fastapi.responses")
+uvicorn = LazyModule("uvicorn")
+
+DEFAULT_KEEP_ALIVE_S = 75
+NDJSON = "application/x-ndjson"
+PROMETHEUS_TEXT = "text/plain; version=0.0.4; charset=utf-8"
+
+def _dumps(record):
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+# NDJSON の1行として読めなかったレコード (結果は {"id": 行番号, "error": ...} の行になる)
+InvalidRecord = namedtuple("InvalidRecord", ["error"])
+
+def _parse_ndjson(body):
+    records = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError as e:
+            records.append(InvalidRecord(f"{type(e).__name__}: {e}"))
+    return records
+
+async def _read_records(request):
+    """
+    リクエストボディ (NDJSON / JSON 配列 / {"posts": [...]}) のレコードのリストを返す
+    ボディは応答のストリーミングを始める前に受信して全て変換しておく
+    (途中で変換に失敗して、ステータス 200 のまま応答が途切れることがないように)。
+    JSON として読めないボディは ValueError などを送出する。NDJSON の読めない行は InvalidRecord になる
+    """
+    if request.headers.get("content-type", "").startswith(NDJSON):
+        return _parse_ndjson(await request.body())
+    body = await request.json()
+    records = body["posts"] if isinstance(body, dict) else body
+    if not isinstance(records, list):
+        raise TypeError("レコードの配列か {\"posts\": [...]} を送ってください")
+    return records
+
+class ScoringService:
+    """
+    workers: バッチ用のワーカープロセス数 (省略時は CPU コア数)
+    chunksize: ワーカーに1回で渡す投稿数
+    clip_model_dir / engagement_model_dir / model_variant: cli と同じ
+    """
+
+    def __init__(self, workers=None, chunksize=DEFAULT_CHUNKSIZE, keywords=None, clip_model_dir=None,
+                 engagement_model_dir=None, model_variant=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.keywords = keywords
+        self.clip_model_dir = clip_model_dir
+        self.engagement_model_dir = engagement_model_dir
+        self.model_variant = model_variant
+        self.matcher = KeywordMatcher(keywords) if keywords is not None else None
+        self._pool = None
+        self._slots = None
+
+    def start(self):
+        self._pool = create_worker_pool(self.workers, self.keywords, self.clip_model_dir,
+                                        self.model_variant, self.engagement_model_dir)
+        self._slots = asyncio.Semaphore(self.workers * 2)
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def score_one(self, record):
+        post = post_from_record(record)
+        if self.engagement_model_dir is not None:
+            # /score/batch のワーカーと同じバリアントのモデルを使う
+            batcher = get_engagement_batcher(self.engagement_model_dir, variant=self.model_variant)
+            post.likes, post.replies, post.reposts = map(
+                float, await asyncio.wrap_future(batcher.submit(post)))
+        nsfw_score = None
+        if self.clip_model_dir is not None and (post.images or post.videos):
+            batcher = get_clip_batcher(self.clip_model_dir, variant=self.model_variant)
+            nsfw_score = await asyncio.wrap_future(batcher.submit(post))
+        return record_from_result(score_post(post, self.matcher, nsfw_score), record.get("id"))
+
+    async def _submit(self, posts):
+        await self._slots.acquire()
+        future = asyncio.wrap_future(submit_chunk(self._pool, posts))
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    async def iter_batch(self, records):
+        """
+        レコードの iterable をチャンクごとにワーカーで処理し、結果の NDJSON 行を入力順に yield する
+        変換できないレコード (InvalidRecord を含む) と、ワーカーで失敗したチャンクのレコードは
+        {"id": ..., "error": ...} の行になる
+        """
+        pending = deque()
+        chunk = []
+
+        async def flush():
+            posts = [post for _, post, _ in chunk if post is not None]
+            future = await self._submit(posts) if posts else None
+            pending.append((list(chunk), future))
+            chunk.clear()
+
+        async def drain_one():
+            entries, future = pending.popleft()
+            try:
+                results = iter(await future) if future is not None else iter(())
+            except Exception as e:
+                # ワーカーで失敗したチャンクは各レコードのエラー行にして、応答は最後まで続ける
+                error = f"{type(e).__name__}: {e}"
+                return "".join(_dumps({"id": record_id, "error": error if post is not None else post_error})
+                               for record_id, post, post_error in entries)
+            return "".join(
+                _dumps({"id": record_id, "error": error}) if post is None
+                else _dumps(record_from_result(next(results), record_id))
+                for record_id, post, error in entries)
+
+        index = 0
+        for record in records:
+            record_id = record.get("id", index) if isinstance(record, dict) else index
+            index += 1
+            if isinstance(record, InvalidRecord):
+                chunk.append((record_id, None, record.error))
+            else:
+                try:
+                    chunk.append((record_id, post_from_record(record), None))
+                except (KeyError, TypeError, ValueError) as e:
+                    chunk.append((record_id, None, f"{type(e).__name__}: {e}"))
+            if len(chunk) >= self.chunksize:
+                await flush()
+                # 先頭のチャンクが終わっていれば、次のチャンクを投げる前に返す
+                while pending and (pending[0][1] is None or pending[0][1].done()):
+                    yield await drain_one()
+                if len(pending) >= self.workers * 2:
+                    yield await drain_one()
+        if chunk:
+            await flush()
+        while pending:
+            yield await drain_one()
+
+def create_app(service):
+    @asynccontextmanager
+    async def lifespan(app):
+        service.start()
+        try:
+            yield
+        finally:
+            service.stop()
+
+    app = fastapi.FastAPI(title="X Algorithm Pipeline Scoring", lifespan=lifespan)
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok"}
+
+    @app.get("/metrics")
+    async def metrics():
+        # ワーカーで計測した分はチャンクの完了時に合算済み
+        return responses.Response(STAGE_TIMINGS.prometheus_text() + PADDING_STATS.prometheus_text(),
+                                  media_type=PROMETHEUS_TEXT)
+
+    @app.post("/score")
+    async def score(request: fastapi.Request):
+        try:
+            record = await request.json()
+            return await service.score_one(record)
+        except (KeyError, TypeError, ValueError) as e:
+            raise fastapi.HTTPException(status_code=422, detail=f"{type(e).__name__}: {e}")
+
+    @app.post("/score/batch")
+    async def score_batch(request: fastapi.Request):
+        try:
+            records = await _read_records(request)
+        except (KeyError, TypeError, ValueError) as e:
+            raise fastapi.HTTPException(status_code=422, detail=f"{type(e).__name__}: {e}")
+        return responses.StreamingResponse(service.iter_batch(records), media_type=NDJSON)
+
+    return app
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="X Algorithm Pipeline のスコアリング HTTP サービス")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=0, help="バッチ用のワーカープロセス数 (0 で CPU コア数)")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE,
+                        help="ワーカーに1回で渡す投稿数")
+    parser.add_argument("--clip-model", metavar="DIR",
+                        help="画像セーフティ判定に使う CLIP モデルのローカルディレクトリ")
+    parser.add_argument("--engagement-model", metavar="DIR",
+                        help="指定時は予想いいね数などをテキストモデルの予測で置き換える")
+    parser.add_argument("--model-variant", choices=VARIANTS,
+                        help="モデルのバリアント (省略時は XSCORER_MODEL_VARIANT、未設定なら fp32)")
+    parser.add_argument("--keep-alive", type=int, default=DEFAULT_KEEP_ALIVE_S,
+                        help="HTTP keep-alive のタイムアウト秒数")
+    parser.add_argument("--stage-timings", action="store_true",
+                        help="ステージごとの処理時間を計測して /metrics で公開する")
+    args = parser.parse_args(argv)
+
+    if args.stage_timings:
+        # ワーカープールの作成 (lifespan) より前に有効にする
+        STAGE_TIMINGS.enable()
+
+    service = ScoringService(workers=args.workers or None, chunksize=args.chunksize,
+                             clip_model_dir=args.clip_model, engagement_model_dir=args.engagement_model,
+                             model_variant=args.model_variant)
+    # 数千 rps ではアクセスログの出力自体が律速になるので出さない
+    uvicorn.run(create_app(service), host=args.host, port=args.port,
+                timeout_keep_alive=args.keep_alive, access_log=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+JSONL / CSV のストリーミング入出力
+
+スケジューリングツールの巨大なエクスポートを全件読み込まずに処理するため、
+1レコードずつ読み込んで PostCandidate にし、結果も1件ずつ書き出す。
+入力レコードの項目: text, has_media, is_premium, follower_count, likes, replies, reposts
+(任意で id は出力にそのまま引き継ぐ。images / videos は画像・動画パスのリスト、CSV では ";" 区切り。
+has_video はファイルなしで動画の投稿として試算する場合に指定する)
+"""
+import csv
+import gzip
+import json
+import sys
+from collections import deque, namedtuple
+
+from pipeline import PostCandidate
+
+FORMATS = ("jsonl", "csv")
+
+RESULT_FIELDS = ("id", "source_type", "filter_status", "base_potential", "engagement_score",
+                 "final_score", "visibility_status", "rank", "nsfw_score", "logs")
+# CSV はエラーの行も同じヘッダーで書き出す
+CSV_FIELDS = RESULT_FIELDS + ("error",)
+
+# PostCandidate に変換できなかったレコード (結果は {"id": ..., "error": ...} の行になる)
+RecordError = namedtuple("RecordError", ["error"])
+
+_TRUE_VALUES = {"1", "true", "yes", "y", "t", "on"}
+
+def detect_format(path, default="jsonl"):
+    """
+    拡張子 (.jsonl / .ndjson / .json / .csv、.gz 付きも可) から形式を判定する
+    """
+    if not path or path == "-":
+        return default
+    name = path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return default
+
+def open_text(path, mode):
+    """
+    "-" は標準入出力、.gz は gzip として開く
+    """
+    if path == "-":
+        return sys.stdin if "r" in mode else sys.stdout
+    if path.lower().endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in _TRUE_VALUES
+    return bool(value)
+
+def _to_number(value, cast):
+    if value is None or value == "":
+        return cast(0)
+    return cast(float(value))
+
+def _to_paths(value):
+    if not value:
+        return ()
+    if isinstance(value, str):
+        return tuple(path for path in value.split(";") if path)
+    return tuple(value)
+
+def post_from_record(record):
+    """
+    レコードを PostCandidate にする。text が無いレコードは KeyError、文字列でなければ TypeError
+    """
+    if not isinstance(record, dict):
+        raise TypeError(f"レコードはオブジェクトで指定してください: {record!r}")
+    text = record["text"]
+    if not isinstance(text, str):
+        raise TypeError(f"text は文字列で指定してください: {text!r}")
+    return PostCandidate(
+        text,
+        _to_bool(record.get("has_media", False)),
+        _to_bool(record.get("is_premium", False)),
+        _to_number(record.get("follower_count"), int),
+        likes=_to_number(record.get("likes"), float),
+        replies=_to_number(record.get("replies"), float),
+        reposts=_to_number(record.get("reposts"), float),
+        images=_to_paths(record.get("images")),
+        videos=_to_paths(record.get("videos")),
+        has_video=_to_bool(record.get("has_video", False)),
+    )
+
+def record_from_result(result, record_id=None):
+    record = result._asdict()
+    record["logs"] = [[[code.name, *params] for code, params in log] for log in result.logs]
+    return {"id": record_id, **record}
+
+def iter_records(stream, fmt):
+    """
+    入力ストリームからレコード (dict) を1件ずつ yield する
+    """
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "jsonl":
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        raise ValueError(f"未対応の形式です: {fmt}")
+
+class ResultWriter:
+    """
+    ScoreResult (変換できなかったレコードは RecordError) を JSONL / CSV で1件ずつ書き出す
+    """
+
+    def __init__(self, stream, fmt):
+        if fmt not in FORMATS:
+            raise ValueError(f"未対応の形式です: {fmt}")
+        self.stream = stream
+        self.fmt = fmt
+        self._csv = None
+        if fmt == "csv":
+            self._csv = csv.DictWriter(stream, fieldnames=CSV_FIELDS)
+            self._csv.writeheader()
+
+    def write(self, result, record_id=None):
+        if isinstance(result, RecordError):
+            self._write_record({"id": record_id, "error": result.error})
+            return
+        record = record_from_result(result, record_id)
+        if self._csv is not None:
+            # CSV ではログをコード名の ";" 区切りにする
+            record["logs"] = ";".join(entry[0] for log in record["logs"] for entry in log)
+        self._write_record(record)
+
+    def _write_record(self, record):
+        if self._csv is not None:
+            self._csv.writerow(record)
+        else:
+            self.stream.write(json.dumps(record, ensure_ascii=False))
+            self.stream.write("\n")
+
+def score_stream(records, score_iter):
+    """
+    レコードを PostCandidate に変換して score_iter (iter_score_batch など) に流し、
+    (レコードの id, ScoreResult) を入力順に yield する
+    変換できないレコード (text が無いなど) は止めずに (レコードの id, RecordError) を yield する
+    処理中の投稿の id だけを保持するので、メモリ使用量は入力サイズに依存しない
+    """
+    # (id, 変換できなかった場合は RecordError) を入力順に並べる
+    entries = deque()
+
+    def posts():
+        for index, record in enumerate(records):
+            record_id = record.get("id", index) if isinstance(record, dict) else index
+            try:
+                post = post_from_record(record)
+            except (KeyError, TypeError, ValueError) as e:
+                entries.append((record_id, RecordError(f"{type(e).__name__}: {e}")))
+                continue
+            entries.append((record_id, None))
+            yield post
+
+    for result in score_iter(posts()):
+        # この結果より前に並んでいる変換できなかったレコードを先に返す
+        while entries[0][1] is not None:
+            yield entries.popleft()
+        yield entries.popleft()[0], result
+    while entries:
+        yield entries.popleft()
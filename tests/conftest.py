@@ -0,0 +1,48 @@
+"""
+テストの共通設定 (リポジトリ直下のモジュールを import できるようにする) と共通のフィクスチャ
+
+    python -m pytest -q
+"""
+import os
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pipeline import PostCandidate  # noqa: E402
+
+# PASS / WARNING / DROP のどれにもなるテキスト (スパム・URL・疑問形・長文・空文字)
+TEXTS = [
+    "こんにちは",
+    "今日のランチ何にする？",
+    "無料配布やってます",
+    "無料配布やってます DM ME",
+    "絶対稼げる方法を教えます https://example.com",
+    "Giveaway のお知らせ #tag",
+    "詳しくはこちら https://example.com",
+    "質問です？ https://example.com",
+    "長文の投稿です。" * 30,
+    "リンクだけ https://example.com/a?b=c",
+    "",
+]
+
+def make_corpus(n=300, seed=0):
+    """
+    乱数シードから再現可能な PostCandidate のリスト (フォロワー数は STAGE 1 のしきい値の前後)
+    """
+    rng = random.Random(seed)
+    return [PostCandidate(rng.choice(TEXTS), rng.random() < 0.5, rng.random() < 0.4,
+                          rng.choice((0, 50, 500, 5000, 50000)),
+                          likes=rng.randrange(0, 200), replies=rng.randrange(0, 30), reposts=rng.randrange(0, 30),
+                          has_video=rng.random() < 0.2)
+            for _ in range(n)]
+
+@pytest.fixture
+def corpus():
+    """
+    corpus(n=300, seed=0) で make_corpus を呼ぶファクトリ
+    """
+    return make_corpus
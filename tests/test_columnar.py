@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from columnar import CandidateTable, columns_from_posts, score_columns
+from pipeline import PostCandidate, score_post
+
+def test_candidate_table_matches_per_post_scoring(corpus):
+    posts = corpus()
+    table = CandidateTable.from_posts(posts)
+    base_potential, final_score = table.score()
+    statuses = set()
+    for i, post in enumerate(posts):
+        result = score_post(post)
+        statuses.add(result.filter_status)
+        assert table.dropped[i] == (result.filter_status == "DROP")
+        # DROP の投稿は最終スコアだけが 0 (base_potential は列からの計算値のまま)
+        assert final_score[i] == pytest.approx(result.final_score)
+        if result.filter_status != "DROP":
+            assert base_potential[i] == pytest.approx(result.base_potential)
+    assert "DROP" in statuses
+
+def test_candidate_table_columns_match_columns_from_posts(corpus):
+    posts = corpus(seed=1)
+    table = CandidateTable.from_posts(posts, keep_text=False)
+    base_potential, final_score = score_columns(**columns_from_posts(posts))
+    final_score[table.dropped] = 0.0
+    for actual, wanted in zip(table.score(), (base_potential, final_score)):
+        np.testing.assert_allclose(actual, wanted)
+    assert table.nbytes < 64 * len(posts)
+
+def test_candidate_table_round_trips_posts(corpus):
+    posts = corpus(n=20, seed=2)
+    table = CandidateTable.from_posts(posts)
+    for post, restored in zip(posts, table):
+        assert (restored.text, restored.has_media, restored.has_video, restored.is_premium) == \
+               (post.text, post.has_media, post.has_video, post.is_premium)
+        assert (restored.likes, restored.replies, restored.reposts) == (post.likes, post.replies, post.reposts)
+    with pytest.raises(ValueError):
+        CandidateTable.from_posts(posts, keep_text=False)[0]
+
+def test_candidate_table_drops_spam_with_the_given_mute_list():
+    from keyword_matcher import KeywordMatcher
+
+    posts = [PostCandidate("無料配布やってます", True, False, 10, likes=100),
+             PostCandidate("buy crypto now", True, False, 10, likes=100)]
+    assert list(CandidateTable.from_posts(posts).score()[1]) == [0.0, 100.0]
+    tenant = CandidateTable.from_posts(posts, matcher=KeywordMatcher(["crypto"]))
+    assert list(tenant.dropped) == [False, True]
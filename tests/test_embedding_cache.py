@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from embedding_cache import EmbeddingCache, content_key
+
+def _vector(value, dim=4):
+    return np.full(dim, value, dtype=np.float32)
+
+def test_content_key_depends_on_model_version():
+    assert content_key("abc", "v1") == content_key(b"abc", "v1")
+    assert content_key("abc", "v1") != content_key("abc", "v2")
+
+def test_round_trip(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), dim=4, capacity=8)
+    cache.put_many([("a", _vector(1.0), {"score": 0.5}), ("b", _vector(2.0), None)])
+    found = cache.get_many(["a", "b", "missing"])
+    assert set(found) == {"a", "b"}
+    np.testing.assert_array_equal(found["a"][0], _vector(1.0))
+    assert found["a"][1] == {"score": 0.5}
+    assert found["b"][1] is None
+
+def test_reopen_keeps_entries(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), dim=4, capacity=8)
+    cache.put_many([("a", _vector(1.0), None)])
+    cache.close()
+    reopened = EmbeddingCache(str(tmp_path), dim=4, capacity=8)
+    np.testing.assert_array_equal(reopened.get_many(["a"])["a"][0], _vector(1.0))
+
+def test_dim_change_rebuilds(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), dim=4, capacity=8)
+    cache.put_many([("a", _vector(1.0), None)])
+    cache.close()
+    rebuilt = EmbeddingCache(str(tmp_path), dim=2, capacity=8)
+    assert len(rebuilt) == 0
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), dim=4, capacity=2)
+    cache.put_many([("a", _vector(1.0), None)])
+    cache.put_many([("b", _vector(2.0), None)])
+    cache.get_many(["a"])
+    cache.put_many([("c", _vector(3.0), None)])
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+
+def test_more_new_keys_than_capacity(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), dim=4, capacity=2)
+    cache.put_many([(key, _vector(i), None) for i, key in enumerate("xyz")])
+    assert len(cache) == 2
+
+def test_updated_key_is_not_evicted_in_same_batch(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), dim=4, capacity=2)
+    cache.put_many([("a", _vector(1.0), None)])
+    cache.put_many([("b", _vector(2.0), None)])
+    cache.put_many([("a", _vector(10.0), None), ("c", _vector(3.0), None)])
+    found = cache.get_many(["a", "b", "c"])
+    assert set(found) == {"a", "c"}
+    np.testing.assert_array_equal(found["a"][0], _vector(10.0))
+    np.testing.assert_array_equal(found["c"][0], _vector(3.0))
+
+def test_failed_put_does_not_corrupt_evicted_entries(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), dim=4, capacity=2)
+    cache.put_many([("a", _vector(1.0), None), ("b", _vector(2.0), None)])
+    # c は追い出した行に書き込まれ、d (次元が違う) の書き込みで失敗する
+    with pytest.raises(ValueError):
+        cache.put_many([("c", _vector(3.0), None), ("d", np.zeros(7, dtype=np.float32), None)])
+    expected = {"a": _vector(1.0), "b": _vector(2.0)}
+    found = cache.get_many(["a", "b", "c", "d"])
+    assert set(found) <= set(expected)
+    for key, (vector, _) in found.items():
+        np.testing.assert_array_equal(vector, expected[key])
+
+def _open_and_put(directory, key):
+    cache = EmbeddingCache(directory, dim=4, capacity=16)
+    cache.put_many([(key, _vector(float(ord(key))), None)])
+    cache.close()
+
+def test_concurrent_open_from_processes(tmp_path):
+    import multiprocessing
+    processes = [multiprocessing.Process(target=_open_and_put, args=(str(tmp_path), key)) for key in "abcdef"]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    cache = EmbeddingCache(str(tmp_path), dim=4, capacity=16)
+    assert set(cache.get_many(list("abcdef"))) == set("abcdef")
@@ -0,0 +1,43 @@
+import numpy as np
+
+import pipeline
+from feature_store import FeatureStore
+from pipeline import PostCandidate, score_post
+
+def _expected_scores(posts):
+    # STAGE 2 で DROP された投稿の最終スコアは 0
+    return np.array([score_post(post).final_score for post in posts])
+
+def test_feature_store_rescore_matches_score_post(corpus):
+    posts = corpus(seed=3)
+    store = FeatureStore.from_posts(posts)
+    np.testing.assert_allclose(store.rescore(), _expected_scores(posts))
+
+def test_feature_store_rescore_with_new_weights(monkeypatch, corpus):
+    posts = corpus(seed=4)
+    store = FeatureStore.from_posts(posts)
+    weights = dict(pipeline.WEIGHTS, like=2.0, reply=1.0, video=3.5)
+    scores = store.rescore(weights)
+    for key, value in weights.items():
+        monkeypatch.setitem(pipeline.WEIGHTS, key, value)
+    np.testing.assert_allclose(scores, _expected_scores(posts))
+
+def test_feature_store_top_k_and_save_load(tmp_path, corpus):
+    posts = corpus(seed=5)
+    store = FeatureStore.from_posts(posts)
+    scores = store.rescore()
+    top = store.top_k(10)
+    assert list(scores[top]) == sorted(scores, reverse=True)[:10]
+    store.save(tmp_path / "features.npz")
+    loaded = FeatureStore.load(tmp_path / "features.npz")
+    np.testing.assert_array_equal(loaded.rescore(), scores)
+    assert len(store.top_k(0)) == 0 and len(store.top_k(10_000)) == len(posts)
+
+def test_feature_store_uses_the_given_mute_list_after_columnar_use():
+    from columnar import columns_from_posts
+    from keyword_matcher import KeywordMatcher
+
+    posts = [PostCandidate("buy crypto now", False, False, 10, likes=100)]
+    columns_from_posts(posts)
+    store = FeatureStore.from_posts(posts, matcher=KeywordMatcher(["crypto"]))
+    assert list(store.dropped) == [True] and list(store.rescore()) == [0.0]
@@ -0,0 +1,65 @@
+import random
+import re
+
+from features import extract_features
+from keyword_matcher import KeywordMatcher, SwappableMatcher
+from pipeline import DEFAULT_SPAM_MATCHER, PostCandidate, stage_2_filtering_pre_scoring, stage_3_scoring
+
+# 特徴量抽出を入れる前に各ステージで使っていた判定
+def _original(text, matcher):
+    return {
+        "length": len(text),
+        "hashtag_count": len(re.findall(r"#\w+", text)),
+        "url_count": len(re.findall(r"http[s]?://", text)),
+        "has_question": "?" in text or "？" in text,
+        "keyword_hits": tuple(matcher.find_all(text)),
+    }
+
+def _extracted(text, matcher):
+    features = extract_features(text, matcher)
+    return {
+        "length": features.length,
+        "hashtag_count": features.hashtag_count,
+        "url_count": features.url_count,
+        "has_question": features.question_marks > 0,
+        "keyword_hits": features.keyword_hits,
+    }
+
+PIECES = ["#", "#tag", "＃タグ", "http", "https://", "http://x.com/h", "https://a.bhttps://c", "h", "ttp://",
+          "?", "？", " ", "\n", "稼げる", "GIVEAWAY", "dm me", "日本語", "😀", "abc", "_", "#_1"]
+
+def test_extract_features_matches_original_checks():
+    rng = random.Random(0)
+    texts = ["", "http://http://", "#a#b #c", "see https://x.com?q=1 and http://y.jp/path#frag"]
+    texts += ["".join(rng.choice(PIECES) for _ in range(rng.randint(0, 12))) for _ in range(3000)]
+    for text in texts:
+        assert _extracted(text, DEFAULT_SPAM_MATCHER) == _original(text, DEFAULT_SPAM_MATCHER), text
+
+def test_weighted_length_counts_wide_characters_twice():
+    assert extract_features("abc").weighted_length == 3
+    assert extract_features("日本語abc").weighted_length == 9
+    assert extract_features("—“”").weighted_length == 3
+
+def test_features_are_reextracted_for_another_mute_list():
+    post = PostCandidate("buy crypto now", False, False, 10)
+    stage_3_scoring(post)
+    assert stage_2_filtering_pre_scoring(post)[0] == "PASS"
+    assert stage_2_filtering_pre_scoring(post, KeywordMatcher(["crypto"]))[0] == "DROP"
+    # 同じキーワードリストなら別インスタンスでも抽出し直さない
+    features = post.features
+    assert stage_2_filtering_pre_scoring(post, KeywordMatcher(["CRYPTO"]))[0] == "DROP"
+    assert post.features is features
+
+def test_swappable_matcher_rebuild_invalidates_features():
+    matcher = SwappableMatcher(["old"])
+    post = PostCandidate("new words", False, False, 10)
+    assert stage_2_filtering_pre_scoring(post, matcher)[0] == "PASS"
+    matcher.rebuild(["new"]).result(timeout=5)
+    assert stage_2_filtering_pre_scoring(post, matcher)[0] == "DROP"
+
+def test_changing_text_clears_features():
+    post = PostCandidate("hello there", False, False, 10)
+    assert stage_2_filtering_pre_scoring(post)[0] == "PASS"
+    post.text = "無料配布"
+    assert post.features is None
+    assert stage_2_filtering_pre_scoring(post)[0] == "DROP"
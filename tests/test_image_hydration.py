@@ -0,0 +1,46 @@
+import io
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+PIL_Image = pytest.importorskip("PIL.Image")
+
+import visibility  # noqa: E402
+from image_hydration import ImageHydrator, decode_image, decode_image_or_none  # noqa: E402
+
+Post = namedtuple("Post", ["images", "videos"])
+
+@pytest.fixture
+def files(tmp_path):
+    good = tmp_path / "good.jpg"
+    PIL_Image.new("RGB", (640, 480), "red").save(good)
+    text = tmp_path / "notes.jpg"
+    text.write_text("これは画像ではない")
+    return {"good": str(good), "text": str(text), "missing": str(tmp_path / "missing.png")}
+
+def test_decode_image_shrinks_to_short_side(files):
+    image = decode_image(files["good"], size=224)
+    assert image.mode == "RGB" and min(image.size) == 224
+
+def test_decode_image_or_none_on_unreadable_files(files):
+    assert decode_image_or_none(files["missing"]) is None
+    assert decode_image_or_none(files["text"]) is None
+    assert decode_image_or_none(io.BytesIO(b"\x00" * 16)) is None
+
+def test_iter_hydrate_yields_none_for_bad_items_in_order(files):
+    hydrator = ImageHydrator(size=64, max_workers=2, max_inflight_bytes=1)
+    try:
+        images = hydrator.hydrate([files["text"], files["good"], files["missing"], files["good"]])
+    finally:
+        hydrator.close()
+    assert images[0] is None and images[2] is None
+    assert min(images[1].size) == 64 and min(images[3].size) == 64
+
+def test_score_posts_ignores_images_that_failed(monkeypatch):
+    classifier = object.__new__(visibility.ClipSafetyClassifier)
+    scores = {"ok": 0.25, "bad": np.nan, "worse": 0.75}
+    monkeypatch.setattr(classifier, "unsafe_scores", lambda images: np.array([scores[i] for i in images]),
+                        raising=False)
+    posts = [Post(["ok", "bad"], []), Post(["bad"], []), Post([], []), Post(["bad", "worse"], [])]
+    assert classifier.score_posts(posts) == [0.25, None, None, 0.75]
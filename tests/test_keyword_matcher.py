@@ -0,0 +1,54 @@
+import random
+
+import keyword_matcher
+from keyword_matcher import KeywordMatcher, SwappableMatcher
+
+def _brute_force(keywords, text):
+    lowered = text.lower()
+    keywords = list(dict.fromkeys(k.lower() for k in keywords if k))
+    return sorted((end, keyword) for keyword in keywords
+                  for end in range(len(keyword), len(lowered) + 1) if lowered[end - len(keyword):end] == keyword)
+
+def _automaton_only(keywords, monkeypatch):
+    monkeypatch.setattr(keyword_matcher, "REGEX_MAX_KEYWORDS", -1)
+    return KeywordMatcher(keywords)
+
+def _cases(seed):
+    rng = random.Random(seed)
+    alphabet = "abc稼げるDM "
+    for _ in range(200):
+        keywords = ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 4))) for _ in range(rng.randint(0, 8))]
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        yield keywords, text
+
+def test_regex_and_automaton_find_the_same_matches(monkeypatch):
+    for keywords, text in _cases(0):
+        regex = KeywordMatcher(keywords)
+        automaton = _automaton_only(keywords, monkeypatch)
+        monkeypatch.undo()
+        assert regex._pattern is not None and automaton._pattern is None
+        expected = _brute_force(keywords, text)
+        assert sorted(regex.iter_matches(text)) == expected
+        assert sorted(automaton.iter_matches(text)) == expected
+        assert regex.find_all(text) == automaton.find_all(text)
+        assert (regex.search(text) is None) == (not expected)
+
+def test_overlapping_and_nested_keywords(monkeypatch):
+    keywords = ["he", "she", "his", "hers", "dm me", "DM"]
+    text = "ushers, DM me!"
+    expected = [(4, "she"), (4, "he"), (6, "hers"), (10, "dm"), (13, "dm me")]
+    for matcher in (KeywordMatcher(keywords), _automaton_only(keywords, monkeypatch)):
+        assert sorted(matcher.iter_matches(text)) == sorted(expected)
+
+def test_large_lists_use_the_automaton():
+    matcher = KeywordMatcher(f"word{i}" for i in range(keyword_matcher.REGEX_MAX_KEYWORDS + 1))
+    assert matcher._pattern is None
+    assert matcher.find_all("xx WORD12 word300") == ["word1", "word12", "word3", "word30"]
+
+def test_swappable_matcher_keeps_latest_generation():
+    matcher = SwappableMatcher(["old"])
+    assert matcher.search("old news") == "old"
+    matcher.rebuild(["first"])
+    matcher.rebuild(["second"]).result(timeout=5)
+    assert matcher.search("first second") == "second"
+    assert matcher.find_all("old") == []
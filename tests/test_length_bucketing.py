@@ -0,0 +1,59 @@
+import random
+from concurrent.futures import Future
+
+import length_bucketing
+import parallel
+from length_bucketing import LengthBucketScheduler, PaddingStats, padding_efficiency, plan_batches
+
+def test_plan_batches_covers_every_index_once():
+    rng = random.Random(0)
+    lengths = [rng.randrange(1, 300) for _ in range(257)]
+    batches = plan_batches(lengths, batch_size=32)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    assert all(len(batch) <= 32 for batch in batches)
+    # 長さの順に並ぶので、バッチの最大長は単調に増える
+    maxima = [max(lengths[i] for i in batch) for batch in batches]
+    assert maxima == sorted(maxima)
+
+def test_plan_batches_respects_max_tokens():
+    lengths = [10] * 8 + [100] * 8
+    batches = plan_batches(lengths, batch_size=8, max_tokens=300)
+    for batch in batches:
+        assert max(lengths[i] for i in batch) * len(batch) <= 300
+
+def test_length_order_pads_less_than_input_order():
+    rng = random.Random(1)
+    lengths = [rng.choice((5, 200)) for _ in range(64)]
+    naive = [list(range(start, start + 16)) for start in range(0, 64, 16)]
+    assert padding_efficiency(lengths, plan_batches(lengths, 16)) > padding_efficiency(lengths, naive)
+
+def test_scheduler_adds_to_its_own_and_process_stats(monkeypatch):
+    monkeypatch.setattr(length_bucketing, "PADDING_STATS", PaddingStats())
+    scheduler = LengthBucketScheduler(batch_size=2)
+    scheduler.plan([1, 4, 1, 4])
+    metrics = scheduler.metrics()
+    assert metrics == length_bucketing.PADDING_STATS.metrics()
+    assert metrics["batches"] == 2 and metrics["real_tokens"] == 10 and metrics["padded_tokens"] == 10
+    assert metrics["padding_efficiency"] == 1.0 and metrics["naive_padding_efficiency"] == 10 / 16
+
+def test_drain_and_merge():
+    worker, parent = PaddingStats(), PaddingStats()
+    worker.add(2, 10, 12, 16)
+    parent.merge(worker.drain())
+    parent.merge(worker.drain())
+    assert parent.metrics()["padded_tokens"] == 12 and worker.batches == 0
+    assert 'xscorer_engagement_padding_efficiency{order="length"} 0.833333' in parent.prometheus_text()
+    assert PaddingStats().prometheus_text() == ""
+
+def test_submit_chunk_merges_worker_padding(monkeypatch):
+    stats = PaddingStats()
+    monkeypatch.setattr(parallel, "PADDING_STATS", stats)
+
+    class Executor:
+        def submit(self, fn, posts):
+            future = Future()
+            future.set_result((["result"], None, (1, 3, 4, 5)))
+            return future
+
+    assert parallel.submit_chunk(Executor(), ["post"]).result() == ["result"]
+    assert stats.metrics()["real_tokens"] == 3
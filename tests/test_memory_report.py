@@ -0,0 +1,61 @@
+import json
+
+from memory_report import MemoryReport
+from pipeline import PostCandidate, score_post
+from timings import STAGE_TIMINGS
+
+def test_report_attributes_allocations_to_stages():
+    memory = MemoryReport(every=50, top=5)
+    kept = []
+    memory.start()
+    try:
+        for i in range(120):
+            kept.append(score_post(PostCandidate(f"投稿 {i} " + "長文" * 50, False, True, 100, likes=i)))
+            memory.tick()
+    finally:
+        memory.stop()
+    report = memory.report()
+    assert report["records"] == 120
+    assert [batch["records"] for batch in report["batches"]] == [50, 50, 20]
+    assert report["traced_peak_bytes"] > 0
+    assert report["peak_batch"] is not None
+    # 保持している ScoreResult のログなどはステージ関数に帰属する
+    assert set(report["peak_by_stage"]) & {"features", "stage_1", "stage_2", "stage_3", "stage_4"}
+    assert 0 < len(report["top_sites"]) <= 5
+    json.dumps(report)
+    text = memory.summary_text(report)
+    assert text.startswith("memory: 120 records / 3 batches")
+
+def test_stage_deltas_on_sampled_records():
+    was_enabled, sample_every = STAGE_TIMINGS.enabled, STAGE_TIMINGS.sample_every
+    memory = MemoryReport(every=50, sample_every=10)
+    kept = []
+    memory.start()
+    try:
+        for i in range(120):
+            kept.append(score_post(PostCandidate(f"投稿 {i} " + "長文" * 50, False, True, 100, likes=i)))
+            memory.tick()
+    finally:
+        memory.stop()
+    # 実行中だけ有効にした計測は元に戻す
+    assert (STAGE_TIMINGS.enabled, STAGE_TIMINGS.sample_every) == (was_enabled, sample_every)
+    assert STAGE_TIMINGS.memory is None
+    report = memory.report()
+    assert [sum(deltas["samples"] for deltas in batch["stage_deltas"].values()) for batch in report["batches"]] \
+        == [5 * 5, 5 * 5, 2 * 5]
+    deltas = report["stage_deltas"]
+    assert set(deltas) == {"features", "stage_1", "stage_2", "stage_3", "stage_4"}
+    assert all(stats["samples"] == 12 for stats in deltas.values())
+    # ログや特徴量は各ステージで確保される
+    assert deltas["features"]["peak_bytes"] > 0 and deltas["stage_3"]["peak_bytes"] > 0
+    assert all(stats["peak_bytes"] >= 0 for stats in deltas.values())
+    json.dumps(report)
+    assert "net (mean)" in memory.summary_text(report)
+
+def test_empty_report():
+    memory = MemoryReport()
+    memory.start()
+    memory.stop()
+    report = memory.report()
+    assert report["records"] == 0 and report["batches"] == [] and report["peak_batch"] is None
+    assert "0 records" in memory.summary_text(report)
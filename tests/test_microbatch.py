@@ -0,0 +1,125 @@
+import threading
+
+import pytest
+
+import engagement_model
+import visibility
+from microbatch import MicroBatcher
+
+def test_results_follow_submission_order():
+    batcher = MicroBatcher(lambda items: [item * 2 for item in items], max_batch_size=4, max_wait_ms=20)
+    try:
+        futures = [batcher.submit(i) for i in range(10)]
+        assert [future.result(timeout=5) for future in futures] == [i * 2 for i in range(10)]
+        assert batcher.mean_batch_size > 1
+    finally:
+        batcher.close()
+
+def test_batch_errors_reach_every_caller():
+    def fail(items):
+        raise RuntimeError("boom")
+
+    batcher = MicroBatcher(fail, max_wait_ms=1)
+    try:
+        with pytest.raises(RuntimeError):
+            batcher(1, timeout=5)
+    finally:
+        batcher.close()
+
+def test_result_count_mismatch_is_an_error():
+    batcher = MicroBatcher(lambda items: [], max_wait_ms=1)
+    try:
+        with pytest.raises(ValueError):
+            batcher(1, timeout=5)
+    finally:
+        batcher.close()
+
+def test_submit_racing_close_never_leaves_pending_futures():
+    for _ in range(20):
+        batcher = MicroBatcher(lambda items: list(items), max_batch_size=8, max_wait_ms=1)
+        futures, rejected = [], []
+        start = threading.Barrier(5)
+
+        def submit_many():
+            start.wait()
+            for i in range(200):
+                try:
+                    futures.append(batcher.submit(i))
+                except RuntimeError:
+                    rejected.append(i)
+
+        threads = [threading.Thread(target=submit_many) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        batcher.close()
+        for thread in threads:
+            thread.join()
+        # 受け付けたリクエストは close の前にキューに入っているので、全て結果が返る
+        assert all(future.result(timeout=5) is not None for future in futures)
+        assert len(futures) + len(rejected) == 800
+
+def test_submit_after_close_is_rejected():
+    batcher = MicroBatcher(lambda items: list(items))
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit(1)
+
+def test_concurrent_callers_are_batched():
+    batcher = MicroBatcher(lambda items: list(items), max_batch_size=64, max_wait_ms=50)
+    results = {}
+
+    def call(i):
+        results[i] = batcher(i, timeout=5)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(32)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == {i: i for i in range(32)}
+        assert batcher.batches < 32
+    finally:
+        batcher.close()
+
+class _FakeClassifier:
+    def __init__(self, variant):
+        self.variant = variant
+
+    def score_posts(self, posts):
+        return [self.variant] * len(posts)
+
+class _FakePredictor:
+    def __init__(self, variant):
+        self.variant = variant
+
+    def predict_engagement(self, posts):
+        return [self.variant] * len(posts)
+
+def test_clip_batcher_is_per_variant(monkeypatch, tmp_path):
+    monkeypatch.setattr(visibility, "get_clip_classifier",
+                        lambda model_dir, variant=None: _FakeClassifier(variant))
+    monkeypatch.setattr(visibility, "_batchers", {})
+    fp32 = visibility.get_clip_batcher(str(tmp_path), variant="fp32")
+    int8 = visibility.get_clip_batcher(str(tmp_path), variant="int8")
+    try:
+        assert fp32 is not int8
+        assert visibility.get_clip_batcher(str(tmp_path), variant="int8") is int8
+        assert fp32("post", timeout=5) == "fp32"
+        assert int8("post", timeout=5) == "int8"
+    finally:
+        fp32.close()
+        int8.close()
+
+def test_engagement_batcher_is_per_variant(monkeypatch, tmp_path):
+    monkeypatch.setattr(engagement_model, "get_engagement_predictor",
+                        lambda model_dir, variant=None: _FakePredictor(variant))
+    monkeypatch.setattr(engagement_model, "_batchers", {})
+    monkeypatch.setenv("XSCORER_MODEL_VARIANT", "onnx")
+    default = engagement_model.get_engagement_batcher(str(tmp_path))
+    try:
+        assert engagement_model.get_engagement_batcher(str(tmp_path), variant="onnx") is default
+        assert default("post", timeout=5) == "onnx"
+    finally:
+        default.close()
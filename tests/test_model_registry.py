@@ -0,0 +1,102 @@
+import gc
+import time
+import weakref
+
+from model_registry import ModelRegistry, model_key
+
+class FakeModel:
+    """
+    最後の参照が無くなったときにリソースを解放するモデル (ClipSafetyClassifier と同じ作り)
+    """
+
+    def __init__(self, size=100):
+        self.size = size
+        self.released = released = []
+        weakref.finalize(self, released.append, True)
+
+    def memory_bytes(self):
+        return self.size
+
+def test_loader_runs_once_per_name():
+    registry = ModelRegistry()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return FakeModel()
+
+    first = registry.get("a", loader)
+    assert registry.get("a", loader) is first
+    assert len(calls) == 1
+
+def test_evict_keeps_models_in_use_and_releases_them_after_the_last_reference():
+    registry = ModelRegistry()
+    model = registry.get("a", FakeModel)
+    released = model.released
+    assert registry.evict("a")
+    assert not registry.is_loaded("a") and not registry.evict("a")
+    # 使用中の呼び出し元は解放後も使える
+    assert not released and model.memory_bytes() == 100
+    del model
+    gc.collect()
+    assert released == [True]
+
+def test_budget_eviction_does_not_break_held_models():
+    registry = ModelRegistry(ram_budget_bytes=150)
+    old = registry.get("old", FakeModel)
+    new = registry.get("new", FakeModel)
+    assert list(registry.memory_usage()) == ["new"]
+    assert not old.released and not new.released
+    # 次に取得すると再ロードされる
+    assert registry.get("old", FakeModel) is not old
+
+def test_idle_eviction_releases_unreferenced_models():
+    registry = ModelRegistry()
+    released = registry.get("a", FakeModel).released
+    time.sleep(0.01)
+    assert registry.evict_idle(0) == ["a"]
+    assert released == [True]
+
+def test_models_without_close_can_be_evicted():
+    registry = ModelRegistry()
+    registry.get("a", lambda: object())
+    assert registry.evict("a")
+
+def test_model_key_includes_loader_options():
+    base = model_key("clip-safety", "models/clip", "fp32")
+    assert base == model_key("clip-safety", "models/clip", "fp32", num_threads=None)
+    assert base != model_key("clip-safety", "models/clip", "int8")
+    assert base != model_key("clip-safety", "models/clip", "fp32", num_threads=2)
+    assert (model_key("clip-safety", "models/clip", "fp32", num_threads=2, batch_size=8)
+            == model_key("clip-safety", "models/clip", "fp32", batch_size=8, num_threads=2))
+    assert base.startswith("clip-safety:fp32:")
+
+def test_get_clip_classifier_loads_per_options(monkeypatch):
+    import visibility
+
+    monkeypatch.setattr(visibility, "REGISTRY", ModelRegistry())
+    monkeypatch.setattr(visibility, "ClipSafetyClassifier", lambda model_dir, **kwargs: FakeModel())
+    two = visibility.get_clip_classifier("models/clip", "fp32", num_threads=2)
+    assert visibility.get_clip_classifier("models/clip", "fp32", num_threads=2) is two
+    assert visibility.get_clip_classifier("models/clip", "fp32", num_threads=4) is not two
+
+def test_workers_fetch_models_from_the_registry_per_chunk(monkeypatch):
+    import parallel
+    from pipeline import PostCandidate
+
+    loads = []
+
+    class Visibility:
+        def score_posts(self, posts):
+            return [0.0] * len(posts)
+
+    def load(model_dir, variant=None, num_threads=None):
+        loads.append((model_dir, variant, num_threads))
+        return Visibility()
+
+    monkeypatch.setattr(parallel, "_load_visibility", load)
+    monkeypatch.setattr(parallel, "_worker_models", ("models/clip", "int8", None))
+    for _ in range(2):
+        results, _, padding = parallel._score_chunk([PostCandidate("x", True, False, 0, images=["a.jpg"])])
+        assert results[0].nsfw_score == 0.0 and padding is None
+    assert loads == [("models/clip", "int8", 1)] * 2
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from model_variants import resolve_variant
+
+def test_resolve_variant(monkeypatch):
+    monkeypatch.delenv("XSCORER_MODEL_VARIANT", raising=False)
+    assert resolve_variant() == "fp32"
+    assert resolve_variant("INT8") == "int8"
+    monkeypatch.setenv("XSCORER_MODEL_VARIANT", "onnx")
+    assert resolve_variant() == "onnx"
+    with pytest.raises(ValueError):
+        resolve_variant("fp16")
+
+def test_export_onnx_is_keyed_on_weights(tmp_path):
+    torch = pytest.importorskip("torch")
+    pytest.importorskip("onnx")
+    from model_variants import export_onnx
+
+    module = torch.nn.Linear(4, 2)
+    example = (torch.zeros(1, 4),)
+    path = str(tmp_path / "linear.onnx")
+    first = export_onnx(module, example, path, ("x",), ("y",))
+    assert os.path.exists(first)
+    assert export_onnx(module, example, path, ("x",), ("y",)) == first
+
+    with torch.no_grad():
+        module.weight.add_(1.0)
+    second = export_onnx(module, example, path, ("x",), ("y",))
+    assert second != first and os.path.exists(second)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
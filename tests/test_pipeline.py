@@ -0,0 +1,59 @@
+from parallel import score_parallel
+from pipeline import (
+    analyze_post,
+    compute_engagement_score,
+    rank_tier,
+    score_batch,
+    score_post,
+    stage_4_filtering_visibility,
+)
+
+def _streamlit_path(post, nsfw_score=None):
+    # app.py と同じ組み立て (STAGE 1〜3 は analyze_post、スコアと STAGE 4 はその場で計算)
+    (_, s1_log, source_type), (s2_status, s2_log), s3 = analyze_post(
+        post.text, post.has_media, post.is_premium, post.follower_count, has_video=post.has_video)
+    if s2_status == "DROP":
+        return source_type, s2_status, None
+    base_potential, _ = s3
+    final_score = compute_engagement_score(post.likes, post.replies, post.reposts) * base_potential
+    s4_status, _ = stage_4_filtering_visibility(post, final_score, nsfw_score)
+    rank = rank_tier(final_score) if s4_status != "DROP" else None
+    return source_type, s2_status, (base_potential, final_score, s4_status, rank)
+
+def _summary(result):
+    if result.filter_status == "DROP":
+        return result.source_type, result.filter_status, None
+    return result.source_type, result.filter_status, (result.base_potential, result.final_score,
+                                                      result.visibility_status, result.rank)
+
+def test_score_batch_matches_streamlit_path(corpus):
+    posts = corpus()
+    results = score_batch(posts)
+    assert len(results) == len(posts)
+    assert {result.filter_status for result in results} >= {"PASS", "WARNING", "DROP"}
+    for post, result in zip(posts, results):
+        assert _summary(result) == _streamlit_path(post)
+
+def test_score_batch_matches_score_post(corpus):
+    for post, result in zip(corpus(seed=1), score_batch(corpus(seed=1))):
+        assert result == score_post(post)
+
+def test_visibility_batch_matches_per_post_nsfw_scores(corpus):
+    posts = corpus(seed=2)
+    for i, post in enumerate(posts):
+        post.images = (f"{i}.jpg",) if i % 3 == 0 else ()
+    nsfw = {f"{i}.jpg": (i % 10) / 10 for i in range(len(posts))}
+
+    class FakeVisibility:
+        def score_posts(self, batch):
+            return [max(nsfw[image] for image in post.images) for post in batch]
+
+    results = score_batch(posts, visibility=FakeVisibility(), batch_size=16)
+    for post, result in zip(posts, results):
+        expected = nsfw[post.images[0]] if post.images and result.filter_status != "DROP" else None
+        assert result.nsfw_score == expected
+        assert _summary(result) == _streamlit_path(post, expected)
+
+def test_parallel_matches_serial(corpus):
+    expected = score_batch(corpus(seed=3))
+    assert score_parallel(corpus(seed=3), workers=2, chunksize=16) == expected
@@ -0,0 +1,64 @@
+import os
+import pstats
+import threading
+import time
+
+import pytest
+
+import profiling
+from profiling import Profiler, SamplingProfiler
+
+def _busy(seconds):
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(range(100))
+    return total
+
+def _idle(seconds):
+    time.sleep(seconds)
+
+@pytest.fixture
+def busy_stage(monkeypatch):
+    monkeypatch.setattr(profiling, "STAGE_FUNCTIONS", {("test_profiling.py", "_busy"): "busy"})
+
+def test_sample_weights_add_up_to_elapsed_time(busy_stage):
+    with Profiler("sample", interval=0.002) as profiler:
+        _busy(0.3)
+        _idle(0.1)
+    seconds = profiler.stage_seconds()
+    total = sum(seconds.values())
+    assert total == pytest.approx(profiler.elapsed, rel=0.1)
+    assert seconds["busy"] == pytest.approx(0.3, rel=0.25)
+
+def test_sampler_thread_mode_off_main_thread(busy_stage):
+    sampler = SamplingProfiler(interval=0.002)
+    result = {}
+
+    def run():
+        sampler.start()
+        _busy(0.2)
+        sampler.stop()
+        result["seconds"] = sampler.stage_seconds()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    assert sampler.mode == "thread"
+    assert result["seconds"].get("busy", 0.0) > 0.1
+
+def test_cprofile_writes_outputs(tmp_path, busy_stage):
+    with Profiler("cprofile") as profiler:
+        _busy(0.05)
+    paths = profiler.write(str(tmp_path / "run"))
+    assert [os.path.basename(path) for path in paths] == ["run.pstats", "run.collapsed", "run.stages.txt"]
+    assert pstats.Stats(paths[0]).total_calls > 0
+    with open(paths[1], encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert any("_busy (test_profiling.py" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert profiler.stage_seconds()["busy"] > 0.04
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        Profiler("perf")
@@ -0,0 +1,70 @@
+import asyncio
+import json
+from concurrent.futures import Future
+
+import service
+from pipeline import PostCandidate, score_post
+from service import InvalidRecord, ScoringService, _parse_ndjson
+from streaming import record_from_result
+
+def _collect(service_, records):
+    async def run():
+        service_.start()
+        try:
+            return [line async for chunk in service_.iter_batch(records) for line in chunk.splitlines()]
+        finally:
+            service_.stop()
+    return [json.loads(line) for line in asyncio.run(run())]
+
+def test_parse_ndjson_keeps_bad_lines_as_errors():
+    records = _parse_ndjson(b'{"text": "a"}\n\nnot json\n{"text": "b"}\n')
+    assert records[0] == {"text": "a"} and records[2] == {"text": "b"}
+    assert isinstance(records[1], InvalidRecord)
+
+def test_iter_batch_matches_score_post_and_reports_bad_records():
+    records = [{"id": i, "text": f"投稿 {i} #tag", "follower_count": 100 * i} for i in range(7)]
+    records.insert(3, InvalidRecord("JSONDecodeError: bad"))
+    records.insert(5, {"id": "no-text"})
+    lines = _collect(ScoringService(workers=2, chunksize=3), records)
+    assert len(lines) == len(records)
+    assert lines[3] == {"id": 3, "error": "JSONDecodeError: bad"}
+    assert lines[5]["id"] == "no-text" and lines[5]["error"].startswith("KeyError")
+    for record, line in zip(records, lines):
+        if isinstance(record, dict) and "text" in record:
+            post = PostCandidate(record["text"], False, False, record["follower_count"])
+            expected = json.loads(json.dumps(record_from_result(score_post(post), record["id"])))
+            assert line == expected
+
+def test_failed_chunk_becomes_error_lines(monkeypatch):
+    service_ = ScoringService(workers=1, chunksize=2)
+
+    async def failing_submit(posts):
+        future = Future()
+        future.set_exception(RuntimeError("worker died"))
+        return asyncio.wrap_future(future)
+
+    monkeypatch.setattr(service_, "_submit", failing_submit)
+    lines = _collect(service_, [{"id": i, "text": "x"} for i in range(3)])
+    assert [line["id"] for line in lines] == [0, 1, 2]
+    assert all(line["error"] == "RuntimeError: worker died" for line in lines)
+
+def test_score_one_uses_configured_variant(monkeypatch):
+    variants = []
+
+    def fake_batcher(model_dir, variant=None):
+        variants.append(variant)
+        batcher = type("Batcher", (), {})()
+
+        def submit(post):
+            future = Future()
+            future.set_result([1.0, 2.0, 3.0])
+            return future
+
+        batcher.submit = submit
+        return batcher
+
+    monkeypatch.setattr(service, "get_engagement_batcher", fake_batcher)
+    service_ = ScoringService(workers=1, engagement_model_dir="/models/engagement", model_variant="int8")
+    result = asyncio.run(service_.score_one({"id": 1, "text": "こんにちは"}))
+    assert variants == ["int8"]
+    assert result["id"] == 1
@@ -0,0 +1,125 @@
+import csv
+import io
+import json
+
+import pytest
+
+import cli
+from pipeline import PostCandidate, iter_score_batch, score_post
+from streaming import (
+    RecordError,
+    ResultWriter,
+    detect_format,
+    iter_records,
+    open_text,
+    post_from_record,
+    record_from_result,
+    score_stream,
+)
+
+RECORDS = [
+    {"id": "a", "text": "こんにちは？", "has_media": True, "is_premium": False, "follower_count": 10,
+     "likes": 3, "replies": 1, "reposts": 0},
+    {"id": "b", "text": "無料配布 https://example.com", "has_media": False, "is_premium": True,
+     "follower_count": 5000, "likes": 100, "replies": 0, "reposts": 2},
+    {"text": "動画の投稿", "has_video": True, "follower_count": 0},
+]
+
+def _expected(record, index):
+    post = PostCandidate(record["text"], record.get("has_media", False), record.get("is_premium", False),
+                         record.get("follower_count", 0), likes=record.get("likes", 0),
+                         replies=record.get("replies", 0), reposts=record.get("reposts", 0),
+                         has_video=record.get("has_video", False))
+    return json.loads(json.dumps(record_from_result(score_post(post), record.get("id", index)),
+                                 ensure_ascii=False))
+
+def test_detect_format():
+    assert detect_format("posts.csv.gz") == "csv"
+    assert detect_format("posts.NDJSON") == "jsonl"
+    assert detect_format("-") == detect_format("posts.txt") == "jsonl"
+
+def test_csv_values_are_parsed_like_json():
+    row = {"text": "x", "has_media": "yes", "is_premium": "0", "follower_count": "12.0", "likes": "",
+           "images": "a.jpg;b.jpg", "videos": ""}
+    post = post_from_record(row)
+    assert post.has_media and not post.is_premium
+    assert (post.follower_count, post.likes, post.images, post.videos) == (12, 0.0, ("a.jpg", "b.jpg"), ())
+
+def test_jsonl_round_trip_matches_score_post():
+    source = io.StringIO("".join(json.dumps(record, ensure_ascii=False) + "\n\n" for record in RECORDS))
+    out = io.StringIO()
+    writer = ResultWriter(out, "jsonl")
+    for record_id, result in score_stream(iter_records(source, "jsonl"), iter_score_batch):
+        writer.write(result, record_id)
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert lines == [_expected(record, index) for index, record in enumerate(RECORDS)]
+
+def test_csv_round_trip(tmp_path):
+    path = tmp_path / "posts.csv.gz"
+    fields = ["id", "text", "has_media", "is_premium", "follower_count", "likes", "replies", "reposts"]
+    with open_text(str(path), "w") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for record in RECORDS[:2]:
+            writer.writerow({field: record.get(field, "") for field in fields})
+    out = io.StringIO()
+    with open_text(str(path), "r") as f:
+        writer = ResultWriter(out, "csv")
+        for record_id, result in score_stream(iter_records(f, "csv"), iter_score_batch):
+            writer.write(result, record_id)
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    for row, record in zip(rows, RECORDS):
+        expected = _expected(record, None)
+        assert row["id"] == record["id"]
+        assert row["filter_status"] == expected["filter_status"]
+        assert float(row["final_score"]) == pytest.approx(expected["final_score"])
+        assert row["logs"] == ";".join(entry[0] for log in expected["logs"] for entry in log)
+
+def test_cli_matches_in_process_scoring(tmp_path):
+    source, target = tmp_path / "posts.jsonl", tmp_path / "scores.jsonl"
+    source.write_text("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in RECORDS * 20),
+                      encoding="utf-8")
+    cli.main([str(source), "-o", str(target), "--workers", "2", "--chunksize", "7"])
+    lines = [json.loads(line) for line in target.read_text(encoding="utf-8").splitlines()]
+    assert lines == [_expected(record, index) for index, record in enumerate(RECORDS * 20)]
+
+def test_invalid_records_become_error_lines():
+    records = [RECORDS[0], {"id": "no-text", "likes": 1}, {"id": "null", "text": None}, RECORDS[1], ["x"]]
+    out = io.StringIO()
+    writer = ResultWriter(out, "jsonl")
+    for record_id, result in score_stream(iter(records), iter_score_batch):
+        writer.write(result, record_id)
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [line["id"] for line in lines] == ["a", "no-text", "null", "b", 4]
+    assert lines[0] == _expected(RECORDS[0], 0)
+    assert lines[3] == _expected(RECORDS[1], 3)
+    for line in (lines[1], lines[2], lines[4]):
+        assert set(line) == {"id", "error"}
+    assert lines[1]["error"].startswith("KeyError")
+    assert lines[2]["error"].startswith("TypeError")
+
+def test_error_lines_in_csv():
+    out = io.StringIO()
+    writer = ResultWriter(out, "csv")
+    writer.write(RecordError("KeyError: 'text'"), "x")
+    writer.write(score_post(PostCandidate("こんにちは", False, False, 0)), "y")
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert (rows[0]["id"], rows[0]["error"], rows[0]["filter_status"]) == ("x", "KeyError: 'text'", "")
+    assert (rows[1]["id"], rows[1]["error"]) == ("y", "")
+
+def test_cli_reports_invalid_records(tmp_path, capsys):
+    source, target = tmp_path / "posts.jsonl", tmp_path / "scores.jsonl"
+    records = [{"id": "bad"}] + RECORDS + [{"id": "null", "text": None}]
+    source.write_text("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records),
+                      encoding="utf-8")
+    cli.main([str(source), "-o", str(target), "--workers", "2", "--chunksize", "2"])
+    lines = [json.loads(line) for line in target.read_text(encoding="utf-8").splitlines()]
+    assert [line.get("id") for line in lines] == ["bad", "a", "b", 3, "null"]
+    assert lines[1:4] == [_expected(record, index + 1) for index, record in enumerate(RECORDS)]
+    assert "2 件" in capsys.readouterr().err
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        list(iter_records(io.StringIO(""), "xml"))
+    with pytest.raises(ValueError):
+        ResultWriter(io.StringIO(), "xml")
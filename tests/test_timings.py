@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from pipeline import PostCandidate, score_post
+from timings import SIGNIFICANT_BITS, LatencyHistogram, StageTimings, bucket_bounds, bucket_index
+
+def test_values_fall_inside_their_bucket_bounds():
+    rng = random.Random(0)
+    values = list(range(1024)) + [rng.randrange(1, 1 << 40) for _ in range(5000)]
+    for value in values:
+        low, high = bucket_bounds(bucket_index(value))
+        assert low <= value <= high
+        # 相対誤差は 2^-(SIGNIFICANT_BITS - 1) 以内
+        assert high - low <= value / (1 << (SIGNIFICANT_BITS - 1))
+
+def test_buckets_are_contiguous():
+    previous_high = -1
+    for index in range(bucket_index(1 << 30)):
+        low, high = bucket_bounds(index)
+        assert low == previous_high + 1
+        previous_high = high
+
+def test_percentiles_are_close_to_exact():
+    rng = random.Random(1)
+    values = sorted(rng.randrange(1000, 10_000_000) for _ in range(10000))
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    for q in (0.5, 0.95, 0.99):
+        exact = values[int(q * len(values)) - 1]
+        assert histogram.percentile(q) == pytest.approx(exact, rel=0.02)
+    assert histogram.percentile(1.0) <= histogram.max == values[-1]
+
+def test_drain_and_merge_equal_recording_in_one_place():
+    worker_a, worker_b, direct, parent = StageTimings(), StageTimings(), StageTimings(), StageTimings()
+    for i in range(1, 200):
+        (worker_a if i % 2 else worker_b).record((("stage_1", i * 100),))
+        direct.record((("stage_1", i * 100),))
+    parent.merge(worker_a.drain())
+    parent.merge(worker_b.drain())
+    assert parent.summary() == direct.summary()
+    assert worker_a.drain() == {}
+
+def test_prometheus_text():
+    timings = StageTimings()
+    timings.enable(4)
+    timings.record((("stage_2", 2_000_000),))
+    text = timings.prometheus_text()
+    assert 'xscorer_stage_latency_seconds{stage="stage_2",quantile="0.5"}' in text
+    assert 'xscorer_stage_latency_seconds_count{stage="stage_2"} 1' in text
+    assert "xscorer_stage_timing_sample_every 4" in text
+
+def test_sampler_measures_one_in_sample_every():
+    timings = StageTimings()
+    timings.enable(3)
+    for _ in range(9):
+        clock = timings.clock()
+        clock.lap("step")
+        clock.finish("total")
+    summary = timings.summary()
+    assert summary["step"]["count"] == summary["total"]["count"] == 3
+
+def test_disabled_timings_record_nothing():
+    timings = StageTimings()
+    timings.clock().lap("step")
+    with timings.timed("batch"):
+        pass
+    assert timings.summary() == {}
+
+def test_timed_skips_failed_blocks():
+    timings = StageTimings()
+    timings.enable(1)
+    with timings.timed("ok"):
+        pass
+    with pytest.raises(ValueError):
+        with timings.timed("failed"):
+            raise ValueError
+    assert list(timings.summary()) == ["ok"]
+
+def test_score_post_records_every_stage(monkeypatch):
+    import pipeline
+
+    timings = StageTimings()
+    timings.enable(1)
+    monkeypatch.setattr(pipeline, "STAGE_TIMINGS", timings)
+    score_post(PostCandidate("こんにちは #tag", False, False, 100))
+    assert set(timings.summary()) == {"features", "stage_1", "stage_2", "stage_3", "stage_4", "score_post"}
@@ -0,0 +1,22 @@
+import time
+
+import video_sampling
+from video_sampling import KeyframeSampler
+
+def _fake_sample(item, max_frames, time_budget_s, size):
+    if item == "broken.mp4":
+        raise OSError("moov atom not found")
+    if item == "huge.mp4":
+        time.sleep(1.0)
+    return [f"{item}:frame"]
+
+def test_broken_and_slow_videos_become_none(monkeypatch):
+    monkeypatch.setattr(video_sampling, "sample_keyframes", _fake_sample)
+    sampler = KeyframeSampler(max_workers=2, time_budget_s=0.05, timeout_s=0.2)
+    try:
+        started = time.perf_counter()
+        results = sampler.sample(["a.mp4", "broken.mp4", "huge.mp4", "b.mp4"])
+        assert time.perf_counter() - started < 0.9
+        assert results == [["a.mp4:frame"], None, None, ["b.mp4:frame"]]
+    finally:
+        sampler.close()
@@ -0,0 +1,255 @@
+"""
+ステージごとの処理時間の計測 (HDR 形式のレイテンシヒストグラム)
+
+score_post などの各ステージの所要時間を ns 単位で記録し、p50 / p95 / p99 を出す。
+1件あたり数 µs のパイプラインで時刻を毎回取るとそれだけで数 % 遅くなるので、
+sample_every 件に1件だけ計測する (計測しない投稿のコストは itertools の next() 1回と、
+何もしない StageClock.lap の呼び出し分)。
+ヒストグラムは HDR Histogram と同じ対数線形のバケット (有効 SIGNIFICANT_BITS ビット) で、
+値の大きさによらず相対誤差は約 1.5% に収まる。
+Prometheus のテキスト形式 (summary) で書き出せる。
+
+    XSCORER_STAGE_TIMINGS=1 で有効 (XSCORER_STAGE_TIMINGS_SAMPLE で計測間隔、既定 256 件に1件)
+"""
+import itertools
+import os
+import threading
+from contextlib import contextmanager
+from time import perf_counter_ns
+
+SIGNIFICANT_BITS = 7
+DEFAULT_SAMPLE_EVERY = int(os.environ.get("XSCORER_STAGE_TIMINGS_SAMPLE", 256))
+QUANTILES = (0.5, 0.95, 0.99)
+
+_HALF = 1 << (SIGNIFICANT_BITS - 1)
+_EXACT = 1 << SIGNIFICANT_BITS
+
+def bucket_index(value):
+    """
+    値 (0 以上の整数) のバケット番号。2^SIGNIFICANT_BITS 未満はそのまま、それ以上は上位ビットで丸める
+    """
+    if value < _EXACT:
+        return value
+    shift = value.bit_length() - SIGNIFICANT_BITS
+    return shift * _HALF + (value >> shift)
+
+def bucket_bounds(index):
+    """
+    バケットに入る値の範囲 (下限, 上限) を返す
+    """
+    if index < _EXACT:
+        return index, index
+    shift = index // _HALF - 1
+    mantissa = index - shift * _HALF
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+class LatencyHistogram:
+    """
+    ns 単位のレイテンシのヒストグラム (使われたバケットだけを dict で持つ)
+    """
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        # bucket_index をインライン展開したもの (計測対象の投稿ごとに数回呼ばれる)
+        if value < _EXACT:
+            index = value
+        else:
+            shift = value.bit_length() - SIGNIFICANT_BITS
+            index = shift * _HALF + (value >> shift)
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, snapshot):
+        counts, count, total, maximum = snapshot
+        for index, n in counts.items():
+            self.counts[index] = self.counts.get(index, 0) + n
+        self.count += count
+        self.total += total
+        self.max = max(self.max, maximum)
+
+    def snapshot(self):
+        return dict(self.counts), self.count, self.total, self.max
+
+    def percentile(self, q):
+        """
+        q (0〜1) 分位点の推定値 (バケットの中央値)
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                low, high = bucket_bounds(index)
+                return min((low + high) / 2, self.max)
+        return float(self.max)
+
+class StageClock:
+    """
+    1回の呼び出しの中のステージの区切りを記録し、finish() でまとめて StageTimings に記録する
+    lap(name) は前の区切りから今までを name のステージの時間とする
+    StageTimings.memory (memory_report.MemoryReport) が設定されていれば、ステージごとのメモリの増減も渡す
+    """
+    __slots__ = ("timings", "started", "last", "stages", "memory")
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.memory = timings.memory
+        if self.memory is not None:
+            self.memory.begin_stages()
+        self.started = self.last = perf_counter_ns()
+        self.stages = []
+
+    def lap(self, name):
+        if self.memory is not None:
+            self.memory.lap(name)
+        now = perf_counter_ns()
+        self.stages.append((name, now - self.last))
+        self.last = now
+
+    def finish(self, total=None):
+        """
+        total: 指定すると、開始から最後の lap までの時間もこの名前で記録する
+        """
+        if total is not None:
+            self.stages.append((total, self.last - self.started))
+        self.timings.record(self.stages)
+
+class _NullClock:
+    # サンプリング対象外の呼び出し用 (何も計測しない)
+    __slots__ = ()
+
+    def lap(self, name):
+        pass
+
+    def finish(self, total=None):
+        pass
+
+_NULL_CLOCK = _NullClock()
+
+class StageTimings:
+    """
+    ステージ名ごとの LatencyHistogram
+    sampler: 計測する呼び出しで True を返すイテレーター (無効時は常に False)
+    memory: 計測する呼び出しのステージごとのメモリの増減を受け取る MemoryReport (既定は None)
+    """
+
+    def __init__(self, sample_every=DEFAULT_SAMPLE_EVERY):
+        self.sample_every = sample_every
+        self.enabled = False
+        self.memory = None
+        self.sampler = itertools.repeat(False)
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def enable(self, sample_every=None):
+        if sample_every is not None:
+            self.sample_every = max(1, sample_every)
+        self.enabled = True
+        if self.sample_every <= 1:
+            self.sampler = itertools.repeat(True)
+        else:
+            self.sampler = itertools.cycle([False] * (self.sample_every - 1) + [True])
+
+    def disable(self):
+        self.enabled = False
+        self.sampler = itertools.repeat(False)
+
+    def clock(self):
+        """
+        サンプリング対象の呼び出しなら StageClock、それ以外は何も計測しない時計を返す
+        """
+        return StageClock(self) if next(self.sampler) else _NULL_CLOCK
+
+    @contextmanager
+    def timed(self, name):
+        """
+        with ブロックの処理時間を name として記録する (無効時は計測しない。例外で抜けた場合も記録しない)
+        バッチ推論など、サンプリングせずに毎回計測する処理用
+        """
+        if not self.enabled:
+            yield
+            return
+        started = perf_counter_ns()
+        yield
+        self.record(((name, perf_counter_ns() - started),))
+
+    def record(self, stages):
+        """
+        stages: (ステージ名, ns) の iterable
+        """
+        with self._lock:
+            for name, value in stages:
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = self.histograms[name] = LatencyHistogram()
+                histogram.record(value)
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def drain(self):
+        """
+        これまでの計測結果を取り出してリセットする (ワーカープロセスから親プロセスへ渡す用)
+        """
+        with self._lock:
+            histograms, self.histograms = self.histograms, {}
+        return {name: histogram.snapshot() for name, histogram in histograms.items()}
+
+    def merge(self, snapshots):
+        with self._lock:
+            for name, snapshot in snapshots.items():
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = self.histograms[name] = LatencyHistogram()
+                histogram.merge(snapshot)
+
+    def summary(self):
+        """
+        {ステージ名: {count, mean_us, p50_us, p95_us, p99_us, max_us}} (count は計測した件数)
+        """
+        with self._lock:
+            histograms = dict(self.histograms)
+        return {name: {
+            "count": histogram.count,
+            "mean_us": histogram.total / histogram.count / 1000 if histogram.count else 0.0,
+            **{f"p{round(q * 100)}_us": histogram.percentile(q) / 1000 for q in QUANTILES},
+            "max_us": histogram.max / 1000,
+        } for name, histogram in histograms.items()}
+
+    def prometheus_text(self, prefix="xscorer"):
+        """
+        Prometheus のテキスト形式 (summary 型、秒単位)
+        """
+        name = f"{prefix}_stage_latency_seconds"
+        lines = [
+            f"# HELP {name} Pipeline stage latency (sampled 1 in {self.sample_every} calls).",
+            f"# TYPE {name} summary",
+        ]
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+        for stage, histogram in histograms:
+            for q in QUANTILES:
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {histogram.percentile(q) / 1e9:.9f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.total / 1e9:.9f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+        lines.append(f"# HELP {prefix}_stage_timing_sample_every Stage timings record 1 in this many calls.")
+        lines.append(f"# TYPE {prefix}_stage_timing_sample_every gauge")
+        lines.append(f"{prefix}_stage_timing_sample_every {self.sample_every if self.enabled else 0}")
+        return "\n".join(lines) + "\n"
+
+STAGE_TIMINGS = StageTimings()
+if os.environ.get("XSCORER_STAGE_TIMINGS", "").strip().lower() in ("1", "true", "yes", "on"):
+    STAGE_TIMINGS.enable()
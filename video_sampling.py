@@ -0,0 +1,140 @@
+"""
+動画のキーフレームサンプリング
+
+動画の投稿を画像と同じセーフティ判定に通すため、動画全体から数枚のフレームだけを
+取り出す。キーフレーム (I フレーム) 以外はデコードせずに読み飛ばし、動画の長さを
+等分した位置へシークしてその直前のキーフレームを1枚ずつデコードする。
+1本あたりの時間予算を超えたら、それまでに取り出せたフレームだけを返す。
+デコーダーは PyAV (FFmpeg のライブラリを同梱) を使う。
+壊れた動画や、開くだけで時間がかかる巨大な動画は判定不能 (None) として扱い、
+同じバッチの他の投稿の判定は止めない。
+"""
+import io
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from image_hydration import DEFAULT_MAX_WORKERS, DEFAULT_SIZE, read_image_bytes
+from lazy_import import LazyModule
+
+av = LazyModule("av")
+
+DEFAULT_MAX_FRAMES = 4
+DEFAULT_TIME_BUDGET_S = float(os.environ.get("XSCORER_VIDEO_TIME_BUDGET_S", 2.0))
+# 時間予算はフレームの間でしか確認できない (ファイルを開く・シーク・1枚のデコードは途中で止められない) ので、
+# 呼び出し側はこの秒数を足した時間まで待って打ち切る
+DEFAULT_TIMEOUT_GRACE_S = 1.0
+
+def _open(item):
+    if isinstance(item, (str, os.PathLike)):
+        return av.open(os.fspath(item))
+    return av.open(io.BytesIO(read_image_bytes(item)))
+
+def _duration_seconds(container, stream):
+    if stream.duration and stream.time_base:
+        return float(stream.duration * stream.time_base)
+    if container.duration:
+        return container.duration / av.time_base
+    return None
+
+def _to_image(frame, size):
+    # 短辺が size になるよう、RGB への変換と同時に縮小する (拡大はしない)
+    scale = size / min(frame.width, frame.height) if size else 1
+    if scale >= 1:
+        return frame.to_image()
+    return frame.to_image(width=math.ceil(frame.width * scale), height=math.ceil(frame.height * scale))
+
+def sample_keyframes(item, max_frames=DEFAULT_MAX_FRAMES, time_budget_s=DEFAULT_TIME_BUDGET_S,
+                     size=DEFAULT_SIZE):
+    """
+    動画 (パス / ファイルオブジェクト) から最大 max_frames 枚のキーフレームを PIL.Image で返す
+    time_budget_s を超えた場合は、それまでに取り出したフレームだけを返す
+    """
+    deadline = time.perf_counter() + time_budget_s
+    frames = []
+    with _open(item) as container:
+        if not container.streams.video:
+            return frames
+        stream = container.streams.video[0]
+        # キーフレーム以外はデコーダーに渡さない
+        stream.codec_context.skip_frame = "NONKEY"
+
+        duration = _duration_seconds(container, stream)
+        if not duration or not stream.time_base:
+            # 長さが分からない (シークできない) 場合は先頭から順にキーフレームを拾う
+            for frame in container.decode(stream):
+                frames.append(_to_image(frame, size))
+                if len(frames) >= max_frames or time.perf_counter() > deadline:
+                    break
+            return frames
+
+        start = stream.start_time or 0
+        seen = set()
+        for i in range(max_frames):
+            if time.perf_counter() > deadline:
+                break
+            # 各区間の中央へシークし、その直前のキーフレームをデコードする
+            target = duration * (i + 0.5) / max_frames
+            container.seek(start + int(target / stream.time_base), stream=stream, backward=True)
+            frame = next(container.decode(stream), None)
+            if frame is None or frame.pts in seen:
+                # キーフレームの間隔が区間より長いと同じフレームに戻ってくる
+                continue
+            seen.add(frame.pts)
+            frames.append(_to_image(frame, size))
+    return frames
+
+def sample_keyframes_or_none(item, max_frames=DEFAULT_MAX_FRAMES, time_budget_s=DEFAULT_TIME_BUDGET_S,
+                             size=DEFAULT_SIZE):
+    """
+    sample_keyframes と同じだが、読めない・壊れた動画では例外を送出せずに None を返す
+    """
+    try:
+        return sample_keyframes(item, max_frames, time_budget_s, size)
+    except (OSError, ValueError, EOFError):
+        return None
+    except av.error.FFmpegError:
+        # ここで初めて av を参照する (上の except で済む場合は import しない)
+        return None
+
+class KeyframeSampler:
+    """
+    複数の動画のキーフレームサンプリングをスレッドプールで並行して行う
+    (PyAV はデコード中に GIL を解放する)
+    timeout_s: 1本あたりの待ち時間の上限 (省略時は time_budget_s + DEFAULT_TIMEOUT_GRACE_S)
+    """
+
+    def __init__(self, max_frames=DEFAULT_MAX_FRAMES, time_budget_s=DEFAULT_TIME_BUDGET_S,
+                 size=DEFAULT_SIZE, max_workers=None, timeout_s=None):
+        self.max_frames = max_frames
+        self.time_budget_s = time_budget_s
+        self.size = size
+        self.max_workers = max_workers or DEFAULT_MAX_WORKERS
+        self.timeout_s = timeout_s if timeout_s is not None else time_budget_s + DEFAULT_TIMEOUT_GRACE_S
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="keyframe-sampler")
+
+    def sample(self, videos):
+        """
+        動画ごとのフレームのリストを、入力と同じ順序のリストで返す
+        読めなかった動画と、待ち時間の上限までに終わらなかった動画は None になる
+        """
+        videos = list(videos)
+        futures = [self._executor.submit(sample_keyframes_or_none, video, self.max_frames,
+                                         self.time_budget_s, self.size) for video in videos]
+        # スレッド数ぶんずつ並行して処理するので、全体の期限は1本あたりの上限 x 巡回数
+        rounds = math.ceil(len(videos) / self.max_workers)
+        deadline = time.perf_counter() + self.timeout_s * rounds
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(timeout=max(0.0, deadline - time.perf_counter())))
+            except FutureTimeoutError:
+                # 実行中のデコードは止められないので、結果を待たずに諦める (未開始なら取り消す)
+                future.cancel()
+                results.append(None)
+        return results
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
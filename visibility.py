@@ -0,0 +1,272 @@
+"""
+STAGE 4 の画像セーフティ判定 (CLIP ゼロショット分類)
+
+ローカルディレクトリに保存した CLIP モデルを CPU で動かし、画像ごとに
+「安全」「NSFW・暴力」のプロンプトとの類似度から unsafe スコア (0〜1) を出す。
+複数の投稿の画像をまとめて1回の forward で処理する。
+動画はキーフレームを数枚取り出し (video_sampling 参照)、画像と同じバッチに入れる。
+torch / transformers / Pillow は分類器を初めて使うときまで import しない。
+画像エンコーダーは fp32 / int8 / onnx のバリアントを選べる (model_variants 参照)。
+XSCORER_EMBEDDING_CACHE_DIR を指定すると、画像の内容ハッシュをキーに埋め込みと
+スコアをディスクにキャッシュし、同じ画像はモデルに通さない (embedding_cache 参照)。
+"""
+import os
+import threading
+import weakref
+from itertools import islice
+
+import numpy as np
+
+from embedding_cache import CACHE_DIR, CACHE_ITEMS, EmbeddingCache, content_key
+from image_hydration import DEFAULT_SIZE, ImageHydrator, image_errors, read_image_bytes
+from lazy_import import LazyModule
+from microbatch import DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT_MS, MicroBatcher
+from model_registry import REGISTRY, estimate_model_bytes, model_key
+from model_variants import OnnxRunner, export_onnx, quantize_dynamic_int8, resolve_variant, weights_fingerprint
+from video_sampling import KeyframeSampler
+
+torch = LazyModule("torch")
+transformers = LazyModule("transformers")
+PIL_Image = LazyModule("PIL.Image")
+
+SAFE_PROMPTS = (
+    "a safe for work photo",
+    "an ordinary everyday photo",
+    "a screenshot or illustration",
+)
+UNSAFE_PROMPTS = (
+    "a nsfw photo with nudity",
+    "a sexually explicit photo",
+    "a photo of graphic violence or gore",
+)
+
+DEFAULT_BATCH_SIZE = 32
+
+def image_content(item):
+    """
+    キャッシュキー用の画像の内容 (PIL.Image は画素データ、それ以外はファイルのバイト列)
+    """
+    if isinstance(item, PIL_Image.Image):
+        return f"{item.mode}:{item.size[0]}x{item.size[1]}:".encode("ascii") + item.tobytes()
+    return read_image_bytes(item)
+
+def _content_key_or_none(item, model_version):
+    # ファイルが読めない画像はキャッシュしない (デコードもできないので NaN になる)
+    try:
+        return content_key(image_content(item), model_version)
+    except image_errors():
+        return None
+
+def _release_resources(hydrator, keyframe_sampler, cache):
+    # GC の途中でプールのスレッドから呼ばれることもあるので、スレッドの終了は待たない
+    hydrator.close(wait=False)
+    keyframe_sampler.close(wait=False)
+    if cache is not None:
+        cache.close()
+
+def _clip_image_encoder(model):
+    """
+    pixel_values -> image_embeds だけを行う nn.Module (ONNX 書き出し用)
+    """
+    class ClipImageEncoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            return self.model.get_image_features(pixel_values=pixel_values)
+
+    return ClipImageEncoder().eval()
+
+class ClipSafetyClassifier:
+    """
+    model_dir: CLIPModel / CLIPProcessor を save_pretrained したディレクトリ
+    (ネットワークには接続せず、ローカルのファイルだけを読む)
+    variant: fp32 / int8 / onnx (省略時は XSCORER_MODEL_VARIANT)
+    onnx_path: onnx バリアントの書き出し先 (省略時は model_dir/onnx/image_encoder.onnx。実際のファイル名には重みのハッシュが付く)
+    cache_dir: 埋め込みキャッシュの保存先 (省略時は XSCORER_EMBEDDING_CACHE_DIR、未設定なら使わない)
+    """
+
+    def __init__(self, model_dir, safe_prompts=SAFE_PROMPTS, unsafe_prompts=UNSAFE_PROMPTS,
+                 batch_size=DEFAULT_BATCH_SIZE, num_threads=None, variant=None, onnx_path=None,
+                 cache_dir=CACHE_DIR, cache_items=CACHE_ITEMS):
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+        self.variant = resolve_variant(variant)
+        self.processor = transformers.CLIPProcessor.from_pretrained(model_dir, local_files_only=True)
+        self.model = transformers.CLIPModel.from_pretrained(model_dir, local_files_only=True).eval()
+        self._num_safe = len(safe_prompts)
+        # 画像は前処理で使う短辺サイズまで縮小しながらデコードする
+        size = getattr(self.processor.image_processor, "size", None)
+        if isinstance(size, dict):
+            size = size.get("shortest_edge")
+        self.hydrator = ImageHydrator(size=size or DEFAULT_SIZE, max_workers=num_threads)
+        self.keyframe_sampler = KeyframeSampler(size=size or DEFAULT_SIZE, max_workers=num_threads)
+
+        # プロンプト側の埋め込みは固定なので最初に1回だけ計算する
+        with torch.inference_mode():
+            text_inputs = self.processor(text=list(safe_prompts) + list(unsafe_prompts),
+                                         return_tensors="pt", padding=True)
+            text_embeds = self.model.get_text_features(**text_inputs)
+        self._text_embeds = torch.nn.functional.normalize(text_embeds, dim=-1)
+        self._logit_scale = self.model.logit_scale.exp().item()
+
+        # キャッシュのキーにはバリアント変換前の重みのハッシュを使う (同じディレクトリ名でも重みが違えば別エントリ)
+        weights = weights_fingerprint(self.model) if cache_dir else None
+
+        # 画像エンコーダーのバリアント
+        self._onnx = None
+        if self.variant == "int8":
+            self.model = quantize_dynamic_int8(self.model)
+        elif self.variant == "onnx":
+            size = self.processor.image_processor.crop_size
+            example = torch.zeros(1, 3, size["height"], size["width"])
+            onnx_path = onnx_path or os.path.join(model_dir, "onnx", "image_encoder.onnx")
+            onnx_path = export_onnx(_clip_image_encoder(self.model), (example,), onnx_path,
+                                    input_names=("pixel_values",), output_names=("image_embeds",),
+                                    dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}})
+            self._onnx = OnnxRunner(onnx_path, num_threads=num_threads)
+            # テキスト側の埋め込みは計算済みなので torch のモデルは保持しない
+            self.model = None
+
+        # キャッシュのキーには重み・バリアント・プロンプトを含める (どれかが変われば別エントリ)
+        self.cache = None
+        self.model_version = "|".join((f"{weights}-{self.variant}",) + tuple(safe_prompts) + ("",)
+                                      + tuple(unsafe_prompts))
+        if cache_dir:
+            self.cache = EmbeddingCache(os.path.join(cache_dir, "clip-safety"),
+                                        dim=self._text_embeds.shape[-1], capacity=cache_items)
+        # ModelRegistry から解放されても使用中の呼び出し元がいるので、最後の参照が無くなったときに閉じる
+        self._finalizer = weakref.finalize(self, _release_resources, self.hydrator, self.keyframe_sampler,
+                                           self.cache)
+
+    @property
+    def name(self):
+        return f"{os.path.basename(os.path.normpath(self.model_dir))}-{self.variant}"
+
+    def memory_bytes(self):
+        if self._onnx is not None:
+            return self._onnx.memory_bytes()
+        return estimate_model_bytes(self.model)
+
+    def close(self):
+        """
+        デコード用のスレッドプールとキャッシュを閉じる (閉じた後は使えない)
+        呼ばなくても、最後の参照が無くなったときに閉じられる
+        """
+        self._finalizer()
+        self.cache = None
+
+    def _encode_images(self, pixel_values):
+        if self._onnx is not None:
+            (image_embeds,) = self._onnx.run(pixel_values=pixel_values.numpy())
+            return torch.from_numpy(image_embeds)
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+    def unsafe_scores(self, images):
+        """
+        画像 (PIL.Image / パス) のリストに対し、unsafe 側プロンプトの確率の合計を返す
+        読めない・壊れた画像は NaN にする
+        キャッシュ済みの画像はデコードもモデルの実行もしない
+        """
+        scores = np.full(len(images), np.nan, dtype=np.float32)
+        pending = list(range(len(images)))
+        keys = None
+        if self.cache is not None:
+            keys = [_content_key_or_none(image, self.model_version) for image in images]
+            cached = self.cache.get_many([key for key in keys if key is not None])
+            pending = []
+            for i, key in enumerate(keys):
+                if key is None:
+                    continue
+                if key in cached:
+                    scores[i] = cached[key][1]
+                else:
+                    pending.append(i)
+
+        # 次のバッチの画像のデコードは、推論中もスレッドプールで進む
+        hydrated = self.hydrator.iter_hydrate(images[i] for i in pending)
+        for start in range(0, len(pending), self.batch_size):
+            indices = pending[start:start + self.batch_size]
+            batch = list(islice(hydrated, len(indices)))
+            # デコードできなかった画像は NaN のまま残す
+            indices = [i for i, image in zip(indices, batch) if image is not None]
+            batch = [image for image in batch if image is not None]
+            if not batch:
+                continue
+            with torch.inference_mode():
+                pixel_values = self.processor(images=batch, return_tensors="pt")["pixel_values"]
+                image_embeds = self._encode_images(pixel_values)
+                image_embeds = torch.nn.functional.normalize(image_embeds, dim=-1)
+                probs = (self._logit_scale * image_embeds @ self._text_embeds.T).softmax(dim=-1)
+            batch_scores = probs[:, self._num_safe:].sum(dim=-1).numpy()
+            scores[indices] = batch_scores
+            if self.cache is not None:
+                self.cache.put_many((keys[i], embeds, float(score)) for i, embeds, score
+                                    in zip(indices, image_embeds.numpy(), batch_scores))
+        return scores
+
+    def score_posts(self, posts):
+        """
+        投稿ごとの unsafe スコア (画像・動画のフレームのうち最大値) を返す
+        画像なしの投稿と、読める画像・フレームが1枚もない投稿は None
+        全投稿の画像と動画のキーフレームを1つのリストにまとめてからバッチ推論する
+        """
+        images, owners = [], []
+        videos, video_owners = [], []
+        for index, post in enumerate(posts):
+            for image in post.images:
+                images.append(image)
+                owners.append(index)
+            for video in post.videos:
+                videos.append(video)
+                video_owners.append(index)
+        if videos:
+            for index, frames in zip(video_owners, self.keyframe_sampler.sample(videos)):
+                # 読めなかった動画 (None) はフレームなしとして扱う
+                frames = frames or ()
+                images.extend(frames)
+                owners.extend([index] * len(frames))
+
+        results = [None] * len(posts)
+        if not images:
+            return results
+        for index, score in zip(owners, self.unsafe_scores(images)):
+            score = float(score)
+            if np.isnan(score):
+                continue
+            if results[index] is None or score > results[index]:
+                results[index] = score
+        return results
+
+def get_clip_classifier(model_dir, variant=None, **kwargs):
+    """
+    プロセス共通の ModelRegistry から分類器を取得する (プロセスごとに1回だけロード)
+    variant と kwargs (num_threads など) の組み合わせごとに別のモデルとしてロードする
+    """
+    variant = resolve_variant(variant)
+    return REGISTRY.get(model_key("clip-safety", model_dir, variant, **kwargs),
+                        lambda: ClipSafetyClassifier(model_dir, variant=variant, **kwargs))
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+def get_clip_batcher(model_dir, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                     variant=None):
+    """
+    1件ずつ届く投稿のセーフティ判定をまとめて推論する、プロセス共通の MicroBatcher
+    batcher(post) で その投稿の unsafe スコア (画像なしは None) が返る
+    モデルはバッチごとにレジストリから取得するので、解放された場合も再ロードされる
+    variant: モデルのバリアント (省略時は XSCORER_MODEL_VARIANT)。バリアントごとに別の MicroBatcher になる
+    """
+    variant = resolve_variant(variant)
+    key = (variant, os.path.abspath(model_dir))
+    with _batchers_lock:
+        batcher = _batchers.get(key)
+        if batcher is None:
+            batcher = _batchers[key] = MicroBatcher(
+                lambda posts: get_clip_classifier(model_dir, variant).score_posts(posts),
+                max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, name="clip-safety-batcher")
+        return batcher